@@ -0,0 +1,93 @@
+# py6502: run many independent programs in parallel.
+#
+# Each Job is executed on a fresh CPU in a pool of worker processes.
+# Images are copied once into shared memory, so jobs that use the same
+# ROM don't pickle it again, and results are yielded as jobs finish.
+# Every process keeps its CPUs in a pool, and reuses them from job to job.
+
+# pylint: disable=C0103
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+from cpu import CPU
+from pool import CPUPool
+
+# image:         bytes-like object loaded at load_address.
+# reset_vector:  if not None, stored at 0xFFFC/0xFFFD before reset_CPU().
+# max_cycles:    how many ticks the job may run for.
+# outputs:       (start, end) RAM ranges returned in the Result.
+Job = namedtuple('Job', 'image load_address reset_vector max_cycles outputs',
+                 defaults=(None, 100_000, ()))
+
+# error is None, or a description of why the job stopped early.
+Result = namedtuple('Result', 'index instructions ticks PC outputs error')
+
+_pools = {}  # CPU class -> CPUPool, in this process.
+
+def run_job(index, job, image=None, cpu_class=CPU):
+    """ Run a single job on an as good as new CPU, in this process. """
+    pool = _pools.get(cpu_class)
+    if pool is None:
+        pool = _pools[cpu_class] = CPUPool(cpu_class)
+
+    with pool.cpu() as cpu:
+        instructions, error = 0, None
+        try:
+            cpu.load(job.load_address, job.image if image is None else image)
+            if job.reset_vector is not None:
+                cpu.write_RAM(0xFFFC, job.reset_vector & 0xFF)
+                cpu.write_RAM(0xFFFD, job.reset_vector >> 8)
+                cpu.reset_CPU()
+            instructions, _ = cpu.run(max_cycles=job.max_cycles)
+        except NotImplementedError as exception:
+            error = str(exception)
+        except Exception as exception:  # pylint: disable=W0703
+            # One broken job mustn't take the whole batch down with it.
+            error = f"{exception.__class__.__name__}: {exception}"
+
+        outputs = [cpu.dump(start, end) for start, end in job.outputs]
+        return Result(index, instructions, cpu.ticks, cpu.PC, outputs, error)
+
+## In the worker processes.
+_attached = {}  # Shared memory name -> SharedMemory
+
+def _run_shared_job(index, job, image_name, image_size, cpu_class):
+    image = _attached.get(image_name)
+    if image is None:
+        # Pool workers share the parent's resource tracker, which
+        # forgets the block once the parent unlinks it.
+        image = _attached[image_name] = shared_memory.SharedMemory(image_name)
+    return run_job(index, job, image.buf[:image_size], cpu_class)
+
+def run_batch(jobs, workers=None, cpu_class=CPU):
+    """ Run the jobs in a pool of `workers` processes (by default, one
+    per core). Yields a Result for each job, in the order they finish. """
+    jobs = list(jobs)
+    images = {}  # Image contents -> SharedMemory
+    try:
+        shared_jobs = []
+        for job in jobs:
+            image = bytes(job.image)
+            if image not in images:
+                block = shared_memory.SharedMemory(create=True, size=max(len(image), 1))
+                block.buf[:len(image)] = image
+                images[image] = block
+            shared_jobs.append((job._replace(image=b''), images[image].name, len(image)))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_run_shared_job, index, job, image_name, image_size, cpu_class): index
+                       for index, (job, image_name, image_size) in enumerate(shared_jobs)}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as exception:  # pylint: disable=W0703
+                    # The job couldn't even run (e.g. its worker died).
+                    result = Result(futures[future], 0, 0, None, [],
+                                    f"{exception.__class__.__name__}: {exception}")
+                yield result
+    finally:
+        for block in images.values():
+            block.close()
+            block.unlink()
@@ -0,0 +1,191 @@
+# py6502: benchmarks.
+#
+# Runs a set of standard workloads on the CPU class, reports how many
+# instructions (and emulated cycles, from `ticks`) per second it gets
+# through, and optionally fails if that's much worse than a baseline.
+#
+#   python benchmark.py --output results.json
+#   python benchmark.py --baseline baseline.json --threshold 0.1
+#
+# Workloads that need opcodes which aren't implemented yet are
+# reported as skipped, and start counting once they are.
+
+# pylint: disable=C0103
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from cpu import CPU
+
+class Workload():
+    """ A 6502 program, loaded at load_address (by default, start), and
+    run `repeat` times from start until PC reaches end. """
+    def __init__(self, name, program, start, end, repeat, load_address=None, setup=None):
+        self.name = name
+        self.program = bytes(program)
+        self.start, self.end = start, end
+        self.load_address = start if load_address is None else load_address
+        self.repeat = repeat
+        self.setup = setup  # Called with the CPU, after loading the program.
+
+    def missing_opcodes(self, cpu):
+        """ The opcodes in the program that the CPU can't execute. Only
+        meaningful for programs that are all code, with no data. """
+        if self.load_address != self.start:
+            return set()
+        missing, address = set(), 0
+        while address < len(self.program):
+            opcode = self.program[address]
+            if cpu.decode_table[opcode][0] is None:
+                missing.add(opcode)
+            address += cpu.find_instruction_length(opcode)
+        return missing
+
+    def run(self, cpu, scale):
+        cpu.load(self.load_address, self.program)
+        if self.setup is not None:
+            self.setup(cpu)
+        instructions = ticks = 0
+        begin = time.perf_counter()
+        for _ in range(max(1, int(self.repeat * scale))):
+            cpu.PC = self.start
+            executed, spent = cpu.run(until_pc=self.end, max_cycles=100_000_000)
+            instructions += executed
+            ticks += spent
+        return instructions, ticks, time.perf_counter() - begin
+
+def _reset_stack(cpu):
+    cpu.SP = 0xFD
+
+# Straight-line code with no loops: mostly fetch/decode/dispatch.
+STRAIGHT_LINE = Workload('straight_line', [0xEA, 0x18, 0xD8, 0xB8] * 64,
+                         0x0200, 0x0300, 1000)
+
+# LDX #0 / loop: DEX / BNE loop: 256 iterations of a 2-instruction loop.
+TIGHT_LOOP = Workload('tight_loop', [0xA2, 0x00, 0xCA, 0xD0, 0xFD],
+                      0x0200, 0x0205, 500)
+
+# 64 x JSR $0300, where $0300 is an RTS.
+JSR_RTS = Workload('jsr_rts', [0x20, 0x00, 0x03] * 64 + [0xEA] * (0x100 - 3 * 64) + [0x60],
+                   0x0200, 0x02C0, 1000, setup=_reset_stack)
+
+# Copy 256 bytes from $1000 to $2000:
+# LDX #0 / loop: LDA $1000,X / STA $2000,X / INX / BNE loop
+MEMCPY = Workload('memcpy', [0xA2, 0x00, 0xBD, 0x00, 0x10, 0x9D, 0x00, 0x20, 0xE8, 0xD0, 0xF7],
+                  0x0200, 0x020B, 200)
+
+WORKLOADS = [STRAIGHT_LINE, TIGHT_LOOP, JSR_RTS, MEMCPY]
+
+# Klaus Dormann's 6502_functional_test.bin: loaded at 0x0000, started
+# at 0x0400, and it traps (JMP *) at 0x3469 when every test passed.
+FUNCTIONAL_TEST_START, FUNCTIONAL_TEST_SUCCESS = 0x0400, 0x3469
+
+def functional_test_workload(path):
+    with open(path, 'rb') as rom:
+        image = rom.read()
+    return Workload('functional_test', image, FUNCTIONAL_TEST_START, FUNCTIONAL_TEST_SUCCESS, 1,
+                    load_address=0x0000)
+
+def _result(operations, ticks, seconds):
+    seconds = max(seconds, 1e-9)
+    return {'instructions': operations, 'ticks': ticks, 'seconds': seconds,
+            'instructions_per_second': operations / seconds,
+            'cycles_per_second': ticks / seconds}
+
+def benchmark_decode(cpu, scale):
+    """ decode_instruction() for every opcode. """
+    rounds = max(1, int(2000 * scale))
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        for opcode in range(0x100):
+            cpu.decode_instruction(opcode)
+    return _result(rounds * 0x100, 0, time.perf_counter() - begin)
+
+def benchmark_RAM(cpu, scale):
+    """ write_RAM() then read_RAM() over the whole address space. """
+    rounds = max(1, int(5 * scale))
+    write_RAM, read_RAM = cpu.write_RAM, cpu.read_RAM
+    begin = time.perf_counter()
+    for _ in range(rounds):
+        for address in range(len(cpu.RAM)):
+            write_RAM(address, address)
+            read_RAM(address)
+    return _result(rounds * 2 * len(cpu.RAM), 0, time.perf_counter() - begin)
+
+def run_suite(cpu_class=CPU, scale=1.0, rom=None):
+    """ Run every workload on a fresh CPU. Returns the results as a dict. """
+    results = {'python': platform.python_version(),
+               'cpu_class': cpu_class.__name__, 'workloads': {}}
+    workloads = results['workloads']
+    workloads['decode'] = benchmark_decode(cpu_class(), scale)
+    workloads['RAM'] = benchmark_RAM(cpu_class(), scale)
+
+    programs = WORKLOADS + ([functional_test_workload(rom)] if rom else [])
+    for workload in programs:
+        cpu = cpu_class()
+        missing = workload.missing_opcodes(cpu)
+        if missing:
+            names = ", ".join(f"0x{opcode:02X}" for opcode in sorted(missing))
+            workloads[workload.name] = {'skipped': f"unimplemented opcodes: {names}"}
+            continue
+        try:
+            workloads[workload.name] = _result(*workload.run(cpu, scale))
+        except NotImplementedError as exception:
+            workloads[workload.name] = {'skipped': str(exception)}
+    return results
+
+def compare_to_baseline(results, baseline, threshold=0.1):
+    """ The workloads that are more than `threshold` (a fraction)
+    slower than in the baseline, as (name, baseline, current) tuples. """
+    regressions = []
+    for name, old in baseline['workloads'].items():
+        new = results['workloads'].get(name, {})
+        if 'instructions_per_second' not in old or 'instructions_per_second' not in new:
+            continue
+        if new['instructions_per_second'] < old['instructions_per_second'] * (1 - threshold):
+            regressions.append((name, old['instructions_per_second'],
+                                new['instructions_per_second']))
+    return regressions
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the 6502 emulator.")
+    parser.add_argument('--output', help="write the results (JSON) to this file")
+    parser.add_argument('--baseline', help="fail if slower than these results (JSON)")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="how much slower than the baseline is a failure (default: 0.1)")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply the work done")
+    parser.add_argument('--rom', help="path to 6502_functional_test.bin")
+    parser.add_argument('--jit', action='store_true', help="use the translating CPU")
+    options = parser.parse_args(arguments)
+
+    cpu_class = CPU
+    if options.jit:
+        from jit import TranslatingCPU  # pylint: disable=C0415
+        cpu_class = TranslatingCPU
+
+    results = run_suite(cpu_class, options.scale, options.rom)
+    for name, result in results['workloads'].items():
+        if 'skipped' in result:
+            print(f"{name:>16}: skipped ({result['skipped']})")
+        else:
+            print(f"{name:>16}: {result['instructions_per_second']:>14,.0f} instructions/s"
+                  f" {result['cycles_per_second']:>14,.0f} cycles/s")
+
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+
+    if options.baseline:
+        with open(options.baseline, encoding='utf-8') as baseline:
+            regressions = compare_to_baseline(results, json.load(baseline), options.threshold)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old:,.0f} -> {new:,.0f} instructions/s")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+# py6502: memory-mapped devices.
+#
+# A CPU sends the reads and writes of each 256-byte page either straight
+# to its RAM or to a device (see CPU.map_device()). A device is any
+# object with read(address) and write(address, value) methods, which
+# are given the full 16-bit address.
+
+# pylint: disable=C0103
+
+class Device():
+    """ A device that does nothing: reads return 0, writes are ignored. """
+    def read(self, address):
+        return 0x00
+
+    def write(self, address, value):
+        pass
+
+class ReadOnly(Device):
+    """ The write side of ROM pages. (Their reads go straight to RAM.) """
+
+READ_ONLY = ReadOnly()
+
+class Mirror(Device):
+    """ Makes pages mirror another part of the address space: address
+    is accessed as base | (address & mask). E.g. Mirror(cpu, 0x07FF)
+    mapped to pages 0x08-0x1F repeats 0x0000-0x07FF three more times. """
+    def __init__(self, cpu, mask, base=0x0000):
+        self.cpu, self.mask, self.base = cpu, mask, base
+
+    def read(self, address):
+        return self.cpu.read_RAM(self.base | (address & self.mask))
+
+    def write(self, address, value):
+        self.cpu.write_RAM(self.base | (address & self.mask), value)
+
+class BankedROM(Device):
+    """ Several ROM banks sharing the same window of the address space,
+    starting at base. Switching banks doesn't copy anything. Like the
+    simplest cartridge mappers, writing anywhere in the window selects
+    the bank. """
+    def __init__(self, banks, base):
+        self.banks = [memoryview(bytes(bank)) for bank in banks]
+        self.base = base
+        self.select(0)
+
+    def select(self, bank):
+        self.bank_number = bank % len(self.banks)
+        self.bank = self.banks[self.bank_number]
+
+    def read(self, address):
+        return self.bank[address - self.base]
+
+    def write(self, address, value):
+        self.select(value)
+
+    def pages(self):
+        """ The (first, last) pages to map this device to. """
+        return (self.base >> 8, (self.base + len(self.banks[0]) - 1) >> 8)
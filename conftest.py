@@ -0,0 +1,23 @@
+# pylint: disable=C0103,E0401
+
+import pytest
+import cpu
+
+@pytest.fixture
+def make_CPU():
+    """ Builds CPUs for the tests: NOPs from 0x0200 to end, with code
+    ({address: bytes}) loaded over them, the NMI, reset and IRQ/BRK
+    vectors pointing at 0x0400, 0x0200 and 0x0300 (NOPs too, with the
+    default end), reset, and with PC at 0x0200. Then registers (e.g.
+    A=0x01, STATUS=...) are set. """
+    def make(cls=cpu.CPU, end=0x0500, code=None, **registers):
+        cpu_under_test = cls()
+        cpu_under_test.fill(0x0200, end, 0xEA)
+        for address, data in (code or {}).items():
+            cpu_under_test.load(address, data)
+        cpu_under_test.load(0xFFFA, bytes([0x00, 0x04, 0x00, 0x02, 0x00, 0x03]))
+        cpu_under_test.reset_CPU()
+        for register, value in registers.items():
+            setattr(cpu_under_test, register, value)
+        return cpu_under_test
+    return make
@@ -4,7 +4,13 @@
 # sô we're making pylint shut up about snake_case.
 # pylint: disable=C0103
 
+from copy import copy
 from enum import Enum, Flag, auto
+from itertools import compress
+from math import inf
+from types import MethodType
+
+from bus import READ_ONLY
 
 class StatusRegister(Flag):
     """ The possible values for the CPU's status register. """
@@ -18,6 +24,10 @@ class StatusRegister(Flag):
     CARRY      = 0x01
     NOTHING    = 0x00
 
+# The same flags, as plain ints, for the hot path.
+FLAG_SIGN, FLAG_OVERFLOW, FLAG_UNUSED, FLAG_BREAK = 0x80, 0x40, 0x20, 0x10
+FLAG_DECIMAL, FLAG_INTERRUPT, FLAG_ZERO, FLAG_CARRY = 0x08, 0x04, 0x02, 0x01
+
 class AddressingModes(Enum):
     """ The possible addressing modes. """
     IMPLIED = auto()
@@ -34,30 +44,486 @@ class AddressingModes(Enum):
     INDIRECT_X = auto()
     INDIRECT_Y = auto()
 
+# Opcodes grouped by addressing mode. Anything not listed here uses
+# implied addressing (the default, and most common, mode).
+ADDRESSING_MODE_OPCODES = {
+    AddressingModes.ABSOLUTE: (
+        0x0C, 0x0D, 0x0E, 0x0F, 0x20, 0x2C, 0x2D, 0x2E,
+        0x2F, 0x4C, 0x4D, 0x4E, 0x4F, 0x6D, 0x6E, 0x6F,
+        0x8C, 0x8D, 0x8E, 0x8F, 0xAC, 0xAD, 0xAE, 0xAF,
+        0xCC, 0xCD, 0xCE, 0xCF, 0xEC, 0xED, 0xEE, 0xEF),
+    AddressingModes.ABSOLUTE_X: (
+        0x1C, 0x1D, 0x1E, 0x1F, 0x3C, 0x3D, 0x3E, 0x3F,
+        0x5C, 0x5D, 0x5E, 0x5F, 0x7C, 0x7D, 0x7E, 0x7F,
+        0x9C, 0x9D, 0xBC, 0xBD, 0xDC, 0xDD, 0xDE, 0xDF,
+        0xFC, 0xFD, 0xFE, 0xFF),
+    AddressingModes.ABSOLUTE_Y: (
+        0x19, 0x1B, 0x39, 0x3B, 0x59, 0x5B, 0x79, 0x7B,
+        0x99, 0x9B, 0x9E, 0x9F, 0xB9, 0xBB, 0xBE, 0xBF,
+        0xD9, 0xDB, 0xF9, 0xFB),
+    AddressingModes.ACCUMULATOR: (0x0A, 0x2A, 0x4A, 0x6A),
+    AddressingModes.IMMEDIATE: (
+        0x09, 0x0B, 0x29, 0x2B, 0x49, 0x4B, 0x69, 0x6B,
+        0x80, 0x82, 0x89, 0x8B, 0xA0, 0xA2, 0xA9, 0xAB,
+        0xC0, 0xC2, 0xC9, 0xCB, 0xE0, 0xE2, 0xE9, 0xEB),
+    AddressingModes.INDIRECT: (0x6C,),
+    AddressingModes.INDIRECT_X: (
+        0x01, 0x03, 0x21, 0x23, 0x41, 0x43, 0x61, 0x63,
+        0x81, 0x83, 0xA1, 0xA3, 0xC1, 0xC3, 0xE1, 0xE3),
+    AddressingModes.INDIRECT_Y: (
+        0x11, 0x13, 0x31, 0x33, 0x51, 0x53, 0x71, 0x73,
+        0x91, 0x93, 0xB1, 0xB3, 0xD1, 0xD3, 0xF1, 0xF3),
+    AddressingModes.RELATIVE: (0x10, 0x30, 0x50, 0x70, 0x90, 0xB0, 0xD0, 0xF0),
+    AddressingModes.ZERO_PAGE: (
+        0x04, 0x05, 0x06, 0x07, 0x24, 0x25, 0x26, 0x27,
+        0x44, 0x45, 0x46, 0x47, 0x64, 0x65, 0x66, 0x67,
+        0x84, 0x85, 0x86, 0x87, 0xA4, 0xA5, 0xA6, 0xA7,
+        0xC4, 0xC5, 0xC6, 0xC7, 0xE4, 0xE5, 0xE6, 0xE7),
+    AddressingModes.ZERO_PAGE_X: (
+        0x14, 0x15, 0x16, 0x17, 0x34, 0x35, 0x36, 0x37,
+        0x54, 0x55, 0x56, 0x57, 0x74, 0x75, 0x76, 0x77,
+        0x94, 0x95, 0xB4, 0xB5, 0xD4, 0xD5, 0xD6, 0xD7,
+        0xF4, 0xF5, 0xF6, 0xF7),
+    AddressingModes.ZERO_PAGE_Y: (0x96, 0x97, 0xB6, 0xB7),
+}
+
+# Opcodes grouped by how many ticks they cost. Anything not
+# listed here costs 2 ticks (again, the most common).
+INSTRUCTION_COST_OPCODES = {
+    3: (0x04, 0x05, 0x08, 0x24, 0x25,
+        0x44, 0x45, 0x48, 0x4C, 0x64,
+        0x65, 0x84, 0x85, 0x86, 0x87,
+        0xA4, 0xA5, 0xA6, 0xA7, 0xC4,
+        0xC5, 0xE4, 0xE5),
+    4: (0x0C, 0x0D,
+        0x14, 0x15, 0x19, 0x1C, 0x1D, 0x28, 0x2C, 0x2D,
+        0x34, 0x35, 0x39, 0x3C, 0x3D, 0x4D, 0x54, 0x55,
+        0x59, 0x5C, 0x5D, 0x68, 0x6D, 0x74, 0x75, 0x79,
+        0x7C, 0x7D, 0x8C, 0x8D, 0x8E, 0x8F, 0x94, 0x95,
+        0x96, 0x97, 0xAC, 0xAD, 0xAE, 0xAF, 0xB4, 0xB5,
+        0xB6, 0xB7, 0xB9, 0xBB, 0xBC, 0xBD, 0xBE, 0xBF,
+        0xCC, 0xCD, 0xD4, 0xD5, 0xD9, 0xDC, 0xDD, 0xEC,
+        0xED, 0xF4, 0xF5, 0xF9, 0xFC, 0xFD),
+    5: (0x06, 0x07, 0x11, 0x26, 0x27,
+        0x31, 0x46, 0x47, 0x51, 0x66,
+        0x67, 0x6C, 0x71, 0x99, 0x9B,
+        0x9C, 0x9D, 0x9E, 0x9F, 0xB1,
+        0xB3, 0xC6, 0xC7, 0xD1, 0xE6,
+        0xE7, 0xF1),
+    6: (0x01, 0x0E, 0x0F, 0x16, 0x17,
+        0x20, 0x21, 0x2E, 0x2F, 0x36,
+        0x37, 0x40, 0x41, 0x4E, 0x4F,
+        0x56, 0x57, 0x60, 0x61, 0x6E,
+        0x6F, 0x76, 0x77, 0x81, 0x83,
+        0x91, 0x93, 0xA1, 0xA3, 0xC1,
+        0xCE, 0xCF, 0xD6, 0xD7, 0xE1,
+        0xEE, 0xEF, 0xF6, 0xF7),
+    7: (0x00, 0x1B, 0x1E, 0x1F, 0x3B,
+        0x3E, 0x3F, 0x5B, 0x5E, 0x5F,
+        0x7B, 0x7E, 0x7F, 0xDB, 0xDE,
+        0xDF, 0xFB, 0xFE, 0xFF),
+    8: (0x03, 0x13, 0x23, 0x33, 0x43,
+        0x53, 0x63, 0x73, 0xC3, 0xD3,
+        0xE3, 0xF3),
+}
+
+# How many bytes (opcode + operand) an instruction takes, by addressing mode.
+INSTRUCTION_LENGTHS = {
+    AddressingModes.IMPLIED: 1,
+    AddressingModes.ACCUMULATOR: 1,
+    AddressingModes.IMMEDIATE: 2,
+    AddressingModes.ZERO_PAGE: 2,
+    AddressingModes.ZERO_PAGE_X: 2,
+    AddressingModes.ZERO_PAGE_Y: 2,
+    AddressingModes.RELATIVE: 2,
+    AddressingModes.ABSOLUTE: 3,
+    AddressingModes.ABSOLUTE_X: 3,
+    AddressingModes.ABSOLUTE_Y: 3,
+    AddressingModes.INDIRECT: 3,
+    AddressingModes.INDIRECT_X: 2,
+    AddressingModes.INDIRECT_Y: 2,
+}
+
+# The opcodes we can already execute, and the CPU method that does it.
+INSTRUCTION_NAMES = {
+    0x00: 'BRK',
+    0x18: 'CLC',
+    0x58: 'CLI',
+    0x80: 'NOP',
+    0xB8: 'CLV',
+    0xD8: 'CLD',
+    0xEA: 'NOP',
+    0x10: 'BPL',
+    0x30: 'BMI',
+    0x50: 'BVC',
+    0x70: 'BVS',
+    0x90: 'BCC',
+    0xB0: 'BCS',
+    0xD0: 'BNE',
+    0xF0: 'BEQ',
+}
+
+# Branches: (flag, value it must have for the branch to be taken).
+BRANCH_CONDITIONS = {
+    0x10: (0x80, 0x00),  # BPL
+    0x30: (0x80, 0x80),  # BMI
+    0x50: (0x40, 0x00),  # BVC
+    0x70: (0x40, 0x40),  # BVS
+    0x90: (0x01, 0x00),  # BCC
+    0xB0: (0x01, 0x01),  # BCS
+    0xD0: (0x02, 0x00),  # BNE
+    0xF0: (0x02, 0x02),  # BEQ
+}
+
+RTS = 0x60
+
+# Opcodes that may start an idle loop (see CPU.skip_idle_loop()). JMP *
+# and LDA / branch polling loops can join them once JMP and LDA exist.
+IDLE_LOOP_OPCODES = frozenset(BRANCH_CONDITIONS)
+
+# The same information, flattened into one entry per opcode.
+ADDRESSING_MODE_TABLE = [AddressingModes.IMPLIED] * 256
+for _mode, _opcodes in ADDRESSING_MODE_OPCODES.items():
+    for _opcode in _opcodes:
+        ADDRESSING_MODE_TABLE[_opcode] = _mode
+
+COST_TABLE = [2] * 256
+for _cost, _opcodes in INSTRUCTION_COST_OPCODES.items():
+    for _opcode in _opcodes:
+        COST_TABLE[_opcode] = _cost
+
+LENGTH_TABLE = [INSTRUCTION_LENGTHS[_mode] for _mode in ADDRESSING_MODE_TABLE]
+
+# Reads through an indexed address take one more tick when adding the
+# index carries into the high byte (crosses a page): the ones whose base
+# cost is 4 (absolute,X/Y) or 5 ((indirect),Y). Stores and
+# read-modify-writes always take the long way, so it's in their cost.
+# (Taken branches also cost more; that's up to their handlers.)
+PAGE_CROSS_PENALTY = [0] * 256
+for _opcode, _mode in enumerate(ADDRESSING_MODE_TABLE):
+    if ((_mode in (AddressingModes.ABSOLUTE_X, AddressingModes.ABSOLUTE_Y) and
+         COST_TABLE[_opcode] == 4) or
+            (_mode == AddressingModes.INDIRECT_Y and COST_TABLE[_opcode] == 5)):
+        PAGE_CROSS_PENALTY[_opcode] = 1
+
+del _mode, _cost, _opcode, _opcodes
+
+
+# Every page is plain RAM. Shared by all the CPUs without devices.
+NO_DEVICES = (None,) * 256
+# What run() fetches opcodes through when profiling: read_RAM() for
+# every page, as in step(), so that the profiler counts the fetches.
+THROUGH_READ_RAM = (True,) * 256
+
+# Blank RAM for hard_reset(), by size; made the first time it's needed.
+_zeroes = {}
+
 class CPU():
     """ The main CPU object. """
+    # Everything, besides RAM, that makes up the state of the CPU.
+    STATE = ('PC', 'SP', 'A', 'X', 'Y', 'P', 'NZ', 'ticks', 'EA', 'RA')
+
     def __init__(self, memory_size = 65536): # Inicialize a new CPU.
                                    # The default RAM size is 64 KiB.
 
+        self.RAM = bytearray(memory_size)
+        self.memory = memoryview(self.RAM)  # Zero-copy view of the RAM.
+        # One byte per 256-byte page, set when the page is written to
+        # (through write_RAM() or the bulk APIs, not self.memory).
+        # See clear_dirty_pages() and snapshot.py.
+        self.dirty_pages = bytearray((memory_size + 0xFF) >> 8)
+        self.STACK_BASE = 0x100
+        self.decode_table = self.build_decode_table()  # Shared by the whole class.
+        self.power_on()
+
+    def power_on(self):
+        """ Set everything but the RAM to how a new CPU has it. """
         self.ticks = 0 # Tick count
 
         self.PC, self.SP = 0x0000, 0x00  # Program counter, stack pointer
+        self.EA, self.RA = 0x0000, 0x0000  # Effective, relative address
         self.A, self.X, self.Y = 0x00, 0x00, 0x00 # Registers
-        self.RAM = [0x00] * memory_size
-        self.STACK_BASE = 0x100
-        self.STATUS = StatusRegister(0x00)
+        # Devices handling the reads and writes of each 256-byte page
+        # (None for plain RAM). See map_device() and bus.py.
+        self.read_pages = self.write_pages = NO_DEVICES
+        # The status register is kept as an int, P. Instructions that
+        # set N and Z just store their result in NZ, and the flags are
+        # only worked out from it when somebody reads them (read_P()).
+        self.P = 0x00
+        self.NZ = None  # None: N and Z in P are up to date.
+        self.tracer = None  # See tracing.py.
+        self.profiler = None  # See profiler.py.
+
+        # Interrupts and timed events. The run loop only compares ticks
+        # with next_event; everything else happens in service_events().
+        self.next_event = inf
+        self.scheduler = None  # See scheduler.py.
+        self.IRQ_lines = 0  # How many devices are holding IRQ low.
+        self.NMI_pending = False
+
+        # Idle loop skipping (opt-in), and how much was skipped.
+        self.idle_skip = False
+        self.idle_skips, self.idle_ticks = 0, 0
+
+        # High-level emulation hooks: None, or a list with either
+        # (function, cycles) or None for every address. See install_hook().
+        self.hooks = None
+
+        # See debugger.py. breakpoints is None, or a list with a
+        # 256-byte bitmap (or None) for every page. When something asks
+        # run() to stop after the current instruction, it sets
+        # stop_reason and next_event.
+        self.debugger = None
+        self.breakpoints = None
+        self.stop_reason = None
 
     def read_RAM(self, address):
-        return self.RAM[address]
+        device = self.read_pages[address >> 8]
+        if device is None:
+            return self.RAM[address]
+        return device.read(address)
 
     def write_RAM(self, address, value):
-        if isinstance(value, StatusRegister):
-            value = value.value  # yeah, I know. Horrible.
-            # But the BRK instruction needs this (i.e. to restore
-            # the previous state).
-
-        print(f"RAM[0x{address:02X}] <- 0x{value:04X}")
-        self.RAM[address] = value & 0xFF  # Limit to 1 byte
+        if self.tracer is not None:
+            self.tracer.memory_write(address, value)
+        self.dirty_pages[address >> 8] = 1
+        device = self.write_pages[address >> 8]
+        if device is None:
+            self.RAM[address] = value & 0xFF  # Limit to 1 byte
+        else:
+            device.write(address, value & 0xFF)
+
+    ## Memory-mapped devices.
+    def map_device(self, device, first_page, last_page=None, reads=True, writes=True):
+        """ Send the reads and/or writes to pages first_page..last_page
+        (inclusive) to device.read(address)/device.write(address, value). """
+        if last_page is None:
+            last_page = first_page
+        if self.read_pages is NO_DEVICES:
+            self.read_pages, self.write_pages = list(NO_DEVICES), list(NO_DEVICES)
+        for page in range(first_page, last_page + 1):
+            if reads:
+                self.read_pages[page] = device
+            if writes:
+                self.write_pages[page] = device
+
+    def unmap_device(self, first_page, last_page=None):
+        """ Make pages first_page..last_page plain RAM again. """
+        self.map_device(None, first_page, last_page)
+
+    def map_ROM(self, address, data):
+        """ Load data at address (a page boundary) and make it read-only.
+        Reads stay as fast as RAM; writes are ignored. """
+        self.load(address, data)
+        self.map_device(READ_ONLY, address >> 8, (address + len(data) - 1) >> 8, reads=False)
+
+    def load(self, address, data):
+        """ Copy a bytes-like object into RAM, starting at address. """
+        end = address + len(data)
+        if address < 0 or end > len(self.RAM):
+            raise IndexError(f"0x{len(data):X} bytes at 0x{address:04X} don't fit in RAM")
+        self.memory[address:end] = data
+        self.mark_dirty(address, end)
+
+    def dump(self, start, end):
+        """ Return a copy of RAM[start:end]. Use self.memory to avoid the copy. """
+        return bytes(self.memory[start:end])
+
+    def fill(self, start, end, value=0x00):
+        """ Set RAM[start:end] to value. """
+        if start < 0 or end > len(self.RAM):
+            raise IndexError(f"0x{start:04X}-0x{end:04X} is outside of RAM")
+        self.memory[start:end] = bytes([value & 0xFF]) * (end - start)
+        self.mark_dirty(start, end)
+
+    def mark_dirty(self, start, end):
+        """ Mark the pages of RAM[start:end] as written to. """
+        if end > start:
+            first, last = start >> 8, (end - 1) >> 8
+            self.dirty_pages[first:last + 1] = b'\x01' * (last + 1 - first)
+
+    def clear_dirty_pages(self):
+        """ Return the numbers of the pages written to since the last
+        call, and start again with every page clean. """
+        pages = list(compress(range(len(self.dirty_pages)), self.dirty_pages))
+        self.dirty_pages[:] = bytes(len(self.dirty_pages))
+        return pages
+
+    ## The status register.
+    def read_P(self):
+        """ The status register, as an int, with N and Z up to date. """
+        NZ = self.NZ
+        if NZ is None:
+            return self.P
+        return ((self.P & ~(FLAG_SIGN | FLAG_ZERO)) | (NZ & FLAG_SIGN) |
+                (0 if NZ & 0xFF else FLAG_ZERO))
+
+    def write_P(self, value):
+        self.P = value & 0xFF
+        self.NZ = None
+        if self.IRQ_lines and not value & FLAG_INTERRUPT:
+            self.next_event = self.ticks  # A masked IRQ can now be serviced.
+
+    @property
+    def STATUS(self):
+        """ The status register, as a StatusRegister. """
+        return StatusRegister(self.read_P())
+
+    @STATUS.setter
+    def STATUS(self, value):
+        self.write_P(value.value if isinstance(value, StatusRegister) else value)
+
+    ## Interrupts and events.
+    def raise_IRQ(self):
+        """ A device starts requesting an interrupt. IRQ is level
+        triggered: it's serviced whenever I is clear, until every
+        device that raised it calls clear_IRQ(). """
+        self.IRQ_lines += 1
+        self.next_event = self.ticks
+
+    def clear_IRQ(self):
+        self.IRQ_lines = max(0, self.IRQ_lines - 1)
+
+    def raise_NMI(self):
+        """ NMI is edge triggered: it's serviced once, regardless of I. """
+        self.NMI_pending = True
+        self.next_event = self.ticks
+
+    def interrupt(self, vector):
+        """ Push PC and the status, and jump through the vector. """
+        self.push_16bit(self.PC)
+        self.push_8bit((self.read_P() & ~FLAG_BREAK) | FLAG_UNUSED)
+        self.P |= FLAG_INTERRUPT
+        self.PC = (self.read_RAM(vector + 1) << 8) | self.read_RAM(vector)
+        self.ticks += 7
+
+    def service_events(self):
+        """ Called before an instruction when ticks >= next_event: fire
+        the scheduled events that are due, then take any interrupt. """
+        self.next_event = inf
+        if self.scheduler is not None:
+            self.scheduler.service()
+        if self.NMI_pending:
+            self.NMI_pending = False
+            self.interrupt(0xFFFA)
+        elif self.IRQ_lines and not self.P & FLAG_INTERRUPT:
+            self.interrupt(0xFFFE)
+
+    ## High-level emulation hooks.
+    def install_hook(self, address, function, cycles):
+        """ Instead of executing the subroutine at address, call
+        function(cpu), add cycles to ticks, and return (like RTS) to
+        the caller. The function works on the CPU through its normal
+        API (registers, read_RAM, write_RAM...).
+
+        A run() that's already going doesn't see the hooks installed
+        (e.g. by an event) while it's running. """
+        if self.hooks is None:
+            self.hooks = [None] * len(self.RAM)
+        self.hooks[address] = (function, cycles)
+
+    def remove_hook(self, address):
+        if self.hooks is not None:
+            self.hooks[address] = None
+            if not any(self.hooks):
+                self.hooks = None
+
+    def call_hook(self, address):
+        """ Run the hook installed at address (where PC is), and return. """
+        function, cycles = self.hooks[address]
+        function(self)
+        self.ticks += cycles
+        self.PC = (self.pop_16bit() + 1) & 0xFFFF
+
+    ## Idle loops.
+    def skip_idle_loop(self, PC, opcode, limit=inf):
+        """ If PC is at a taken branch to itself, a loop that can only
+        end with an event, jump ticks forward to the instruction where
+        the interpreter would notice the next event (or limit), leaving
+        the CPU exactly as the interpreter would. Instructions the CPU
+        doesn't implement are never skipped.
+
+        Returns how many instructions were skipped (maybe 0), or None
+        if the loop can never end. """
+        if self.decode_table[opcode][0] is None:
+            return 0  # Leave it to the interpreter to complain.
+        RAM, read_pages = self.RAM, self.read_pages
+        if (PC + 1 >= len(RAM) or read_pages[PC >> 8] is not None or
+                read_pages[(PC + 1) >> 8] is not None):
+            return 0  # Only plain RAM code can be trusted not to change.
+        flag, value = BRANCH_CONDITIONS[opcode]
+        if RAM[PC + 1] != 0xFE or self.read_P() & flag != value:
+            return 0
+
+        target = min(self.next_event, limit)
+        if target == inf:
+            return None
+        # The interpreter stops at the first instruction boundary at
+        # or after target.
+        ticks, period = target - self.ticks, COST_TABLE[opcode] + self.branch_penalty(PC + 2, PC)
+        if ticks <= 0:
+            return 0
+        loops = (ticks - 1) // period + 1
+        self.ticks += loops * period
+        self.idle_skips += 1
+        self.idle_ticks += loops * period
+        return loops
+
+    def branch_penalty(self, next_PC, target):
+        """ The extra ticks a branch costs when taken: one, or two if it
+        lands on a different page than the next instruction. """
+        return 2 if (next_PC ^ target) & 0xFF00 else 1
+
+    def fork(self):
+        """ Return an independent copy of this CPU. The debugger,
+        profiler and tracer aren't copied: they stay with this one. """
+        clone = copy(self)
+        clone.RAM = bytearray(self.RAM)  # A single memcpy.
+        clone.memory = memoryview(clone.RAM)
+        clone.dirty_pages = bytearray(self.dirty_pages)
+        if clone.read_pages is not NO_DEVICES:  # The devices themselves are shared.
+            clone.read_pages, clone.write_pages = list(self.read_pages), list(self.write_pages)
+        if self.scheduler is not None:
+            clone.scheduler = self.scheduler.fork(clone)
+        if self.hooks is not None:
+            clone.hooks = list(self.hooks)
+        if self.debugger is not None:  # The debugger stays with this CPU.
+            self.debugger.forget(clone)
+        if self.profiler is not None:  # So does the profiler.
+            self.profiler.forget(clone)
+        clone.tracer = None  # And the tracer, whose sinks only expect this CPU.
+        return clone
+
+    def restore(self, other):
+        """ Make this CPU's registers, RAM, pending interrupts and
+        scheduled events the same as other's (e.g. a fork() taken
+        earlier). Only the events are copied into new objects. """
+        for register in self.STATE:
+            setattr(self, register, getattr(other, register))
+        self.memory[:] = other.memory
+        self.mark_dirty(0, len(self.RAM))
+        self.IRQ_lines, self.NMI_pending = other.IRQ_lines, other.NMI_pending
+        self.next_event = other.next_event
+        # A copy, so that other can be restored again.
+        self.scheduler = other.scheduler.fork(self) if other.scheduler is not None else None
+
+    def hard_reset(self, template=None):
+        """ Make this CPU as good as new without allocating anything: RAM
+        becomes a copy of template (a bytes-like object as big as the
+        RAM, e.g. bytes(cpu.RAM) once a program is loaded), or zeroes,
+        in one copy. Devices, hooks, the scheduler, debugger, profiler
+        and tracer are dropped, and the registers are as after CPU(). """
+        if template is None:
+            template = _zeroes.get(len(self.RAM))
+            if template is None:
+                template = _zeroes[len(self.RAM)] = bytes(len(self.RAM))
+        self.memory[:] = template
+        self.mark_dirty(0, len(self.RAM))
+        if self.profiler is not None:
+            self.profiler.detach(self)
+        if self.debugger is not None:
+            self.debugger.detach()
+        self.power_on()
 
     def reset_CPU(self):
         self.A, self.X, self.Y = 0x00, 0x00, 0x00
@@ -95,106 +561,46 @@ class CPU():
 
         return value_high + value_low
 
+    @classmethod
+    def build_decode_table(cls):
+        """ Return the 256-entry decode table for this CPU class.
+
+        Each entry is (handler, addressing mode, cost, length, page
+        cross penalty), where handler is the (unbound) method executing
+        the opcode, or None if it is not implemented yet. The table is
+        built once per class. """
+        table = cls.__dict__.get('_decode_table')
+        if table is None:
+            table = []
+            for opcode in range(256):
+                name = INSTRUCTION_NAMES.get(opcode)
+                handler = getattr(cls, name) if name else None
+                table.append((handler, ADDRESSING_MODE_TABLE[opcode], COST_TABLE[opcode],
+                              LENGTH_TABLE[opcode], PAGE_CROSS_PENALTY[opcode]))
+            cls._decode_table = table
+        return table
+
     def find_addressing_mode(self, opcode):
         # Given opcode, find its addressing mode.
-        # TODO: find a more elegant way to do that (Logic simplification?)
-        if opcode in [0x0C, 0x0D, 0x0E, 0x0F, 0x20, 0x2C, 0x2D, 0x2E,
-                      0x2F, 0x4C, 0x4D, 0x4E, 0x4F, 0x6D, 0x6E, 0x6F,
-                      0x8C, 0x8D, 0x8E, 0x8F, 0xAC, 0xAD, 0xAE, 0xAF,
-                      0xCC, 0xCD, 0xCE, 0xCF, 0xEC, 0xED, 0xEE, 0xEF]:
-            return AddressingModes.ABSOLUTE
-        elif opcode in [0x1C, 0x1D, 0x1E, 0x1F, 0x3C, 0x3D, 0x3E, 0x3F,
-                        0x5C, 0x5D, 0x5E, 0x5F, 0x7C, 0x7D, 0x7E, 0x7F,
-                        0x9C, 0x9D, 0xBC, 0xBD, 0xDC, 0xDD, 0xDE, 0xDF,
-                        0xFC, 0xFD, 0xFE, 0xFF]:
-            return AddressingModes.ABSOLUTE_X
-        elif opcode in [0x19, 0x1B, 0x39, 0x3B, 0x59, 0x5B, 0x79, 0x7B,
-                        0x99, 0x9B, 0x9E, 0x9F, 0xB9, 0xBB, 0xBE, 0xBF,
-                        0xD9, 0xDB, 0xF9, 0xFB]:
-            return AddressingModes.ABSOLUTE_Y
-        elif opcode in [0x0A, 0x2A, 0x4A, 0x6A]:
-            return AddressingModes.ACCUMULATOR
-        elif opcode in [0x09, 0x0B, 0x29, 0x2B, 0x49, 0x4B, 0x69, 0x6B,
-                        0x80, 0x82, 0x89, 0x8B, 0xA0, 0xA2, 0xA9, 0xAB,
-                        0xC0, 0xC2, 0xC9, 0xCB, 0xE0, 0xE2, 0xE9, 0xEB]:
-            return AddressingModes.IMMEDIATE
-        elif opcode == 0x6C:
-            return AddressingModes.INDIRECT
-        elif opcode in [0x01, 0x03, 0x21, 0x23, 0x41, 0x43, 0x61, 0x63,
-                        0x81, 0x83, 0xA1, 0xA3, 0xC1, 0xC3, 0xE1, 0xE3]:
-            return AddressingModes.INDIRECT_X
-        elif opcode in [0x11, 0x13, 0x31, 0x33, 0x51, 0x53, 0x71, 0x73,
-                        0x91, 0x93, 0xB1, 0xB3, 0xD1, 0xD3, 0xF1, 0xF3]:
-            return AddressingModes.INDIRECT_Y
-        elif opcode in [0x10, 0x30, 0x50, 0x70, 0x90, 0xB0, 0xD0, 0xF0]:
-            return AddressingModes.RELATIVE
-        elif opcode in [0x04, 0x05, 0x06, 0x07, 0x24, 0x25, 0x26, 0x27,
-                        0x44, 0x45, 0x46, 0x47, 0x64, 0x65, 0x66, 0x67,
-                        0x84, 0x85, 0x86, 0x87, 0xA4, 0xA5, 0xA6, 0xA7,
-                        0xC4, 0xC5, 0xC6, 0xC7, 0xE4, 0xE5, 0xE6, 0xE7]:
-            return AddressingModes.ZERO_PAGE
-        elif opcode in [0x14, 0x15, 0x16, 0x17, 0x34, 0x35, 0x36, 0x37,
-                        0x54, 0x55, 0x56, 0x57, 0x74, 0x75, 0x76, 0x77,
-                        0x94, 0x95, 0xB4, 0xB5, 0xD4, 0xD5, 0xD6, 0xD7,
-                        0xF4, 0xF5, 0xF6, 0xF7]:
-            return AddressingModes.ZERO_PAGE_X
-        elif opcode in [0x96, 0x97, 0xB6, 0xB7]:
-            return AddressingModes.ZERO_PAGE_Y
-
-        # The default (most common) is implied addressing.
-        return AddressingModes.IMPLIED
+        return ADDRESSING_MODE_TABLE[opcode]
 
     def find_instruction_cost(self, opcode):
         # Given an opcode, it returns how many ticks this opcode costs.
-        if opcode in [0x04, 0x05, 0x08, 0x24, 0x25,
-                      0x44, 0x45, 0x48, 0x4C, 0x64,
-                      0x65, 0x84, 0x85, 0x86, 0x87,
-                      0xA4, 0xA5, 0xA6, 0xA7, 0xC4,
-                      0xC5, 0xE4, 0xE5]:
-            return 3
-        if opcode in [0x0C, 0x0D,
-                        0x14, 0x15, 0x19, 0x1C, 0x1D, 0x28, 0x2C, 0x2D,
-                        0x34, 0x35, 0x39, 0x3C, 0x3D, 0x4D, 0x54, 0x55,
-                        0x59, 0x5C, 0x5D, 0x68, 0x6D, 0x74, 0x75, 0x79,
-                        0x7C, 0x7D, 0x8C, 0x8D, 0x8E, 0x8F, 0x94, 0x95,
-                        0x96, 0x97, 0xAC, 0xAD, 0xAE, 0xAF, 0xB4, 0xB5,
-                        0xB6, 0xB7, 0xB9, 0xBB, 0xBC, 0xBD, 0xBE, 0xBF,
-                        0xCC, 0xCD, 0xD4, 0xD5, 0xD9, 0xDC, 0xDD, 0xEC,
-                        0xED, 0xF4, 0xF5, 0xF9, 0xFC, 0xFD]:
-            return 4
-        if opcode in [0x06, 0x07, 0x11, 0x26, 0x27,
-                        0x31, 0x46, 0x47, 0x51, 0x66,
-                        0x67, 0x6C, 0x71, 0x99, 0x9B,
-                        0x9C, 0x9D, 0x9E, 0x9F, 0xB1,
-                        0xB3, 0xC6, 0xC7, 0xD1, 0xE6,
-                        0xE7, 0xF1]:
-            return 5
-        if opcode in [0x01, 0x0E, 0x0F, 0x16, 0x17,
-                        0x20, 0x21, 0x2E, 0x2F, 0x36,
-                        0x37, 0x40, 0x41, 0x4E, 0x4F,
-                        0x56, 0x57, 0x60, 0x61, 0x6E,
-                        0x6F, 0x76, 0x77, 0x81, 0x83,
-                        0x91, 0x93, 0xA1, 0xA3, 0xC1,
-                        0xCE, 0xCF, 0xD6, 0xD7, 0xE1,
-                        0xEE, 0xEF, 0xF6, 0xF7]:
-            return 6
-        if opcode in [0x00, 0x1B, 0x1E, 0x1F, 0x3B,
-                        0x3E, 0x3F, 0x5B, 0x5E, 0x5F,
-                        0x7B, 0x7E, 0x7F, 0xDB, 0xDE,
-                        0xDF, 0xFB, 0xFE, 0xFF]:
-            return 7
-        if opcode in [0x03, 0x13, 0x23, 0x33, 0x43,
-                        0x53, 0x63, 0x73, 0xC3, 0xD3,
-                        0xE3, 0xF3]:
-            return 8
-        return 2  # The most common.
+        return COST_TABLE[opcode]
+
+    def find_instruction_length(self, opcode):
+        # Given an opcode, it returns how many bytes the instruction takes.
+        return LENGTH_TABLE[opcode]
+
+    def find_page_cross_penalty(self, opcode):
+        # Given an opcode, how many more ticks it costs when its indexed address crosses a page.
+        return PAGE_CROSS_PENALTY[opcode]
 
     def find_instruction(self, opcode):
-        if opcode == 0x18:
-            return self.CLC
-        if opcode == 0x80:
-            return self.NOP
-        return NotImplementedError(f"Instruction 0x{opcode:02X} not implemented yet!")
+        handler = self.decode_table[opcode][0]
+        if handler is None:
+            return NotImplementedError(f"Instruction 0x{opcode:02X} not implemented yet!")
+        return MethodType(handler, self)
 
     def decode_instruction(self, opcode):
         instruction = self.find_instruction(opcode)
@@ -203,7 +609,11 @@ class CPU():
 
         return (instruction, addressing_mode, cost)
 
-    def compute_effective_address(self, addressing_mode):
+    def compute_effective_address(self, addressing_mode, penalty=0):
+        # On entry, PC points to the opcode. On exit, it points
+        # to the last byte of the operand (if any).
+        # If adding an index to the address crosses a page, penalty
+        # ticks are added (see PAGE_CROSS_PENALTY).
         if addressing_mode in [AddressingModes.ACCUMULATOR,
                                AddressingModes.IMPLIED]:
             return
@@ -216,9 +626,9 @@ class CPU():
                 self.EA = self.read_RAM(self.PC) # EA <- RAM[PC]
                 ### Since 0 <= PC <= 0xFF... reads from zero-page
             elif addressing_mode == AddressingModes.ZERO_PAGE_X:
-                self.EA = self.read_RAM((self.PC + self.X) & 0xFF)
+                self.EA = (self.read_RAM(self.PC) + self.X) & 0xFF
             elif addressing_mode == AddressingModes.ZERO_PAGE_Y:
-                self.EA = self.read_RAM((self.PC + self.Y) & 0xFF)
+                self.EA = (self.read_RAM(self.PC) + self.Y) & 0xFF
             elif addressing_mode == AddressingModes.RELATIVE:
                 # Relative addressing mode is slightly different...
                 # we will use a different variable name.
@@ -226,31 +636,139 @@ class CPU():
                 if (self.RA & 0x80):  # It's > 127...
                     self.RA |= 0xFF00 ## so it wraps back.
             elif addressing_mode == AddressingModes.ABSOLUTE:
+                self.PC += 1
                 EA_low = self.read_RAM(self.PC - 1)
                 EA_high = self.read_RAM(self.PC)
                 self.EA = (EA_high << 8) | EA_low
-                        
-            
+            elif addressing_mode in (AddressingModes.ABSOLUTE_X, AddressingModes.ABSOLUTE_Y):
+                self.PC += 1
+                base = (self.read_RAM(self.PC) << 8) | self.read_RAM(self.PC - 1)
+                index = self.X if addressing_mode == AddressingModes.ABSOLUTE_X else self.Y
+                self.EA = (base + index) & 0xFFFF
+                if penalty and (base ^ self.EA) & 0xFF00:
+                    self.ticks += penalty
+            elif addressing_mode == AddressingModes.INDIRECT:
+                # Only JMP (ind). Like the NMOS 6502, the high byte of
+                # the target is read from the same page as the low one.
+                self.PC += 1
+                pointer = (self.read_RAM(self.PC) << 8) | self.read_RAM(self.PC - 1)
+                self.EA = ((self.read_RAM((pointer & 0xFF00) | ((pointer + 1) & 0xFF)) << 8) |
+                           self.read_RAM(pointer))
+            elif addressing_mode == AddressingModes.INDIRECT_X:
+                pointer = (self.read_RAM(self.PC) + self.X) & 0xFF
+                self.EA = (self.read_RAM((pointer + 1) & 0xFF) << 8) | self.read_RAM(pointer)
+            elif addressing_mode == AddressingModes.INDIRECT_Y:
+                pointer = self.read_RAM(self.PC)
+                base = (self.read_RAM((pointer + 1) & 0xFF) << 8) | self.read_RAM(pointer)
+                self.EA = (base + self.Y) & 0xFFFF
+                if penalty and (base ^ self.EA) & 0xFF00:
+                    self.ticks += penalty
+
     def step(self):
+        if self.ticks >= self.next_event:
+            self.service_events()
+
+        PC = self.PC
+        if self.hooks is not None and self.hooks[PC] is not None:
+            self.call_hook(PC)
+            if self.profiler is not None:
+                self.profiler.instruction(self, PC, RTS)
+            return
+
         # Fetch
-        opcode = self.read_RAM(self.PC)
-        print(f"FETCH RAM[0x{self.PC:02X}] = 0x{opcode:02X}")
-        self.PC += 1
+        opcode = self.read_RAM(PC)
+        if self.tracer is not None:
+            self.tracer.instruction(self, opcode)
 
         # Decode
-
-        instruction, addressing_mode, cost = self.decode_instruction(opcode)
-        print(instruction)
+        instruction, addressing_mode, cost, _, penalty = self.decode_table[opcode]
+        if instruction is None:
+            raise NotImplementedError(f"Instruction 0x{opcode:02X} not implemented yet!")
 
         # Execute
-        ## Find effective address
-        self.compute_effective_address(addressing_mode)
-        try:
-            instruction()
-        except:
-            raise NotImplementedError()
+        ## Find effective address, then move PC to the next instruction.
+        self.compute_effective_address(addressing_mode, penalty)
+        self.PC = (self.PC + 1) & 0xFFFF
+        instruction(self)
 
         self.ticks += cost
+        if self.profiler is not None:
+            self.profiler.instruction(self, PC, opcode)
+
+    def run(self, max_cycles=None, until_pc=None, until=None):
+        """ Execute instructions, without printing anything, until max_cycles
+        ticks have been spent, PC reaches until_pc, or until(cpu) is true.
+
+        Returns a tuple (instructions executed, ticks spent). """
+        # Everything the loop needs is looked up once, outside of it.
+        # The handlers work on self, so PC and ticks stay there.
+        decode_table = self.decode_table
+        RAM, read_pages, read_RAM = self.RAM, self.read_pages, self.read_RAM
+        compute_effective_address = self.compute_effective_address
+        tracer, profiler, hooks = self.tracer, self.profiler, self.hooks
+        breakpoints = self.breakpoints
+        # Skipping idle loops would hide instructions from predicates,
+        # profilers, tracers and breakpoints.
+        idle_skip = (self.idle_skip and until is None and profiler is None and
+                     tracer is None and breakpoints is None)
+        if profiler is not None:
+            read_pages = THROUGH_READ_RAM
+        IMPLIED, ACCUMULATOR = AddressingModes.IMPLIED, AddressingModes.ACCUMULATOR
+
+        start_ticks = self.ticks
+        limit = start_ticks + max_cycles if max_cycles is not None else inf
+        instructions = 0
+        # Running again after a breakpoint carries on from it.
+        resuming = self.stop_reason.address if (self.stop_reason is not None and
+                                                self.stop_reason.cause == 'breakpoint') else None
+        self.stop_reason = None
+
+        while self.ticks < limit:
+            if self.ticks >= self.next_event:
+                if self.stop_reason is not None:
+                    break  # The events are serviced when running again.
+                self.service_events()
+                continue  # The budget is checked again.
+
+            PC = self.PC
+            if PC == until_pc or (until is not None and until(self)):
+                break
+            if breakpoints is not None and (instructions or PC != resuming):
+                bitmap = breakpoints[PC >> 8]
+                if bitmap is not None and bitmap[PC & 0xFF] and self.debugger.breakpoint(PC):
+                    break
+            if hooks is not None and hooks[PC] is not None:
+                self.call_hook(PC)
+                instructions += 1
+                if profiler is not None:  # It's the hooked subroutine returning.
+                    profiler.instruction(self, PC, RTS)
+                continue
+
+            opcode = RAM[PC] if read_pages[PC >> 8] is None else read_RAM(PC)
+            if idle_skip and opcode in IDLE_LOOP_OPCODES:
+                skipped = self.skip_idle_loop(PC, opcode, limit)
+                if skipped is None:  # Idle forever.
+                    break
+                if skipped:
+                    instructions += skipped
+                    continue
+            if tracer is not None:
+                tracer.instruction(self, opcode)
+            instruction, addressing_mode, cost, _, penalty = decode_table[opcode]
+            if instruction is None:
+                raise NotImplementedError(f"Instruction 0x{opcode:02X} not implemented yet!")
+
+            if addressing_mode is not IMPLIED and addressing_mode is not ACCUMULATOR:
+                compute_effective_address(addressing_mode, penalty)
+            self.PC = (self.PC + 1) & 0xFFFF
+            instruction(self)
+
+            self.ticks += cost
+            instructions += 1
+            if profiler is not None:
+                profiler.instruction(self, PC, opcode)
+
+        return (instructions, self.ticks - start_ticks)
 
     ## The instructions themselves
     def BRK(self):  # 0x00
@@ -259,7 +777,7 @@ class CPU():
         # Save PC++ to stack.
         self.push_16bit(self.PC)
         # Push CPU status to stack.
-        self.push_8bit(self.STATUS)
+        self.push_8bit(self.read_P())
         # Read the new PC from the BRK vector
         self.PC = (self.read_RAM(0xFFFF)) << 8 | self.read_RAM(0xFFFE)
 
@@ -269,16 +787,69 @@ class CPU():
 
     def CLC(self):
         """ CLV: Clear the Carry status. """
-        self.STATUS &= ~StatusRegister.CARRY
+        self.P &= ~FLAG_CARRY
 
     def CLD(self):
         """ CLV: Clear the Decimal status. """
-        self.STATUS &= ~StatusRegister.DECIMAL
+        self.P &= ~FLAG_DECIMAL
 
     def CLI(self):
         """ CLV: Clear the Interrupt status. """
-        self.STATUS &= ~StatusRegister.INTERRUPT
+        self.P &= ~FLAG_INTERRUPT
+        if self.IRQ_lines:
+            self.next_event = self.ticks
 
     def CLV(self):
         """ CLV: Clear the oVerflow status. """
-        self.STATUS &= ~StatusRegister.OVERFLOW
+        self.P &= ~FLAG_OVERFLOW
+
+    def branch(self):
+        """ Branch to PC + RA: one more tick, or two if the target is
+        on a different page than the next instruction. """
+        target = (self.PC + self.RA) & 0xFFFF
+        self.ticks += 2 if (self.PC ^ target) & 0xFF00 else 1
+        self.PC = target
+
+    def BPL(self):
+        """ BPL: Branch if the Sign status is clear. """
+        NZ = self.NZ
+        if not (self.P if NZ is None else NZ) & FLAG_SIGN:
+            self.branch()
+
+    def BMI(self):
+        """ BMI: Branch if the Sign status is set. """
+        NZ = self.NZ
+        if (self.P if NZ is None else NZ) & FLAG_SIGN:
+            self.branch()
+
+    def BVC(self):
+        """ BVC: Branch if the oVerflow status is clear. """
+        if not self.P & FLAG_OVERFLOW:
+            self.branch()
+
+    def BVS(self):
+        """ BVS: Branch if the oVerflow status is set. """
+        if self.P & FLAG_OVERFLOW:
+            self.branch()
+
+    def BCC(self):
+        """ BCC: Branch if the Carry status is clear. """
+        if not self.P & FLAG_CARRY:
+            self.branch()
+
+    def BCS(self):
+        """ BCS: Branch if the Carry status is set. """
+        if self.P & FLAG_CARRY:
+            self.branch()
+
+    def BNE(self):
+        """ BNE: Branch if the Zero status is clear. """
+        NZ = self.NZ
+        if (not self.P & FLAG_ZERO) if NZ is None else NZ & 0xFF:
+            self.branch()
+
+    def BEQ(self):
+        """ BEQ: Branch if the Zero status is set. """
+        NZ = self.NZ
+        if self.P & FLAG_ZERO if NZ is None else not NZ & 0xFF:
+            self.branch()
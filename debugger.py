@@ -0,0 +1,158 @@
+# py6502: breakpoints and watchpoints.
+#
+# debugger = Debugger(cpu), then add breakpoints and watchpoints. When
+# one of them is hit, run() returns early, with the cause (a Stop) in
+# cpu.stop_reason; running again carries on from there.
+#
+# Breakpoints are kept as a 256-byte bitmap per page, and only pages
+# with breakpoints have one. Watchpoints put a WatchedPage device in
+# front of the pages they watch, so the other pages don't pay for them.
+# With no breakpoints or watchpoints, the CPU runs as fast as it does
+# without a debugger.
+
+# pylint: disable=C0103
+
+from collections import namedtuple
+
+from bus import Device
+
+# cause is 'breakpoint', 'read' or 'write'; value is what was read or
+# written (None for breakpoints).
+Stop = namedtuple('Stop', 'cause address value')
+
+class WatchedPage(Device):
+    """ Sits in front of a page with watchpoints. Accesses are passed on
+    to the device it replaced, or to RAM. """
+    def __init__(self, debugger, page):
+        cpu = debugger.cpu
+        self.debugger, self.RAM = debugger, cpu.RAM
+        self.reader, self.writer = cpu.read_pages[page], cpu.write_pages[page]
+        self.reads, self.writes = bytearray(256), bytearray(256)  # Watched offsets.
+
+    def read(self, address):
+        value = self.RAM[address] if self.reader is None else self.reader.read(address)
+        if self.reads[address & 0xFF]:
+            self.debugger.watchpoint('read', address, value)
+        return value
+
+    def write(self, address, value):
+        if self.writes[address & 0xFF]:
+            self.debugger.watchpoint('write', address, value)
+        if self.writer is None:
+            self.RAM[address] = value
+        else:
+            self.writer.write(address, value)
+
+class Debugger():
+    """ Breakpoints and watchpoints for a CPU. Map the CPU's devices
+    before adding watchpoints. """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.conditions = {}  # Breakpoint address -> condition, or None.
+        self.watched = {}  # Page -> WatchedPage
+        cpu.debugger = self
+
+    @property
+    def idle(self):
+        """ True when there's nothing to stop at. """
+        return not self.conditions and not self.watched
+
+    def detach(self):
+        """ Remove every breakpoint and watchpoint, and the debugger. """
+        for address in list(self.conditions):
+            self.remove_breakpoint(address)
+        for page in list(self.watched):
+            self.remove_watchpoint(page << 8, (page + 1) << 8)
+        self.cpu.debugger = None
+
+    def forget(self, cpu):
+        """ Take the debugger out of a fork of its CPU. """
+        cpu.debugger = cpu.breakpoints = None
+        for page, watched in self.watched.items():
+            if cpu.read_pages[page] is watched:
+                cpu.read_pages[page] = watched.reader
+            if cpu.write_pages[page] is watched:
+                cpu.write_pages[page] = watched.writer
+
+    ## Breakpoints.
+    def add_breakpoint(self, address, condition=None):
+        """ Stop before the instruction at address, if condition(cpu)
+        is true (e.g. lambda cpu: cpu.X == 0), or always. """
+        cpu = self.cpu
+        cpu.debugger = self  # Again, if it was detached.
+        if cpu.breakpoints is None:
+            cpu.breakpoints = [None] * 256
+        bitmap = cpu.breakpoints[address >> 8]
+        if bitmap is None:
+            bitmap = cpu.breakpoints[address >> 8] = bytearray(256)
+        bitmap[address & 0xFF] = 1
+        self.conditions[address] = condition
+
+    def remove_breakpoint(self, address):
+        cpu = self.cpu
+        del self.conditions[address]
+        bitmap = cpu.breakpoints[address >> 8]
+        bitmap[address & 0xFF] = 0
+        if not any(bitmap):
+            cpu.breakpoints[address >> 8] = None
+            if not any(cpu.breakpoints):
+                cpu.breakpoints = None
+
+    def breakpoint(self, address):
+        """ Called by the CPU at a breakpoint. True if it should stop. """
+        condition = self.conditions[address]
+        if condition is not None and not condition(self.cpu):
+            return False
+        self.cpu.stop_reason = Stop('breakpoint', address, None)
+        return True
+
+    ## Watchpoints.
+    def add_watchpoint(self, start, end=None, reads=False, writes=True):
+        """ Stop after the instruction that reads and/or writes any of
+        RAM[start:end] (by default, just start). Instruction fetches
+        are reads, too. """
+        self.cpu.debugger = self  # Again, if it was detached.
+        end = start + 1 if end is None else end
+        for address in range(start, end):
+            page = address >> 8
+            watched = self.watched.get(page)
+            if watched is None:
+                watched = self.watched[page] = WatchedPage(self, page)
+            if reads:
+                watched.reads[address & 0xFF] = 1
+            if writes:
+                watched.writes[address & 0xFF] = 1
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            self.remap(page)
+
+    def remove_watchpoint(self, start, end=None, reads=True, writes=True):
+        end = start + 1 if end is None else end
+        for address in range(start, end):
+            watched = self.watched.get(address >> 8)
+            if watched is None:
+                continue
+            if reads:
+                watched.reads[address & 0xFF] = 0
+            if writes:
+                watched.writes[address & 0xFF] = 0
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            if page in self.watched:
+                self.remap(page)
+
+    def remap(self, page):
+        """ Only put the WatchedPage in front of the sides of the page
+        (reads, writes) that have watchpoints. """
+        watched, cpu = self.watched[page], self.cpu
+        reads, writes = any(watched.reads), any(watched.writes)
+        cpu.map_device(watched if reads else watched.reader, page, writes=False)
+        cpu.map_device(watched if writes else watched.writer, page, reads=False)
+        if not reads and not writes:
+            del self.watched[page]
+
+    def watchpoint(self, cause, address, value):
+        """ Called by a WatchedPage: stop after the current instruction.
+        If it hits several watchpoints, the first one is reported. """
+        cpu = self.cpu
+        if cpu.stop_reason is None:
+            cpu.stop_reason = Stop(cause, address, value)
+            cpu.next_event = cpu.ticks
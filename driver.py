@@ -0,0 +1,174 @@
+# py6502: running CPUs under asyncio.
+#
+# A Driver runs its CPU a slice of cycles at a time, and awaits between
+# slices, so that many machines (and their I/O) share one event loop.
+# It can also pace the CPU to a clock rate. SerialConsole is a serial
+# port device whose other end is asyncio-friendly: pump() connects it
+# to a pair of streams (a socket, pipes...), serve_console() listens on
+# a local socket, and Terminal stands in for a user, in tests.
+#
+#   console = SerialConsole(cpu)
+#   cpu.map_device(console, 0xD0)
+#   await asyncio.gather(Driver(cpu).run(), serve_console(console, port=6502))
+
+# pylint: disable=C0103
+
+import asyncio
+from collections import deque
+from contextlib import suppress
+import time
+
+from bus import Device
+
+class Driver():
+    """ Runs a CPU in slices of slice_cycles ticks. With a clock_rate
+    (in Hz), it sleeps between slices so as not to get ahead of it;
+    without, it only gives the other tasks a turn. """
+    def __init__(self, cpu, slice_cycles=20_000, clock_rate=None, idle_sleep=0.01):
+        self.cpu = cpu
+        self.slice_cycles = slice_cycles
+        self.clock_rate = clock_rate
+        self.idle_sleep = idle_sleep  # When the CPU can't make progress.
+        self.stopping = False
+
+    def stop(self):
+        """ Make run() return after the current slice. """
+        self.stopping = True
+
+    async def run(self, max_cycles=None, until_pc=None):
+        """ Like CPU.run(), but awaiting between slices. Also returns
+        when the CPU stops on its own (see cpu.stop_reason) or stop()
+        is called. Returns (instructions executed, ticks spent). """
+        cpu = self.cpu
+        start_ticks, instructions = cpu.ticks, 0
+        begin = time.perf_counter()
+        self.stopping = False
+
+        while not self.stopping:
+            budget = self.slice_cycles
+            if max_cycles is not None:
+                budget = min(budget, start_ticks + max_cycles - cpu.ticks)
+                if budget <= 0:
+                    break
+            executed, spent = cpu.run(max_cycles=budget, until_pc=until_pc)
+            instructions += executed
+            if cpu.PC == until_pc or cpu.stop_reason is not None:
+                break
+
+            if not spent:  # E.g. idle with nothing scheduled: wait for input.
+                await asyncio.sleep(self.idle_sleep)
+            elif self.clock_rate:
+                ahead = (cpu.ticks - start_ticks) / self.clock_rate - (time.perf_counter() - begin)
+                await asyncio.sleep(max(0.0, ahead))
+            else:
+                await asyncio.sleep(0)
+
+        return (instructions, cpu.ticks - start_ticks)
+
+class SerialConsole(Device):
+    """ A serial port, with two registers repeated over its page: DATA
+    (reading returns the next byte received, or 0; writing sends a
+    byte), and STATUS (RECEIVED when there's a byte to read; CAN_SEND
+    is always set). With IRQ, it holds IRQ while there's a byte to read. """
+    DATA, STATUS = 0x00, 0x01
+    RECEIVED, CAN_SEND = 0x01, 0x02
+
+    def __init__(self, cpu=None, IRQ=False):
+        self.cpu, self.IRQ = cpu, IRQ
+        self.received = deque()  # From the outside world, to the guest.
+        self.sent = bytearray()  # From the guest, not read_output() yet.
+        self.sent_event = asyncio.Event()
+        self.holding_IRQ = False
+
+    def read(self, address):
+        if address & 1 == self.STATUS:
+            return (self.RECEIVED if self.received else 0) | self.CAN_SEND
+        value = self.received.popleft() if self.received else 0x00
+        self.update_IRQ()
+        return value
+
+    def write(self, address, value):
+        if address & 1 == self.DATA:
+            self.sent.append(value)
+            self.sent_event.set()
+
+    def update_IRQ(self):
+        if self.IRQ and bool(self.received) != self.holding_IRQ:
+            self.holding_IRQ = not self.holding_IRQ
+            if self.holding_IRQ:
+                self.cpu.raise_IRQ()
+            else:
+                self.cpu.clear_IRQ()
+
+    ## The outside world's end.
+    def feed(self, data):
+        """ Bytes received by the guest. """
+        self.received.extend(data)
+        self.update_IRQ()
+
+    async def read_output(self):
+        """ Wait for, and return, what the guest has sent. """
+        await self.sent_event.wait()
+        data = bytes(self.sent)
+        self.sent.clear()
+        self.sent_event.clear()
+        return data
+
+async def pump(console, reader, writer):
+    """ Connect the console to a pair of asyncio streams until the
+    reader is at EOF: what's read is fed to the guest, and what the
+    guest sends is written. """
+    async def send():
+        while True:
+            writer.write(await console.read_output())
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    try:
+        while data := await reader.read(4096):
+            console.feed(data)
+    finally:
+        sender.cancel()
+        with suppress(asyncio.CancelledError):
+            await sender
+        writer.close()
+
+async def serve_console(console, host='127.0.0.1', port=0):
+    """ Listen on a local socket, and pump() every connection to it. """
+    return await asyncio.start_server(lambda reader, writer: pump(console, reader, writer),
+                                      host, port)
+
+async def pipe_streams(read_pipe, write_pipe):
+    """ asyncio streams for a pair of pipes (file objects), for pump(). """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), read_pipe)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                        write_pipe)
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+class Terminal():
+    """ A stand-in for a user at a terminal: types into the console, and
+    keeps what the guest prints on screen. """
+    def __init__(self, console):
+        self.console = console
+        self.screen = bytearray()
+
+    def type(self, text):
+        self.console.feed(text.encode('latin-1'))
+
+    async def expect(self, text, timeout=1.0):
+        """ Wait until text is on screen, and return the screen up to it
+        (which is then cleared). Raises TimeoutError if it doesn't come. """
+        text = text.encode('latin-1')
+        deadline = time.perf_counter() + timeout
+        while text not in self.screen:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError(f"Expected {text!r}, got {bytes(self.screen)!r}")
+            with suppress(asyncio.TimeoutError):
+                self.screen += await asyncio.wait_for(self.console.read_output(), remaining)
+        end = self.screen.index(text) + len(text)
+        shown = bytes(self.screen[:end])
+        del self.screen[:end]
+        return shown.decode('latin-1')
@@ -0,0 +1,271 @@
+# py6502: a basic-block translating CPU.
+#
+# Instead of decoding one instruction at a time, TranslatingCPU finds
+# the straight-line block of code starting at PC, turns it into a single
+# Python function (with the operands already decoded) and caches it by
+# its entry address. Writing into a translated block throws it away,
+# so self-modifying code still works.
+
+# pylint: disable=C0103
+
+from itertools import compress
+from math import inf
+
+from cpu import CPU, AddressingModes, IDLE_LOOP_OPCODES
+
+# Instructions that may change PC: a block always ends with them.
+BLOCK_ENDING = {'BRK', 'JMP', 'JSR', 'RTS', 'RTI',
+                'BCC', 'BCS', 'BEQ', 'BMI', 'BNE', 'BPL', 'BVC', 'BVS'}
+
+# Instructions that never write to RAM. After any other instruction,
+# the block checks whether it has just overwritten itself.
+NO_RAM_WRITES = {'NOP', 'CLC', 'CLD', 'CLI', 'CLV', 'SEC', 'SED', 'SEI',
+                 'LDA', 'LDX', 'LDY', 'TAX', 'TAY', 'TSX', 'TXA', 'TXS', 'TYA',
+                 'INX', 'INY', 'DEX', 'DEY', 'CMP', 'CPX', 'CPY', 'BIT',
+                 'AND', 'ORA', 'EOR', 'ADC', 'SBC', 'PLA', 'PLP'}
+
+# Instructions that may clear I, and so let a pending IRQ in right after them.
+UNMASKING_IRQ = {'CLI', 'PLP', 'RTI'}
+
+# The operand of these modes is known when the block is translated.
+STATIC_MODES = {AddressingModes.IMPLIED, AddressingModes.ACCUMULATOR,
+                AddressingModes.IMMEDIATE, AddressingModes.ZERO_PAGE,
+                AddressingModes.ABSOLUTE, AddressingModes.RELATIVE}
+
+MAX_BLOCK_INSTRUCTIONS = 64
+
+def in_RAM(cpu):
+    """ Whether the CPU fetches its next opcode from plain RAM. """
+    return cpu.read_pages[cpu.PC >> 8] is None
+
+class Block():
+    """ A translated basic block. """
+    def __init__(self, start, end, instructions, cycles, max_cycles, function, alive):
+        self.start, self.end = start, end  # Covers RAM[start:end].
+        self.instructions = instructions
+        self.cycles = cycles  # Base cost of the whole block.
+        self.max_cycles = max_cycles  # With every page crossed and branch taken.
+        self.function = function  # function(cpu) -> instructions executed.
+        self.alive = alive  # [False] once invalidated.
+
+class TranslatingCPU(CPU):
+    """ A CPU whose run() executes translated basic blocks. """
+    def __init__(self, memory_size = 65536):
+        super().__init__(memory_size)
+        self.blocks = {}  # Entry address -> Block
+        self.code_pages = [None] * 256  # Page -> list of Blocks on it.
+
+    def install_hook(self, address, function, cycles):
+        super().install_hook(address, function, cycles)
+        self.invalidate(address, address + 1)  # Blocks stop before hooks.
+
+    def map_device(self, device, first_page, last_page=None, reads=True, writes=True):
+        super().map_device(device, first_page, last_page, reads, writes)
+        # Blocks are only translated from pages whose reads go to RAM.
+        last_page = first_page if last_page is None else last_page
+        self.invalidate(first_page << 8, (last_page + 1) << 8)
+
+    def fork(self):
+        clone = super().fork()
+        clone.blocks, clone.code_pages = {}, [None] * 256
+        return clone
+
+    ## Keeping the cache coherent.
+    def restore(self, other):
+        self.invalidate_changes(other.memory)
+        super().restore(other)
+
+    def hard_reset(self, template=None):
+        # Blocks only depend on RAM, so a CPU reset to the same program
+        # keeps its translations.
+        self.invalidate_changes(template)
+        super().hard_reset(template)
+
+    def invalidate_changes(self, contents):
+        """ Throw away the blocks on the pages that differ in contents
+        (a bytes-like object as big as RAM, or None for zeroes). """
+        for page in compress(range(len(self.code_pages)), self.code_pages):
+            start, end = page << 8, (page + 1) << 8
+            if contents is None:
+                if any(self.memory[start:end]):
+                    self.invalidate(start, end)
+            elif self.memory[start:end] != contents[start:end]:
+                self.invalidate(start, end)
+
+    def write_RAM(self, address, value):
+        super().write_RAM(address, value)
+        if self.code_pages[address >> 8] is not None:
+            self.invalidate(address, address + 1)
+
+    def load(self, address, data):
+        super().load(address, data)
+        self.invalidate(address, address + len(data))
+
+    def fill(self, start, end, value=0x00):
+        super().fill(start, end, value)
+        self.invalidate(start, end)
+
+    def invalidate(self, start, end):
+        """ Throw away the blocks translated from RAM[start:end]. """
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            blocks = self.code_pages[page]
+            if blocks is None:
+                continue
+            for block in [block for block in blocks if block.start < end and start < block.end]:
+                self.discard(block)
+
+    def discard(self, block):
+        block.alive[0] = False
+        del self.blocks[block.start]
+        for page in range(block.start >> 8, ((block.end - 1) >> 8) + 1):
+            blocks = self.code_pages[page]
+            blocks.remove(block)
+            if not blocks:
+                self.code_pages[page] = None
+
+    ## Translation.
+    def operand_source(self, address, addressing_mode, penalty=0):
+        """ Python statements setting EA/RA for the instruction at address. """
+        RAM = self.RAM
+        if addressing_mode == AddressingModes.IMMEDIATE:
+            return [f"cpu.EA = 0x{address + 1:04X}"]
+        if addressing_mode == AddressingModes.ZERO_PAGE:
+            return [f"cpu.EA = 0x{RAM[address + 1]:02X}"]
+        if addressing_mode == AddressingModes.ABSOLUTE:
+            return [f"cpu.EA = 0x{RAM[address + 2] << 8 | RAM[address + 1]:04X}"]
+        if addressing_mode == AddressingModes.RELATIVE:
+            RA = RAM[address + 1]
+            if RA & 0x80:
+                RA |= 0xFF00
+            return [f"cpu.RA = 0x{RA:04X}"]
+        if addressing_mode in STATIC_MODES:
+            return []
+        # Anything indexed is left to compute_effective_address.
+        return [f"cpu.PC = 0x{address:04X}",
+                f"cpu.compute_effective_address(MODE_{addressing_mode.name}, {penalty})"]
+
+    def translate(self, start):
+        """ Translate the block starting at start, or return None if the
+        very first instruction can't be translated. Code is only
+        translated from pages whose reads go straight to RAM, and
+        blocks stop before any address with a hook. """
+        decode_table, hooks = self.decode_table, self.hooks
+        namespace = {f"MODE_{mode.name}": mode for mode in AddressingModes}
+        namespace['alive'] = alive = [True]
+        body = []
+        address, instructions, cycles, max_cycles = start, 0, 0, 0
+
+        while instructions < MAX_BLOCK_INSTRUCTIONS and address < len(self.RAM):
+            opcode = self.RAM[address]
+            instruction, addressing_mode, cost, length, penalty = decode_table[opcode]
+            if (instruction is None or address + length > len(self.RAM) or
+                    any(self.read_pages[page] is not None
+                        for page in range(address >> 8, ((address + length - 1) >> 8) + 1)) or
+                    (hooks is not None and hooks[address] is not None)):
+                break
+            name = instruction.__name__
+            namespace[f"H{instructions}"] = instruction
+            ends_block = name in BLOCK_ENDING
+            # After these, the block may have to stop early.
+            checked = name not in NO_RAM_WRITES or name in UNMASKING_IRQ
+
+            body.append(f"# 0x{address:04X}: {name}")
+            body.extend(self.operand_source(address, addressing_mode, penalty))
+            address += length
+            instructions += 1
+            cycles += cost
+            max_cycles += cost + (2 if addressing_mode == AddressingModes.RELATIVE else penalty)
+            if ends_block or checked or addressing_mode not in STATIC_MODES:
+                body.append(f"cpu.PC = 0x{address & 0xFFFF:04X}")
+            body.append(f"H{instructions - 1}(cpu)")
+
+            if ends_block:
+                break
+            if checked:
+                # It may have overwritten the block, or made an event
+                # due (unmasking IRQ, or writing to a device), which
+                # the interpreter would see before the next instruction.
+                body.append(f"if not alive[0] or cpu.next_event <= cpu.ticks + {cycles}:")
+                body.append(f"    cpu.ticks += {cycles}")
+                body.append(f"    return {instructions}")
+
+        if instructions == 0:
+            return None
+        if name not in BLOCK_ENDING:
+            body.append(f"cpu.PC = 0x{address & 0xFFFF:04X}")
+        body.append(f"cpu.ticks += {cycles}")
+        body.append(f"return {instructions}")
+
+        source = f"def block_{start:04X}(cpu):\n" + "".join(f"    {line}\n" for line in body)
+        exec(compile(source, f"<block 0x{start:04X}>", 'exec'), namespace)  # pylint: disable=W0122
+
+        block = Block(start, address, instructions, cycles, max_cycles,
+                      namespace[f"block_{start:04X}"], alive)
+        self.blocks[start] = block
+        for page in range(start >> 8, ((address - 1) >> 8) + 1):
+            if self.code_pages[page] is None:
+                self.code_pages[page] = []
+            self.code_pages[page].append(block)
+        return block
+
+    ## Execution.
+    def run(self, max_cycles=None, until_pc=None, until=None):
+        """ Like CPU.run(), but a block at a time. Predicates, tracing,
+        profiling, and anything that stops halfway through a block fall
+        back to the interpreter, so the results are exactly the same. So
+        do breakpoints and watchpoints. """
+        if (until is not None or self.tracer is not None or self.profiler is not None or
+                (self.debugger is not None and not self.debugger.idle)):
+            return super().run(max_cycles, until_pc, until)
+
+        blocks = self.blocks
+        start_ticks = self.ticks
+        limit = start_ticks + max_cycles if max_cycles is not None else inf
+        instructions = 0
+        idle_skip, hooks = self.idle_skip and self.breakpoints is None, self.hooks
+        self.stop_reason = None
+
+        while self.ticks < limit:
+            if self.ticks >= self.next_event:
+                if self.stop_reason is not None:
+                    break
+                self.service_events()
+                continue
+
+            PC = self.PC
+            if PC == until_pc:
+                break
+            if hooks is not None and hooks[PC] is not None:
+                self.call_hook(PC)
+                instructions += 1
+                continue
+            if idle_skip and self.RAM[PC] in IDLE_LOOP_OPCODES:
+                skipped = self.skip_idle_loop(PC, self.RAM[PC], limit)
+                if skipped is None:  # Idle forever.
+                    break
+                if skipped:
+                    instructions += skipped
+                    continue
+            if self.read_pages[PC >> 8] is not None:
+                # Code in devices is never translated: interpret it
+                # until it's back in RAM.
+                executed, _ = super().run(limit - self.ticks, until_pc, in_RAM)
+                instructions += executed
+                continue
+            block = blocks.get(PC) or self.translate(PC)
+            if block is None or self.ticks + block.max_cycles > self.next_event:
+                # Interpret it (or let the interpreter complain), or
+                # the next event would be late.
+                self.step()
+                instructions += 1
+                continue
+
+            if ((until_pc is not None and block.start < until_pc < block.end) or
+                    self.ticks + block.max_cycles > limit):
+                # The block would run past where we have to stop.
+                executed, _ = super().run(limit - self.ticks, until_pc)
+                instructions += executed
+                break
+            instructions += block.function(self)
+
+        return (instructions, self.ticks - start_ticks)
@@ -0,0 +1,178 @@
+# py6502: loading program images.
+#
+# Reads raw binaries, PRG files (a 2-byte load address, then the data),
+# Intel HEX and o65 executables into an Image: a list of segments, each
+# an address and a bytes-like object, and maybe an entry point. Files
+# are memory-mapped when they're large, the segments are views into
+# them, and each one is copied into RAM with a single slice assignment.
+#
+#   loader.load_file(cpu, "program.prg", reset_vector=0x0801)
+#   loader.load_file(cpu, "program.o65", reset_vector=loader.ENTRY)
+
+# pylint: disable=C0103
+
+from collections import namedtuple
+from contextlib import contextmanager
+import mmap
+import os
+import struct
+
+Segment = namedtuple('Segment', 'address data')
+# entry is the image's start address, or None if the format doesn't say.
+Image = namedtuple('Image', 'segments entry')
+# What load_file() put in RAM: (start, end) ranges, and the entry point.
+Loaded = namedtuple('Loaded', 'ranges entry')
+
+# Pass as reset_vector/BRK_vector to use the image's entry point.
+ENTRY = 'entry'
+
+# Files at least this big are memory-mapped instead of read.
+MMAP_THRESHOLD = 0x4000
+
+RESET_VECTOR, BRK_VECTOR = 0xFFFC, 0xFFFE
+
+## Formats.
+def read_raw(data, address=0x0000):
+    """ A raw binary, loaded at address. """
+    return Image([Segment(address, memoryview(data))], None)
+
+def read_PRG(data):
+    """ A PRG file: the load address (little-endian), then the data. """
+    if len(data) < 2:
+        raise ValueError("Truncated PRG file")
+    data = memoryview(data)
+    return Image([Segment(data[0] | (data[1] << 8), data[2:])], None)
+
+def read_intel_HEX(data):
+    """ Intel HEX: data (00), end of file (01), extended segment (02) and
+    linear (04) address, and start address (03, 05) records.
+    Consecutive data records are merged into one segment. """
+    segments, entry, base = [], None, 0
+    for number, line in enumerate(bytes(data).splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[:1] != b':':
+            raise ValueError(f"Line {number}: not an Intel HEX record")
+        try:
+            record = bytes.fromhex(line[1:].decode('ascii'))
+        except ValueError as error:
+            raise ValueError(f"Line {number}: {error}") from None
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise ValueError(f"Line {number}: bad record length")
+        if sum(record) & 0xFF:
+            raise ValueError(f"Line {number}: bad checksum")
+
+        offset, kind, payload = (record[1] << 8) | record[2], record[3], record[4:-1]
+        if kind == 0x00:
+            address = base + offset
+            if segments and segments[-1].address + len(segments[-1].data) == address:
+                segments[-1].data.extend(payload)
+            else:
+                segments.append(Segment(address, bytearray(payload)))
+        elif kind == 0x01:
+            break
+        elif kind == 0x02:
+            base = int.from_bytes(payload, 'big') << 4
+        elif kind == 0x04:
+            base = int.from_bytes(payload, 'big') << 16
+        elif kind == 0x03:
+            entry = int.from_bytes(payload[2:], 'big')  # CS:IP; just IP.
+        elif kind == 0x05:
+            entry = int.from_bytes(payload, 'big') & 0xFFFF
+        else:
+            raise ValueError(f"Line {number}: unknown record type 0x{kind:02X}")
+    return Image(segments, entry)
+
+O65_MAGIC = b'\x01\x00o65\x00'
+O65_MODE_65816, O65_MODE_SIZE, O65_MODE_OBJECT, O65_MODE_BSSZERO = 0x8000, 0x2000, 0x1000, 0x0200
+
+def read_o65(data):
+    """ An o65 executable, loaded where it was assembled (it isn't
+    relocated): text at tbase, then data at dbase, and a zeroed bss if
+    the file asks for it. The entry point is tbase. """
+    # No view of data until it's checked: a view left in a traceback
+    # would keep a mapped file from being closed.
+    if bytes(data[:6]) != O65_MAGIC:
+        raise ValueError("Not an o65 file")
+    if len(data) < 8:
+        raise ValueError("Truncated o65 header")
+    mode = data[6] | (data[7] << 8)
+    if mode & O65_MODE_65816:
+        raise ValueError("65816 o65 files aren't supported")
+    if mode & O65_MODE_OBJECT:
+        raise ValueError("o65 object files need linking first")
+    fields = struct.Struct('<9I' if mode & O65_MODE_SIZE else '<9H')
+    if len(data) < 8 + fields.size:
+        raise ValueError("Truncated o65 header")
+    tbase, tlen, dbase, dlen, bbase, blen, _, _, _ = fields.unpack_from(data, 8)
+
+    position = 8 + fields.size
+    while True:  # Header options: length (including itself), type, data.
+        if position >= len(data):
+            raise ValueError("Truncated o65 header options")
+        if data[position] == 0:
+            position += 1
+            break
+        position += data[position]
+
+    if position + tlen + dlen > len(data):
+        raise ValueError("Truncated o65 segments")
+    data = memoryview(data)
+    segments = [Segment(tbase, data[position:position + tlen]),
+                Segment(dbase, data[position + tlen:position + tlen + dlen])]
+    if mode & O65_MODE_BSSZERO and blen:
+        segments.append(Segment(bbase, bytes(blen)))
+    return Image([segment for segment in segments if len(segment.data)], tbase)
+
+FORMATS = {'raw': read_raw, 'prg': read_PRG, 'hex': read_intel_HEX, 'o65': read_o65}
+EXTENSIONS = {'.prg': 'prg', '.hex': 'hex', '.ihx': 'hex', '.o65': 'o65'}
+
+def guess_format(path, data):
+    if bytes(data[:6]) == O65_MAGIC:
+        return 'o65'
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'raw')
+
+## Loading.
+def load_image(cpu, image, reset_vector=None, BRK_vector=None):
+    """ Copy the image's segments into the CPU's RAM and, if given (an
+    address, or ENTRY), set the reset and BRK vectors. """
+    for address, data in image.segments:
+        cpu.load(address, data)
+    for vector, address in ((RESET_VECTOR, reset_vector), (BRK_VECTOR, BRK_vector)):
+        if address is ENTRY:
+            if image.entry is None:
+                raise ValueError("The image has no entry point")
+            address = image.entry
+        if address is not None:
+            cpu.load(vector, bytes([address & 0xFF, (address >> 8) & 0xFF]))
+
+@contextmanager
+def mapped(path):
+    """ The contents of the file: memory-mapped if it's large. """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < MMAP_THRESHOLD:
+            yield file.read()
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+            yield contents
+
+def load_file(cpu, path, file_format=None, address=0x0000, reset_vector=None, BRK_vector=None):
+    """ Load a file into the CPU. The format ('raw', 'prg', 'hex' or
+    'o65') is guessed from the contents and file name if not given;
+    address is only used for raw files. Returns what was loaded where. """
+    with mapped(path) as contents:
+        file_format = file_format or guess_format(path, contents)
+        if file_format == 'raw':
+            image = read_raw(contents, address)
+        else:
+            image = FORMATS[file_format](contents)
+        try:
+            load_image(cpu, image, reset_vector, BRK_vector)
+            return Loaded([(segment.address, segment.address + len(segment.data))
+                           for segment in image.segments], image.entry)
+        finally:
+            # The views into a mapped file must go before the file is closed.
+            for segment in image.segments:
+                if isinstance(segment.data, memoryview):
+                    segment.data.release()
@@ -0,0 +1,207 @@
+# py6502: many CPUs running the same program, in lockstep, with NumPy.
+#
+# Registers are kept as arrays (one element per CPU) and RAM as a
+# (CPUs, memory size) array. Every step fetches the opcode of each CPU,
+# decodes them all with the same tables the CPU class uses, and then
+# applies each distinct opcode to the CPUs executing it at once.
+
+# pylint: disable=C0103
+
+import numpy as np
+
+from cpu import (CPU, AddressingModes, ADDRESSING_MODE_TABLE, COST_TABLE, LENGTH_TABLE,
+                 PAGE_CROSS_PENALTY, INSTRUCTION_NAMES, FLAG_CARRY, FLAG_DECIMAL,
+                 FLAG_INTERRUPT, FLAG_OVERFLOW, FLAG_SIGN, FLAG_ZERO)
+
+# The decode tables, as arrays.
+MODES = list(AddressingModes)
+MODE_TABLE = np.array([MODES.index(mode) for mode in ADDRESSING_MODE_TABLE], dtype=np.int8)
+COSTS = np.array(COST_TABLE, dtype=np.int64)
+LENGTHS = np.array(LENGTH_TABLE, dtype=np.int64)
+PENALTIES = np.array(PAGE_CROSS_PENALTY, dtype=np.int64)
+
+class LockstepCPUs():
+    """ `count` CPUs, stepped together. """
+    def __init__(self, count, memory_size = 65536):
+        self.count = count
+        self.ticks = np.zeros(count, dtype=np.int64)
+        # Signed and wider than the real registers, like the CPU
+        # class' Python ints (e.g. SP can go below 0).
+        self.PC, self.SP = np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.int64)
+        self.EA, self.RA = np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.int64)
+        self.A, self.X, self.Y = (np.zeros(count, dtype=np.int64) for _ in range(3))
+        self.STATUS = np.zeros(count, dtype=np.int64)
+        self.RAM = np.zeros((count, memory_size), dtype=np.uint8)
+        self.STACK_BASE = 0x100
+        self.rows = np.arange(count)
+
+    @classmethod
+    def from_CPUs(cls, cpus):
+        """ Start from the state of a list of CPU objects. """
+        lockstep = cls(len(cpus), len(cpus[0].RAM))
+        for index, cpu in enumerate(cpus):
+            lockstep.PC[index], lockstep.SP[index] = cpu.PC, cpu.SP
+            lockstep.A[index], lockstep.X[index], lockstep.Y[index] = cpu.A, cpu.X, cpu.Y
+            lockstep.STATUS[index] = cpu.read_P()
+            lockstep.EA[index], lockstep.RA[index] = cpu.EA, cpu.RA
+            lockstep.ticks[index] = cpu.ticks
+            lockstep.RAM[index] = np.frombuffer(cpu.memory, dtype=np.uint8)
+        return lockstep
+
+    def to_CPU(self, index):
+        """ A CPU object with the state of one of the CPUs. """
+        cpu = CPU(self.RAM.shape[1])
+        cpu.PC, cpu.SP = int(self.PC[index]), int(self.SP[index])
+        cpu.A, cpu.X, cpu.Y = int(self.A[index]), int(self.X[index]), int(self.Y[index])
+        cpu.write_P(int(self.STATUS[index]))
+        cpu.EA, cpu.RA = int(self.EA[index]), int(self.RA[index])
+        cpu.ticks = int(self.ticks[index])
+        cpu.load(0, self.RAM[index].tobytes())
+        return cpu
+
+    ## Memory and stack, for the CPUs in `rows`.
+    def read_RAM(self, rows, addresses):
+        return self.RAM[rows, addresses].astype(np.int64)
+
+    def write_RAM(self, rows, addresses, values):
+        self.RAM[rows, addresses] = values & 0xFF
+
+    def push_8bit(self, rows, values):
+        self.write_RAM(rows, self.STACK_BASE + self.SP[rows], values)
+        self.SP[rows] -= 1
+
+    def push_16bit(self, rows, values):
+        self.push_8bit(rows, (values & 0xFF00) >> 8)
+        self.push_8bit(rows, values & 0x00FF)
+
+    ## Execution.
+    def read_16bit(self, rows, low_addresses, high_addresses):
+        return self.read_RAM(rows, low_addresses) | self.read_RAM(rows, high_addresses) << 8
+
+    def compute_effective_address(self, rows, modes, penalties=None):
+        """ The vector version of CPU.compute_effective_address(). PC
+        points to the opcode, and is left there. """
+        operand = (self.PC[rows] + 1) & 0xFFFF
+        for mode_index in np.unique(modes).tolist():
+            mode = MODES[mode_index]
+            selected = modes == mode_index
+            where, address = rows[selected], operand[selected]
+            if mode == AddressingModes.IMMEDIATE:
+                self.EA[where] = address
+            elif mode == AddressingModes.ZERO_PAGE:
+                self.EA[where] = self.read_RAM(where, address)
+            elif mode == AddressingModes.ZERO_PAGE_X:
+                self.EA[where] = (self.read_RAM(where, address) + self.X[where]) & 0xFF
+            elif mode == AddressingModes.ZERO_PAGE_Y:
+                self.EA[where] = (self.read_RAM(where, address) + self.Y[where]) & 0xFF
+            elif mode == AddressingModes.RELATIVE:
+                RA = self.read_RAM(where, address)
+                self.RA[where] = np.where(RA & 0x80, RA | 0xFF00, RA)
+            elif mode == AddressingModes.ABSOLUTE:
+                self.EA[where] = self.read_16bit(where, address, (address + 1) & 0xFFFF)
+            elif mode == AddressingModes.INDIRECT:
+                pointer = self.read_16bit(where, address, (address + 1) & 0xFFFF)
+                self.EA[where] = self.read_16bit(where, pointer,
+                                                 (pointer & 0xFF00) | ((pointer + 1) & 0xFF))
+            elif mode == AddressingModes.INDIRECT_X:
+                pointer = (self.read_RAM(where, address) + self.X[where]) & 0xFF
+                self.EA[where] = self.read_16bit(where, pointer, (pointer + 1) & 0xFF)
+            elif mode in (AddressingModes.ABSOLUTE_X, AddressingModes.ABSOLUTE_Y,
+                          AddressingModes.INDIRECT_Y):
+                if mode == AddressingModes.INDIRECT_Y:
+                    pointer = self.read_RAM(where, address)
+                    base = self.read_16bit(where, pointer, (pointer + 1) & 0xFF)
+                else:
+                    base = self.read_16bit(where, address, (address + 1) & 0xFFFF)
+                index = self.X if mode == AddressingModes.ABSOLUTE_X else self.Y
+                self.EA[where] = (base + index[where]) & 0xFFFF
+                if penalties is not None:
+                    crossed = ((base ^ self.EA[where]) & 0xFF00) != 0
+                    self.ticks[where] += penalties[selected] * crossed
+
+    def step(self, rows=None):
+        """ Execute one instruction on each of the CPUs in rows
+        (an array of indexes; by default, all of them). """
+        if rows is None:
+            rows = self.rows
+        opcodes = self.RAM[rows, self.PC[rows]]
+        distinct = np.unique(opcodes)
+        for opcode in distinct.tolist():
+            if opcode not in INSTRUCTION_NAMES:
+                raise NotImplementedError(f"Instruction 0x{opcode:02X} not implemented yet!")
+
+        self.compute_effective_address(rows, MODE_TABLE[opcodes], PENALTIES[opcodes])
+        self.PC[rows] = (self.PC[rows] + LENGTHS[opcodes]) & 0xFFFF
+        for opcode in distinct.tolist():
+            getattr(self, INSTRUCTION_NAMES[opcode])(rows[opcodes == opcode])
+        self.ticks[rows] += COSTS[opcodes]
+
+    def run(self, max_cycles=None, until_pc=None):
+        """ Step every CPU until it has spent max_cycles ticks, or
+        reached until_pc. Returns the instructions each one executed. """
+        limit = self.ticks + max_cycles if max_cycles is not None else None
+        instructions = np.zeros(self.count, dtype=np.int64)
+        while True:
+            running = np.ones(self.count, dtype=bool)
+            if limit is not None:
+                running &= self.ticks < limit
+            if until_pc is not None:
+                running &= self.PC != until_pc
+            rows = self.rows[running]
+            if len(rows) == 0:
+                return instructions
+            self.step(rows)
+            instructions[rows] += 1
+
+    ## The instructions themselves
+    def BRK(self, rows):
+        self.PC[rows] += 1
+        self.push_16bit(rows, self.PC[rows])
+        self.push_8bit(rows, self.STATUS[rows])
+        self.PC[rows] = self.read_RAM(rows, 0xFFFF) << 8 | self.read_RAM(rows, 0xFFFE)
+
+    def NOP(self, rows):
+        pass
+
+    def CLC(self, rows):
+        self.STATUS[rows] &= ~FLAG_CARRY
+
+    def CLD(self, rows):
+        self.STATUS[rows] &= ~FLAG_DECIMAL
+
+    def CLI(self, rows):
+        self.STATUS[rows] &= ~FLAG_INTERRUPT
+
+    def CLV(self, rows):
+        self.STATUS[rows] &= ~FLAG_OVERFLOW
+
+    def branch(self, rows, taken):
+        """ Branch the CPUs in rows for which taken is true. """
+        rows = rows[taken]
+        target = (self.PC[rows] + self.RA[rows]) & 0xFFFF
+        self.ticks[rows] += np.where((self.PC[rows] ^ target) & 0xFF00, 2, 1)
+        self.PC[rows] = target
+
+    def BPL(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_SIGN == 0)
+
+    def BMI(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_SIGN != 0)
+
+    def BVC(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_OVERFLOW == 0)
+
+    def BVS(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_OVERFLOW != 0)
+
+    def BCC(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_CARRY == 0)
+
+    def BCS(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_CARRY != 0)
+
+    def BNE(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_ZERO == 0)
+
+    def BEQ(self, rows):
+        self.branch(rows, self.STATUS[rows] & FLAG_ZERO != 0)
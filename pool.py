@@ -0,0 +1,57 @@
+# py6502: reusing CPUs.
+#
+# Short-lived jobs shouldn't pay for building a CPU each time. A CPUPool
+# keeps the CPUs that have been given back, and hands them out again
+# after a hard_reset(), which copies a template image over the whole RAM
+# at once. Translating CPUs keep the blocks that are still valid, so a
+# pool running the same program over and over translates it once.
+#
+#   pool = CPUPool(TranslatingCPU)
+#   with pool.cpu(template) as cpu:
+#       cpu.reset_CPU()
+#       cpu.run(max_cycles=10_000)
+
+# pylint: disable=C0103
+
+from contextlib import contextmanager
+
+from cpu import CPU
+
+class CPUPool():
+    """ CPUs of cpu_class, given out by acquire() (or cpu()) and taken
+    back by release(). Up to max_idle of them are kept for reuse; size
+    of them are built up front. """
+    def __init__(self, cpu_class=CPU, size=0, max_idle=64, memory_size=65536):
+        self.cpu_class = cpu_class
+        self.memory_size = memory_size
+        self.max_idle = max_idle
+        self.idle = [cpu_class(memory_size) for _ in range(size)]
+        self.created, self.reused = size, 0
+
+    def acquire(self, template=None):
+        """ A CPU as good as new, with template (a bytes-like object as
+        big as RAM) in RAM, or zeroes. See CPU.hard_reset(). """
+        if self.idle:
+            cpu = self.idle.pop()  # The last one back: its translations are the freshest.
+            cpu.hard_reset(template)
+            self.reused += 1
+            return cpu
+        cpu = self.cpu_class(self.memory_size)
+        self.created += 1
+        if template is not None:
+            cpu.hard_reset(template)
+        return cpu
+
+    def release(self, cpu):
+        """ Give a CPU back. It mustn't be used anymore. """
+        if len(self.idle) < self.max_idle:
+            self.idle.append(cpu)
+
+    @contextmanager
+    def cpu(self, template=None):
+        """ acquire() a CPU for the duration of a with block. """
+        cpu = self.acquire(template)
+        try:
+            yield cpu
+        finally:
+            self.release(cpu)
@@ -0,0 +1,129 @@
+# py6502: an execution profiler.
+#
+# profiler = Profiler(); profiler.attach(cpu) and then run the CPU.
+# It counts, per opcode and per address, how often each instruction
+# was executed and how many ticks it took, reads and writes per RAM
+# page, and a call graph following JSR/RTS (and BRK/RTI), which can
+# be exported as folded stacks for flamegraph.pl and similar tools.
+#
+# With no profiler attached, a CPU pays one check per instruction.
+
+# pylint: disable=C0103
+
+from array import array
+from collections import defaultdict
+
+from cpu import INSTRUCTION_NAMES
+
+JSR, RTS, BRK, RTI = 0x20, 0x60, 0x00, 0x40
+
+def _counters(size):
+    return array('Q', bytes(8 * size))
+
+class Profiler():
+    """ Collects execution statistics from the CPUs it's attached to. """
+    def __init__(self, symbols=None):
+        self.opcode_counts, self.opcode_cycles = _counters(0x100), _counters(0x100)
+        self.address_counts, self.address_cycles = _counters(0x10000), _counters(0x10000)
+        self.page_reads, self.page_writes = _counters(0x100), _counters(0x100)
+        self.symbols = symbols or {}  # Address -> subroutine name.
+
+        # Call graph: each CPU's current call stack, and the (exclusive)
+        # ticks spent with each call stack, all CPUs together.
+        self.stacks = {}  # CPU -> its call stack.
+        self.folded = defaultdict(int)
+        self.last_ticks = {}  # CPU -> its ticks after the last instruction.
+
+    def attach(self, cpu):
+        """ Start profiling the CPU. """
+        cpu.profiler = self
+        self.last_ticks[cpu] = cpu.ticks
+        self.stacks[cpu] = ['main']
+
+        # RAM accesses are counted by wrapping the CPU's methods, so
+        # that nothing is paid for when there is no profiler.
+        read_RAM, write_RAM = cpu.read_RAM, cpu.write_RAM
+        page_reads, page_writes = self.page_reads, self.page_writes
+
+        def profiled_read_RAM(address):
+            page_reads[address >> 8] += 1
+            return read_RAM(address)
+
+        def profiled_write_RAM(address, value):
+            page_writes[address >> 8] += 1
+            write_RAM(address, value)
+
+        cpu.read_RAM, cpu.write_RAM = profiled_read_RAM, profiled_write_RAM
+
+    def detach(self, cpu):
+        """ Stop profiling the CPU. """
+        self.forget(cpu)
+        self.last_ticks.pop(cpu, None)
+        self.stacks.pop(cpu, None)
+
+    def forget(self, cpu):
+        """ Take the profiler (and its wrappers, which would still count,
+        and access, the original's RAM) out of a fork of its CPU. """
+        cpu.profiler = None
+        del cpu.read_RAM, cpu.write_RAM
+
+    def name(self, address):
+        return self.symbols.get(address, f"sub_{address:04X}")
+
+    def instruction(self, cpu, PC, opcode):
+        """ Called by the CPU after executing the instruction at PC. """
+        cycles = cpu.ticks - self.last_ticks.get(cpu, 0)
+        self.last_ticks[cpu] = cpu.ticks
+
+        self.opcode_counts[opcode] += 1
+        self.opcode_cycles[opcode] += cycles
+        self.address_counts[PC] += 1
+        self.address_cycles[PC] += cycles
+
+        # The call itself counts for the caller, the return for the callee.
+        stack = self.stacks.setdefault(cpu, ['main'])
+        self.folded[tuple(stack)] += cycles
+        if opcode in (JSR, BRK):
+            stack.append(self.name(cpu.PC))
+        elif opcode in (RTS, RTI) and len(stack) > 1:
+            stack.pop()
+
+    ## Reports.
+    def subroutine_cycles(self):
+        """ {subroutine: (inclusive ticks, exclusive ticks)} """
+        inclusive, exclusive = defaultdict(int), defaultdict(int)
+        for stack, cycles in self.folded.items():
+            exclusive[stack[-1]] += cycles
+            for name in set(stack):  # Recursion only counts once.
+                inclusive[name] += cycles
+        return {name: (inclusive[name], exclusive[name]) for name in inclusive}
+
+    def folded_stacks(self):
+        """ The call graph, as lines of "main;caller;callee ticks". """
+        return [f"{';'.join(stack)} {cycles}"
+                for stack, cycles in sorted(self.folded.items()) if cycles]
+
+    def write_folded_stacks(self, stream):
+        for line in self.folded_stacks():
+            stream.write(line + "\n")
+
+    def hottest_addresses(self, count=10):
+        """ The `count` addresses that took the most ticks, as
+        (address, executions, ticks) tuples. """
+        cycles = self.address_cycles
+        addresses = sorted(range(0x10000), key=cycles.__getitem__, reverse=True)[:count]
+        return [(address, self.address_counts[address], cycles[address])
+                for address in addresses if cycles[address]]
+
+    def report(self, count=10):
+        """ A short, human-readable, summary. """
+        lines = ["opcode  name  executions       ticks"]
+        opcodes = sorted(range(0x100), key=self.opcode_cycles.__getitem__, reverse=True)
+        for opcode in opcodes[:count]:
+            if self.opcode_counts[opcode]:
+                lines.append(f"  0x{opcode:02X}  {INSTRUCTION_NAMES.get(opcode, '???'):<4}"
+                             f"{self.opcode_counts[opcode]:>12}{self.opcode_cycles[opcode]:>12}")
+        lines.append("address  executions       ticks")
+        for address, executions, cycles in self.hottest_addresses(count):
+            lines.append(f"   {address:04X}{executions:>13}{cycles:>12}")
+        return "\n".join(lines)
@@ -0,0 +1,63 @@
+# py6502: timed events.
+#
+# Peripherals ask the Scheduler to call them back at a given tick
+# (e.g. a timer underflowing, a byte arriving on a serial line), and
+# raise IRQ/NMI from there. The events are kept in a heap; the CPU only
+# compares its ticks with the next event's, once per instruction.
+
+# pylint: disable=C0103
+
+import heapq
+from itertools import count
+
+class Event():
+    """ A scheduled callback. Returned by schedule(), for cancel(). """
+    __slots__ = ('cycle', 'callback', 'cancelled')
+
+    def __init__(self, cycle, callback):
+        self.cycle, self.callback, self.cancelled = cycle, callback, False
+
+class Scheduler():
+    """ The events scheduled for a CPU. """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.events = []  # Heap of (cycle, sequence, Event)
+        self.sequence = count()  # Events due on the same tick fire in order.
+        cpu.scheduler = self
+
+    def schedule(self, cycle, callback):
+        """ Call callback(cpu) when cpu.ticks reaches cycle. """
+        event = Event(cycle, callback)
+        heapq.heappush(self.events, (cycle, next(self.sequence), event))
+        if cycle < self.cpu.next_event:
+            self.cpu.next_event = cycle
+        return event
+
+    def after(self, cycles, callback):
+        """ Call callback(cpu) `cycles` ticks from now. """
+        return self.schedule(self.cpu.ticks + cycles, callback)
+
+    def cancel(self, event):
+        event.cancelled = True
+
+    def service(self):
+        """ Fire every event that's due, and tell the CPU when the next one is. """
+        cpu, events = self.cpu, self.events
+        while events and events[0][0] <= cpu.ticks:
+            event = heapq.heappop(events)[2]
+            if not event.cancelled:
+                event.callback(cpu)
+        while events and events[0][2].cancelled:
+            heapq.heappop(events)
+        if events and events[0][0] < cpu.next_event:
+            cpu.next_event = events[0][0]
+
+    def fork(self, cpu):
+        """ A copy of this scheduler, for a fork of the CPU. The
+        callbacks themselves are shared. """
+        clone = Scheduler.__new__(Scheduler)
+        clone.cpu, clone.sequence = cpu, count(next(self.sequence))
+        clone.events = [(cycle, sequence, Event(event.cycle, event.callback))
+                        for cycle, sequence, event in self.events if not event.cancelled]
+        heapq.heapify(clone.events)
+        return clone
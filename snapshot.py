@@ -0,0 +1,161 @@
+# py6502: save states.
+#
+# A save state is a small header (magic, format version, registers,
+# ticks and RAM size) followed by the RAM itself. For rewinding inside
+# the same process, CPU.fork() and CPU.restore() are faster still.
+#
+# Checkpoints keeps a series of in-process checkpoints where, thanks to
+# the CPU's dirty pages, each one only stores the pages written to since
+# the one before. diff_states() tells what's different between two CPUs.
+
+# pylint: disable=C0103
+
+from collections import namedtuple
+import struct
+
+MAGIC = b'P65S'
+VERSION = 1
+
+# Magic, version, PC, SP, A, X, Y, STATUS, ticks, EA, RA, RAM size.
+HEADER = struct.Struct('<4sBHBBBBBQHHI')
+
+def save_state(cpu):
+    """ Return the state of the CPU, as bytes. """
+    header = HEADER.pack(MAGIC, VERSION, cpu.PC, cpu.SP & 0xFF, cpu.A, cpu.X, cpu.Y,
+                         cpu.read_P(), cpu.ticks, cpu.EA, cpu.RA, len(cpu.RAM))
+    return header + cpu.memory
+
+def load_state(cpu, state):
+    """ Restore a state returned by save_state() into the CPU. """
+    state = memoryview(state)
+    if len(state) < HEADER.size:
+        raise ValueError("Truncated save state")
+    (magic, version, PC, SP, A, X, Y, STATUS,
+     ticks, EA, RA, memory_size) = HEADER.unpack_from(state)
+    if magic != MAGIC:
+        raise ValueError("Not a save state")
+    if version != VERSION:
+        raise ValueError(f"Unsupported save state version {version}")
+    if memory_size != len(cpu.RAM) or len(state) != HEADER.size + memory_size:
+        raise ValueError("Save state doesn't match the CPU's RAM size")
+
+    cpu.PC, cpu.SP, cpu.A, cpu.X, cpu.Y = PC, SP, A, X, Y
+    cpu.write_P(STATUS)
+    cpu.ticks, cpu.EA, cpu.RA = ticks, EA, RA
+    cpu.load(0, state[HEADER.size:])
+
+## Incremental checkpoints.
+
+# registers: the values of CPU.STATE. interrupts: IRQ_lines, NMI_pending
+# and next_event. scheduler: a copy of the CPU's, or None. pages: {page
+# number: contents}.
+Checkpoint = namedtuple('Checkpoint', 'registers interrupts scheduler pages')
+
+class Checkpoints():
+    """ Checkpoints of a CPU. The first one holds all of RAM, and every
+    other one only the pages written to since the previous one. """
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.checkpoints = []
+        cpu.mark_dirty(0, len(cpu.RAM))
+        self.take()
+
+    def __len__(self):
+        return len(self.checkpoints)
+
+    def take(self):
+        """ Take a checkpoint. Returns its index. """
+        cpu = self.cpu
+        memory = cpu.memory
+        pages = {page: bytes(memory[page << 8:(page + 1) << 8])
+                 for page in cpu.clear_dirty_pages()}
+        registers = tuple(getattr(cpu, register) for register in cpu.STATE)
+        interrupts = (cpu.IRQ_lines, cpu.NMI_pending, cpu.next_event)
+        scheduler = cpu.scheduler.fork(cpu) if cpu.scheduler is not None else None
+        self.checkpoints.append(Checkpoint(registers, interrupts, scheduler, pages))
+        return len(self.checkpoints) - 1
+
+    def page(self, index, page):
+        """ The contents of a page, as of checkpoint index. """
+        for previous in range(index, -1, -1):
+            contents = self.checkpoints[previous].pages.get(page)
+            if contents is not None:
+                return contents
+        raise IndexError(f"No page 0x{page:02X} in the checkpoints")
+
+    def _index(self, index):
+        if not -len(self.checkpoints) <= index < len(self.checkpoints):
+            raise IndexError(f"No checkpoint {index}")
+        return index % len(self.checkpoints)
+
+    def restore(self, index):
+        """ Put the CPU back as it was at checkpoint index, pending
+        interrupts and scheduled events included (like CPU.restore()).
+        Only the pages written to since then are copied back. """
+        cpu = self.cpu
+        index = self._index(index)
+        pages = set(cpu.clear_dirty_pages())
+        for checkpoint in self.checkpoints[index + 1:]:
+            pages.update(checkpoint.pages)
+        for page in sorted(pages):
+            cpu.load(page << 8, self.page(index, page))  # Marks them dirty again.
+        checkpoint = self.checkpoints[index]
+        for register, value in zip(cpu.STATE, checkpoint.registers):
+            setattr(cpu, register, value)
+        cpu.IRQ_lines, cpu.NMI_pending, cpu.next_event = checkpoint.interrupts
+        # A copy, so that the checkpoint can be restored again.
+        cpu.scheduler = checkpoint.scheduler.fork(cpu) if checkpoint.scheduler is not None else None
+
+    def changes(self, index):
+        """ The (start, end) ranges of RAM that changed between checkpoint
+        index - 1 and index. The first checkpoint has nothing to be
+        compared with. """
+        index = self._index(index)
+        if index == 0:
+            raise ValueError("The first checkpoint has no changes")
+        ranges = []
+        for page in sorted(self.checkpoints[index].pages):
+            _diff_page(ranges, page << 8, self.page(index - 1, page),
+                       self.checkpoints[index].pages[page])
+        return ranges
+
+## Diffs.
+
+# registers: {name: (value in a, value in b)} for the registers that
+# differ. ranges: the (start, end) ranges of RAM that differ.
+Diff = namedtuple('Diff', 'registers ranges')
+
+def _diff_page(ranges, start, old, new):
+    """ Append the ranges where old and new (starting at address start)
+    differ to ranges, merging them with the last one if they touch. """
+    if old == new:
+        return
+    for offset, (old_value, new_value) in enumerate(zip(old, new)):
+        if old_value != new_value:
+            address = start + offset
+            if ranges and ranges[-1][1] == address:
+                ranges[-1] = (ranges[-1][0], address + 1)
+            else:
+                ranges.append((address, address + 1))
+
+def diff_memory(a, b):
+    """ The (start, end) ranges where two bytes-like objects of the same
+    size differ. Equal pages are skipped at memcmp speed. """
+    a, b = memoryview(a), memoryview(b)
+    ranges = []
+    for start in range(0, len(a), 0x100):
+        _diff_page(ranges, start, a[start:start + 0x100], b[start:start + 0x100])
+    return ranges
+
+def _registers(cpu):
+    registers = {register: getattr(cpu, register) for register in cpu.STATE}
+    registers['P'] = cpu.read_P()
+    del registers['NZ']  # Folded into P.
+    return registers
+
+def diff_states(a, b):
+    """ What's different between two CPUs (e.g. one and a fork of it). """
+    a_registers, b_registers = _registers(a), _registers(b)
+    registers = {register: (value, b_registers[register])
+                 for register, value in a_registers.items() if value != b_registers[register]}
+    return Diff(registers, diff_memory(a.memory, b.memory))
@@ -16,6 +16,23 @@ class TestCPU():
             self.cpu_under_test.write_RAM(i, i & 0xFF) # Get the lowest byte
             assert self.cpu_under_test.read_RAM(i) == (i & 0xFF)
 
+    def test_RAM_bulk_load_dump_fill(self):
+        image = bytes(range(0x100)) * 4
+        self.cpu_under_test.load(0x8000, image)
+        assert self.cpu_under_test.dump(0x8000, 0x8400) == image
+        assert self.cpu_under_test.read_RAM(0x8042) == 0x42
+
+        self.cpu_under_test.fill(0x8000, 0x8100, 0x1EA)
+        assert self.cpu_under_test.dump(0x8000, 0x8100) == b'\xEA' * 0x100
+        assert self.cpu_under_test.read_RAM(0x8100) == 0x00
+
+        # The RAM never grows.
+        with pytest.raises(IndexError):
+            self.cpu_under_test.load(0xFFFF, b'\x01\x02')
+        with pytest.raises(IndexError):
+            self.cpu_under_test.fill(0xFF00, 0x10001)
+        assert len(self.cpu_under_test.RAM) == 0x10000
+
     def test_CPU_reset(self):
         # On reset, the 6502 reads the PC from 0xFFFC and 0xFFFD.
         self.cpu_under_test.write_RAM(0xFFFD, 0xCA)
@@ -177,6 +194,46 @@ class TestCPU():
         assert addressing_mode == cpu.AddressingModes.IMPLIED
         assert cost == 2
     
+    def test_decode_table(self):
+        # The table agrees with the find_* lookups, for every opcode.
+        for opcode in range(0x100):
+            handler, addressing_mode, cost, length, penalty = self.cpu_under_test.decode_table[opcode]
+            assert addressing_mode == self.cpu_under_test.find_addressing_mode(opcode)
+            assert cost == self.cpu_under_test.find_instruction_cost(opcode)
+            assert length == self.cpu_under_test.find_instruction_length(opcode)
+            assert penalty == self.cpu_under_test.find_page_cross_penalty(opcode)
+            if handler is not None:
+                assert self.cpu_under_test.find_instruction(opcode) == getattr(self.cpu_under_test, handler.__name__)
+
+        # It's built once, and shared by every CPU.
+        assert cpu.CPU().decode_table is self.cpu_under_test.decode_table
+
+    def test_step_advances_PC_by_length(self):
+        for opcode in [0x18, 0x58, 0x80, 0xB8, 0xD8, 0xEA]:
+            self.cpu_under_test.PC = 0x0200
+            self.cpu_under_test.write_RAM(0x0200, opcode)
+            self.cpu_under_test.step()
+            assert self.cpu_under_test.PC == 0x0200 + self.cpu_under_test.find_instruction_length(opcode)
+
+    def test_run(self, capsys):
+        self.cpu_under_test.fill(0x0200, 0x0300, 0xEA)  # A sea of NOPs.
+
+        # Run for a number of ticks...
+        self.cpu_under_test.PC = 0x0200
+        assert self.cpu_under_test.run(max_cycles=20) == (10, 20)
+        assert self.cpu_under_test.PC == 0x020A
+
+        # ... until PC reaches an address...
+        self.cpu_under_test.PC = 0x0200
+        assert self.cpu_under_test.run(until_pc=0x0205) == (5, 10)
+
+        # ... or until something we are looking for happens.
+        self.cpu_under_test.PC = 0x0200
+        assert self.cpu_under_test.run(until=lambda c: c.PC >= 0x0210) == (16, 32)
+
+        # And nothing gets printed.
+        assert capsys.readouterr().out == ""
+
     # imp, acc don't change ea, so they are not tested.
     def test_find_effective_address_imm(self):
         # Immediate. EA <- PC+1
@@ -226,18 +283,48 @@ class TestCPU():
         assert self.cpu_under_test.EA == self.cpu_under_test.read_RAM(target_EA)
     
     def test_find_effective_address_abs(self):
-        # Absolute mode. EA <- RAM[PC, PC+1]    
+        # Absolute mode. EA <- RAM[PC+1, PC+2]
         for position in range(0, 65536):
             value = position & 0xFF
             self.cpu_under_test.write_RAM(position, value)
         
         self.cpu_under_test.PC = 0x4040
-        target_EA_low = self.cpu_under_test.read_RAM(self.cpu_under_test.PC)
-        target_EA_high = self.cpu_under_test.read_RAM(self.cpu_under_test.PC + 1)
+        target_EA_low = self.cpu_under_test.read_RAM(self.cpu_under_test.PC + 1)
+        target_EA_high = self.cpu_under_test.read_RAM(self.cpu_under_test.PC + 2)
         target_EA = (target_EA_high << 8) | target_EA_low
         
         self.cpu_under_test.compute_effective_address(cpu.AddressingModes.ABSOLUTE)
         assert self.cpu_under_test.EA == target_EA
+
+    def test_find_effective_address_indexed(self):
+        modes = cpu.AddressingModes
+        self.cpu_under_test.load(0x0201, bytes([0xF0, 0x12]))  # Operand: 0x12F0
+        self.cpu_under_test.load(0x0080, bytes([0xF0, 0x12, 0x34, 0x56]))  # Pointers
+        self.cpu_under_test.load(0x12FF, bytes([0x78, 0x9A]))
+        self.cpu_under_test.write_RAM(0x1200, 0xBC)
+        self.cpu_under_test.X, self.cpu_under_test.Y = 0x02, 0x10
+
+        # (mode, operand byte, EA, ticks with a penalty of 1)
+        for mode, operand, EA, ticks in [(modes.ABSOLUTE_X, 0xF0, 0x12F2, 0),
+                                          (modes.ABSOLUTE_Y, 0xF0, 0x1300, 1),
+                                          (modes.INDIRECT_X, 0x80, 0x5634, 0),
+                                          (modes.INDIRECT_Y, 0x80, 0x1300, 1),
+                                          (modes.INDIRECT, 0xFF, 0xBC78, 0)]:
+            self.cpu_under_test.write_RAM(0x0201, operand)
+            self.cpu_under_test.PC, self.cpu_under_test.ticks = 0x0200, 0
+            self.cpu_under_test.compute_effective_address(mode, 1)
+            assert self.cpu_under_test.EA == EA, mode
+            assert self.cpu_under_test.ticks == ticks, mode
+            assert self.cpu_under_test.PC == 0x01FF + cpu.INSTRUCTION_LENGTHS[mode], mode
+
+    def test_page_cross_penalty(self):
+        assert self.cpu_under_test.find_page_cross_penalty(0xBD) == 1  # LDA abs,X
+        assert self.cpu_under_test.find_page_cross_penalty(0xB9) == 1  # LDA abs,Y
+        assert self.cpu_under_test.find_page_cross_penalty(0xB1) == 1  # LDA (ind),Y
+        assert self.cpu_under_test.find_page_cross_penalty(0x9D) == 0  # STA abs,X
+        assert self.cpu_under_test.find_page_cross_penalty(0x91) == 0  # STA (ind),Y
+        assert self.cpu_under_test.find_page_cross_penalty(0xFE) == 0  # INC abs,X
+        assert self.cpu_under_test.find_page_cross_penalty(0xA1) == 0  # LDA (ind,X)
         
     ##### INSTRUCTION TESTS
 
@@ -265,3 +352,101 @@ class TestCPU():
         self.cpu_under_test.CLV()
         assert (self.cpu_under_test.STATUS.value & cpu.StatusRegister.OVERFLOW.value) == 0
 
+    def test_lazy_NZ_flags(self):
+        self.cpu_under_test.STATUS = cpu.StatusRegister.CARRY | cpu.StatusRegister.ZERO
+        assert self.cpu_under_test.P == 0x03
+
+        # An instruction sets N and Z just by storing its result...
+        self.cpu_under_test.NZ = 0x80
+        assert self.cpu_under_test.P == 0x03  # ... so P itself is out of date...
+        # ... until somebody reads the flags.
+        assert self.cpu_under_test.read_P() == 0x81
+        assert self.cpu_under_test.STATUS == cpu.StatusRegister.SIGN | cpu.StatusRegister.CARRY
+
+        self.cpu_under_test.NZ = 0x100  # Only the low byte counts.
+        assert self.cpu_under_test.STATUS == cpu.StatusRegister.ZERO | cpu.StatusRegister.CARRY
+
+        # BRK pushes the up to date flags.
+        self.cpu_under_test.SP = 0xFD
+        self.cpu_under_test.NZ = 0x01
+        self.cpu_under_test.BRK()
+        assert self.cpu_under_test.pop_8bit() == 0x01
+
+        # Writing the whole register replaces the pending result.
+        self.cpu_under_test.write_P(0x82)
+        assert self.cpu_under_test.NZ is None
+        assert self.cpu_under_test.STATUS == cpu.StatusRegister.SIGN | cpu.StatusRegister.ZERO
+
+    def test_branches(self):
+        flags = cpu.StatusRegister
+        for opcode, flag, taken_if_set in [(0x10, flags.SIGN, False), (0x30, flags.SIGN, True),
+                                           (0x50, flags.OVERFLOW, False), (0x70, flags.OVERFLOW, True),
+                                           (0x90, flags.CARRY, False), (0xB0, flags.CARRY, True),
+                                           (0xD0, flags.ZERO, False), (0xF0, flags.ZERO, True)]:
+            for is_set in (False, True):
+                # (offset, PC if taken, ticks if taken)
+                for offset, target, ticks in [(0x10, 0x0292, 3), (0x80, 0x0202, 3),
+                                              (0x7F, 0x0301, 4), (0xF0, 0x0272, 3)]:
+                    self.cpu_under_test.load(0x0280, bytes([opcode, offset]))
+                    self.cpu_under_test.PC, self.cpu_under_test.ticks = 0x0280, 0
+                    self.cpu_under_test.STATUS = flag if is_set else flags.NOTHING
+                    self.cpu_under_test.step()
+                    if is_set == taken_if_set:
+                        assert (self.cpu_under_test.PC, self.cpu_under_test.ticks) == (target, ticks)
+                    else:
+                        assert (self.cpu_under_test.PC, self.cpu_under_test.ticks) == (0x0282, 2)
+
+        # N and Z are read from a pending result, without updating P.
+        self.cpu_under_test.load(0x0280, bytes([0xF0, 0x10, 0x30, 0x10]))  # BEQ, BMI
+        for NZ, PC in [(0x00, 0x0292), (0x100, 0x0292), (0x80, 0x0294), (0x01, 0x0284)]:
+            self.cpu_under_test.PC, self.cpu_under_test.P = 0x0280, 0x00
+            self.cpu_under_test.NZ = NZ
+            self.cpu_under_test.step()
+            if self.cpu_under_test.PC == 0x0282:
+                self.cpu_under_test.step()
+            assert self.cpu_under_test.PC == PC
+            assert self.cpu_under_test.P == 0x00
+
+    def test_cycle_counts(self):
+        # CLC / BCC (taken, to the next page) / NOP / BCS (not taken) /
+        # BNE (taken, same page) / NOP
+        self.cpu_under_test.load(0x02FA, bytes([0x18, 0x90, 0x10]))
+        self.cpu_under_test.load(0x030D, bytes([0xEA, 0xB0, 0x02, 0xD0, 0xF0]))
+        self.cpu_under_test.write_RAM(0x0302, 0xEA)
+        self.cpu_under_test.STATUS = 0
+        self.cpu_under_test.PC = 0x02FA
+        assert self.cpu_under_test.run(until_pc=0x0303) == (6, 2 + 4 + 2 + 2 + 3 + 2)
+
+
+    def test_hooks(self):
+        # A native multiply, in place of a subroutine at 0x0300:
+        # RAM[0x12:0x14] <- RAM[0x10] * RAM[0x11]
+        def multiply(cpu_under_test):
+            product = cpu_under_test.read_RAM(0x10) * cpu_under_test.read_RAM(0x11)
+            cpu_under_test.write_RAM(0x12, product & 0xFF)
+            cpu_under_test.write_RAM(0x13, product >> 8)
+
+        self.cpu_under_test.fill(0x0200, 0x0400, 0xEA)
+        self.cpu_under_test.load(0x0010, bytes([200, 100]))
+        self.cpu_under_test.install_hook(0x0300, multiply, 50)
+
+        # As if "JSR $0300" at 0x0200 had just been executed.
+        self.cpu_under_test.SP = 0xFD
+        self.cpu_under_test.push_16bit(0x0202)
+        self.cpu_under_test.PC = 0x0300
+        assert self.cpu_under_test.run(until_pc=0x0204) == (2, 52)
+        assert self.cpu_under_test.dump(0x12, 0x14) == (200 * 100).to_bytes(2, 'little')
+        assert self.cpu_under_test.SP == 0xFD
+
+        # step() runs them, too.
+        self.cpu_under_test.push_16bit(0x0202)
+        self.cpu_under_test.PC = 0x0300
+        self.cpu_under_test.step()
+        assert self.cpu_under_test.PC == 0x0203
+
+        # Without hooks, there's nothing to look up.
+        self.cpu_under_test.remove_hook(0x0300)
+        assert self.cpu_under_test.hooks is None
+        self.cpu_under_test.PC = 0x0300
+        self.cpu_under_test.step()
+        assert self.cpu_under_test.PC == 0x0301
@@ -0,0 +1,42 @@
+# pylint: disable=C0103,E0401
+
+import batch
+import jit
+
+class TestBatch():
+
+    # NOPs, then a CLC, then more NOPs.
+    image = bytes([0xEA] * 8 + [0x18] + [0xEA] * 0x100)
+
+    def test_run_job(self):
+        job = batch.Job(self.image, 0x0200, reset_vector=0x0200, max_cycles=20,
+                        outputs=[(0x0200, 0x0210)])
+        result = batch.run_job(7, job)
+        assert result == batch.Result(7, 10, 20, 0x020A, [self.image[:0x10]], None)
+
+    def test_run_job_error(self):
+        job = batch.Job(bytes([0xEA, 0x02]), 0x0200, reset_vector=0x0200)
+        result = batch.run_job(0, job)
+        assert result.instructions == 0  # Lost when the exception was raised.
+        assert result.PC == 0x0201
+        assert "0x02" in result.error
+
+    def test_bad_job(self):
+        job = batch.Job(bytes(0x200), 0xFF00, reset_vector=0xFF00)  # Doesn't fit in RAM.
+        result = batch.run_job(3, job)
+        assert result.index == 3 and result.instructions == 0
+        assert result.error.startswith("IndexError: ")
+
+    def test_run_batch(self):
+        jobs = [batch.Job(self.image, 0x0200, 0x0200, max_cycles=2 * n, outputs=[(0x0208, 0x0209)])
+                for n in range(1, 21)]
+        jobs.append(batch.Job(bytes([0x02]), 0x0300, 0x0300))
+        jobs.append(batch.Job(bytes(0x200), 0xFF00, 0xFF00))
+
+        results = sorted(batch.run_batch(jobs, workers=2, cpu_class=jit.TranslatingCPU))
+        assert [result.index for result in results] == list(range(22))
+        for n, result in enumerate(results[:20], start=1):
+            assert (result.instructions, result.ticks, result.PC) == (n, 2 * n, 0x0200 + n)
+            assert result.outputs == [b'\x18']
+        assert results[20].error is not None
+        assert results[21].error.startswith("IndexError: ")
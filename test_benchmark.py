@@ -0,0 +1,45 @@
+# pylint: disable=C0103,E0401
+
+import json
+
+import benchmark
+
+class TestBenchmark():
+
+    def test_run_suite(self):
+        results = benchmark.run_suite(scale=0.01)
+        workloads = results['workloads']
+        assert set(workloads) == {'decode', 'RAM', 'straight_line', 'tight_loop', 'jsr_rts', 'memcpy'}
+
+        straight_line = workloads['straight_line']
+        assert straight_line['instructions'] == 10 * 0x100
+        assert straight_line['ticks'] == 2 * straight_line['instructions']
+        assert straight_line['instructions_per_second'] > 0
+
+        # Not everything can run yet.
+        for result in workloads.values():
+            assert 'skipped' in result or result['instructions'] > 0
+
+    def test_compare_to_baseline(self):
+        baseline = {'workloads': {'fast': {'instructions_per_second': 1000},
+                                  'slow': {'instructions_per_second': 1000},
+                                  'skipped': {'skipped': 'unimplemented opcodes: 0x02'}}}
+        results = {'workloads': {'fast': {'instructions_per_second': 950},
+                                 'slow': {'instructions_per_second': 800},
+                                 'skipped': {'instructions_per_second': 1}}}
+        assert benchmark.compare_to_baseline(results, baseline, 0.1) == [('slow', 1000, 800)]
+        assert benchmark.compare_to_baseline(results, baseline, 0.25) == []
+
+    def test_main(self, tmp_path, capsys):
+        output = tmp_path / "results.json"
+        assert benchmark.main(['--scale', '0.01', '--output', str(output)]) == 0
+        results = json.loads(output.read_text())
+        assert 'straight_line' in capsys.readouterr().out
+
+        # Pretend we used to be a million times faster.
+        for result in results['workloads'].values():
+            if 'instructions_per_second' in result:
+                result['instructions_per_second'] *= 1e6
+        output.write_text(json.dumps(results))
+        assert benchmark.main(['--scale', '0.01', '--baseline', str(output)]) == 1
+        assert 'REGRESSION' in capsys.readouterr().out
@@ -0,0 +1,85 @@
+# pylint: disable=C0103,E0401
+
+import bus
+import cpu
+import jit
+
+class Register(bus.Device):
+    """ Remembers what was written to it, and counts the reads. """
+    def __init__(self):
+        self.reads, self.writes = 0, []
+
+    def read(self, address):
+        self.reads += 1
+        return address & 0xFF
+
+    def write(self, address, value):
+        self.writes.append((address, value))
+
+class TestBus():
+
+    def test_device(self):
+        cpu_under_test = cpu.CPU()
+        register = Register()
+        cpu_under_test.map_device(register, 0xD0)
+
+        cpu_under_test.write_RAM(0xD012, 0x1FF)
+        assert register.writes == [(0xD012, 0xFF)]
+        assert cpu_under_test.read_RAM(0xD034) == 0x34
+        assert register.reads == 1
+        assert cpu_under_test.RAM[0xD012] == 0x00  # RAM was never touched.
+
+        # The other pages are still plain RAM.
+        cpu_under_test.write_RAM(0xD100, 0x42)
+        assert cpu_under_test.read_RAM(0xD100) == 0x42
+        assert register.reads == 1
+
+        cpu_under_test.unmap_device(0xD0)
+        cpu_under_test.write_RAM(0xD012, 0x42)
+        assert cpu_under_test.read_RAM(0xD012) == 0x42
+        assert len(register.writes) == 1
+
+    def test_ROM(self):
+        cpu_under_test = cpu.CPU()
+        cpu_under_test.map_ROM(0xE000, bytes([0xEA]) * 0x2000)
+        cpu_under_test.write_RAM(0xE123, 0x00)
+        assert cpu_under_test.read_RAM(0xE123) == 0xEA
+        assert cpu_under_test.read_pages[0xE1] is None  # Reads are plain RAM reads.
+
+    def test_mirror(self):
+        cpu_under_test = cpu.CPU()
+        cpu_under_test.map_device(bus.Mirror(cpu_under_test, 0x07FF), 0x08, 0x1F)
+        cpu_under_test.write_RAM(0x1842, 0x65)
+        assert cpu_under_test.read_RAM(0x0042) == 0x65
+        assert cpu_under_test.read_RAM(0x0842) == 0x65
+        assert cpu_under_test.RAM[0x1842] == 0x00
+
+    def test_banked_ROM(self):
+        for cls in (cpu.CPU, jit.TranslatingCPU):
+            cpu_under_test = cls()
+            banks = bus.BankedROM([bytes([0xEA]) * 0x1000, bytes([0x18]) * 0x1000], 0x8000)
+            cpu_under_test.map_device(banks, *banks.pages())
+
+            # Bank 0: NOPs.
+            cpu_under_test.STATUS = cpu.StatusRegister.CARRY
+            cpu_under_test.PC = 0x8000
+            assert cpu_under_test.run(until_pc=0x8004) == (4, 8)
+            assert cpu_under_test.STATUS == cpu.StatusRegister.CARRY
+
+            # Bank 1: CLCs.
+            cpu_under_test.write_RAM(0x8FFF, 1)
+            assert banks.bank_number == 1
+            cpu_under_test.PC = 0x8000
+            cpu_under_test.run(until_pc=0x8004)
+            assert cpu_under_test.STATUS == cpu.StatusRegister.NOTHING
+
+    def test_fork_keeps_devices(self):
+        cpu_under_test = cpu.CPU()
+        register = Register()
+        cpu_under_test.map_device(register, 0xD0)
+        clone = cpu_under_test.fork()
+        clone.unmap_device(0xD0)
+
+        assert cpu_under_test.read_pages[0xD0] is register
+        assert clone.read_pages[0xD0] is None
+        assert cpu.CPU().read_pages is cpu.NO_DEVICES
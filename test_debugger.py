@@ -0,0 +1,121 @@
+# pylint: disable=C0103,E0401
+
+import cpu
+import debugger
+import jit
+import scheduler
+
+BRK = {0x0220: b'\x00'}  # To the NOPs at 0x0300.
+
+class TestDebugger():
+
+    def test_breakpoints(self, make_CPU):
+        for cls in (cpu.CPU, jit.TranslatingCPU):
+            cpu_under_test = make_CPU(cls, code=BRK)
+            debug = debugger.Debugger(cpu_under_test)
+            debug.add_breakpoint(0x0210)
+            debug.add_breakpoint(0x0305)
+
+            assert cpu_under_test.run(max_cycles=1000) == (16, 32)
+            assert cpu_under_test.stop_reason == debugger.Stop('breakpoint', 0x0210, None)
+            # Running again carries on, to the next one.
+            cpu_under_test.run(max_cycles=1000)
+            assert cpu_under_test.stop_reason.address == cpu_under_test.PC == 0x0305
+
+            # Until there are none left.
+            debug.remove_breakpoint(0x0210)
+            debug.remove_breakpoint(0x0305)
+            assert debug.idle and cpu_under_test.breakpoints is None
+            cpu_under_test.PC = 0x0200
+            assert cpu_under_test.run(max_cycles=20) == (10, 20)
+            assert cpu_under_test.stop_reason is None
+
+    def test_conditional_breakpoint(self, make_CPU):
+        # loop: NOP / NOP / NOP / BCC loop, until an event changes X.
+        cpu_under_test = make_CPU(code=BRK)
+        cpu_under_test.load(0x0203, bytes([0x90, 0xFB]))
+        cpu_under_test.STATUS = 0
+        events = scheduler.Scheduler(cpu_under_test)
+        events.schedule(50, lambda c: setattr(c, 'X', 5))
+        debug = debugger.Debugger(cpu_under_test)
+        debug.add_breakpoint(0x0201, lambda c: c.X == 5)
+
+        cpu_under_test.run(max_cycles=1000)
+        assert cpu_under_test.stop_reason.cause == 'breakpoint'
+        assert cpu_under_test.PC == 0x0201
+        assert 50 <= cpu_under_test.ticks < 50 + 9
+
+    def test_watchpoints(self, make_CPU):
+        cpu_under_test = make_CPU(code=BRK)
+        debug = debugger.Debugger(cpu_under_test)
+        debug.add_watchpoint(0x01F0, 0x0200)  # Writes to the stack.
+        debug.add_watchpoint(0xFFFF, reads=True, writes=False)
+        assert cpu_under_test.read_pages[0x01] is None  # Reads aren't watched there.
+
+        # BRK pushes PC (high byte first) and stops after the instruction.
+        assert cpu_under_test.run(max_cycles=1000) == (33, 64 + 7)
+        assert cpu_under_test.stop_reason == debugger.Stop('write', 0x01FD, 0x02)
+        assert cpu_under_test.PC == 0x0300
+        assert cpu_under_test.dump(0x01FC, 0x01FE) == bytes([0x22, 0x02])  # Pushed PC.
+
+        # Reads go on to the RAM, or the device, behind them.
+        cpu_under_test.stop_reason = None
+        assert cpu_under_test.read_RAM(0xFFFF) == 0x03
+        assert cpu_under_test.stop_reason.cause == 'read'
+
+        debug.detach()
+        assert cpu_under_test.debugger is None
+        assert cpu_under_test.read_pages[0xFF] is None and cpu_under_test.write_pages[0x01] is None
+
+    def test_fork(self, make_CPU):
+        cpu_under_test = make_CPU(code=BRK)
+        debug = debugger.Debugger(cpu_under_test)
+        debug.add_breakpoint(0x0210)
+        debug.add_watchpoint(0x01FD)
+
+        clone = cpu_under_test.fork()
+        assert clone.debugger is None and clone.breakpoints is None
+        assert clone.write_pages[0x01] is None
+        clone.run(until_pc=0x0300)
+        assert clone.stop_reason is None
+        assert cpu_under_test.breakpoints is not None
+
+    def test_breakpoint_in_idle_loop(self, make_CPU):
+        for cls in (cpu.CPU, jit.TranslatingCPU):
+            cpu_under_test = make_CPU(cls, code=BRK)
+            cpu_under_test.load(0x0200, bytes([0xD0, 0xFE]))  # BNE *, with Z clear
+            cpu_under_test.STATUS = 0
+            cpu_under_test.idle_skip = True
+            debugger.Debugger(cpu_under_test).add_breakpoint(0x0200, lambda cpu: cpu.ticks >= 30)
+
+            assert cpu_under_test.run(max_cycles=1000) == (10, 30)
+            assert cpu_under_test.stop_reason.cause == 'breakpoint'
+            assert cpu_under_test.idle_skips == 0
+
+    def test_hard_reset(self, make_CPU):
+        cpu_under_test = make_CPU(code=BRK)
+        debug = debugger.Debugger(cpu_under_test)
+        debug.add_breakpoint(0x0210)
+        debug.add_watchpoint(0x0300)
+        cpu_under_test.hard_reset(bytes(cpu_under_test.RAM))
+        assert cpu_under_test.debugger is None and debug.idle
+
+        # The old debugger can still be used: it attaches itself again.
+        debug.add_breakpoint(0x0208)
+        cpu_under_test.PC = 0x0200
+        assert cpu_under_test.run(max_cycles=1000) == (8, 16)
+        assert cpu_under_test.stop_reason == debugger.Stop('breakpoint', 0x0208, None)
+
+    def test_breakpoint_between_slices(self, make_CPU):
+        # A breakpoint where a slice ends still stops the next slice.
+        for cls in (cpu.CPU, jit.TranslatingCPU):
+            cpu_under_test = make_CPU(cls)
+            debugger.Debugger(cpu_under_test).add_breakpoint(0x0232)
+            # The first slice of 100 cycles ends right on it.
+            assert cpu_under_test.run(max_cycles=100) == (50, 100)
+            assert cpu_under_test.stop_reason is None and cpu_under_test.PC == 0x0232
+            assert cpu_under_test.run(max_cycles=100) == (0, 0)
+            assert cpu_under_test.stop_reason == debugger.Stop('breakpoint', 0x0232, None)
+
+            # Running again carries on past it.
+            assert cpu_under_test.run(max_cycles=10) == (5, 10)
@@ -0,0 +1,128 @@
+# pylint: disable=C0103,E0401
+
+import asyncio
+import os
+import time
+
+import pytest
+import cpu
+import debugger
+import driver
+
+class TestDriver():
+
+    def test_slices_are_shared(self, make_CPU):
+        machines = [make_CPU(end=0x10000), make_CPU(end=0x10000)]
+        seen_together = []
+
+        async def watch():
+            while all(machine.ticks < 100_000 for machine in machines):
+                if all(0 < machine.ticks < 100_000 for machine in machines):
+                    seen_together.append(True)
+                await asyncio.sleep(0)
+
+        async def main():
+            return await asyncio.gather(*[driver.Driver(machine, slice_cycles=1000).run(100_000)
+                                          for machine in machines], watch())
+
+        results = asyncio.run(main())
+        assert results[:2] == [(50_000, 100_000), (50_000, 100_000)]
+        assert seen_together  # Both were half way at the same time.
+
+    def test_until_pc_and_stop(self, make_CPU):
+        machine = make_CPU(end=0x10000)
+        assert asyncio.run(driver.Driver(machine, slice_cycles=100).run(until_pc=0x1000)) == (0x0E00, 0x1C00)
+
+        runner = driver.Driver(machine, slice_cycles=100)
+        async def main():
+            task = asyncio.ensure_future(runner.run())
+            await asyncio.sleep(0.01)
+            runner.stop()
+            return await task
+        instructions, ticks = asyncio.run(main())
+        assert 0 < instructions and ticks == 2 * instructions
+
+    def test_breakpoint(self, make_CPU):
+        machine = make_CPU(end=0x10000)
+        debugger.Debugger(machine).add_breakpoint(0x0232)  # Where the first slice ends.
+        assert asyncio.run(driver.Driver(machine, slice_cycles=100).run(1000)) == (50, 100)
+        assert machine.stop_reason == debugger.Stop('breakpoint', 0x0232, None)
+
+    def test_pacing(self, make_CPU):
+        machine = make_CPU(end=0x10000)
+        begin = time.perf_counter()
+        asyncio.run(driver.Driver(machine, slice_cycles=1000, clock_rate=200_000).run(10_000))
+        assert time.perf_counter() - begin >= 0.045  # 10000 ticks at 200 kHz: 50 ms.
+
+    def test_serial_console(self):
+        machine = cpu.CPU()
+        console = driver.SerialConsole(machine, IRQ=True)
+        machine.map_device(console, 0xD0)
+        assert machine.read_RAM(0xD001) == console.CAN_SEND
+
+        console.feed(b'hi')
+        assert machine.IRQ_lines == 1
+        assert machine.read_RAM(0xD001) & console.RECEIVED
+        assert machine.read_RAM(0xD000) == ord('h')
+        assert machine.read_RAM(0xD000) == ord('i')
+        assert machine.IRQ_lines == 0
+        assert machine.read_RAM(0xD000) == 0x00
+
+        for character in b'OK':
+            machine.write_RAM(0xD000, character)
+        assert asyncio.run(console.read_output()) == b'OK'
+
+    def test_terminal(self):
+        console = driver.SerialConsole()
+        terminal = driver.Terminal(console)
+
+        async def main():
+            terminal.type("RUN\r")
+            assert bytes(console.received) == b'RUN\r'
+            for character in b'HELLO\r\nREADY.\r\n':
+                console.write(0xD000, character)
+            assert await terminal.expect("READY.") == "HELLO\r\nREADY."
+            with pytest.raises(TimeoutError):
+                await terminal.expect("?SYNTAX ERROR", timeout=0.01)
+
+        asyncio.run(main())
+
+    def test_socket(self):
+        console = driver.SerialConsole()
+
+        async def main():
+            server = await driver.serve_console(console)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'10 PRINT')
+            await writer.drain()
+            while len(console.received) < 8:
+                await asyncio.sleep(0.001)
+            console.write(0xD000, ord('?'))
+            assert await asyncio.wait_for(reader.read(1), 1.0) == b'?'
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(main())
+        assert bytes(console.received) == b'10 PRINT'
+
+    def test_pipes(self):
+        console = driver.SerialConsole()
+        to_guest, from_guest = os.pipe(), os.pipe()
+
+        async def main():
+            with open(to_guest[0], 'rb', buffering=0) as guest_in, \
+                    open(from_guest[1], 'wb', buffering=0) as guest_out:
+                reader, writer = await driver.pipe_streams(guest_in, guest_out)
+                pumping = asyncio.ensure_future(driver.pump(console, reader, writer))
+                os.write(to_guest[1], b'LIST')
+                os.close(to_guest[1])  # EOF: the pump stops.
+                console.write(0xD000, ord('>'))
+                await asyncio.sleep(0)
+                await asyncio.wait_for(pumping, 1.0)
+
+        asyncio.run(main())
+        assert bytes(console.received) == b'LIST'
+        with open(from_guest[0], 'rb') as output:
+            assert output.read() == b'>'
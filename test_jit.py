@@ -0,0 +1,155 @@
+# pylint: disable=C0103,E0401
+
+import pytest
+import bus
+import cpu
+import jit
+
+class TestJIT():
+
+    def make_CPUs(self):
+        # The same program, on an interpreting and a translating CPU.
+        program = bytes([0xEA, 0x18, 0x80, 0x42, 0xEA, 0xD8, 0x58, 0xB8] * 16)
+        CPUs = (cpu.CPU(), jit.TranslatingCPU())
+        for cpu_under_test in CPUs:
+            cpu_under_test.load(0x0200, program)
+            cpu_under_test.PC = 0x0200
+        return CPUs
+
+    def test_same_results_as_interpreter(self):
+        interpreter, translator = self.make_CPUs()
+        for limits in [dict(max_cycles=100), dict(until_pc=0x0235), dict(max_cycles=7)]:
+            interpreter.PC = translator.PC = 0x0200
+            assert translator.run(**limits) == interpreter.run(**limits)
+            assert translator.PC == interpreter.PC
+            assert translator.ticks == interpreter.ticks
+        assert translator.blocks  # Blocks were actually used.
+
+    def test_blocks_are_cached(self):
+        _, translator = self.make_CPUs()
+        translator.run(until_pc=0x0280)
+        block = translator.blocks[0x0200]
+        translator.PC = 0x0200
+        translator.run(until_pc=0x0280)
+        assert translator.blocks[0x0200] is block
+        assert block.instructions == jit.MAX_BLOCK_INSTRUCTIONS
+
+    def test_self_modifying_code(self):
+        _, translator = self.make_CPUs()
+        translator.fill(0x0200, 0x0210, 0xEA)
+        translator.STATUS = cpu.StatusRegister.CARRY
+        translator.run(until_pc=0x0208)
+        assert translator.STATUS == cpu.StatusRegister.CARRY
+
+        # Writing into the block throws it away...
+        translator.write_RAM(0x0204, 0x18)  # CLC
+        assert 0x0200 not in translator.blocks
+
+        # ... and the new code is executed.
+        translator.PC = 0x0200
+        translator.run(until_pc=0x0208)
+        assert translator.STATUS == cpu.StatusRegister.NOTHING
+
+    def test_data_writes_keep_blocks(self):
+        _, translator = self.make_CPUs()
+        translator.run(max_cycles=10)
+        translator.write_RAM(0x02F0, 0x00)  # Same page, but not code.
+        assert 0x0200 in translator.blocks
+
+    def test_unimplemented_opcode(self):
+        _, translator = self.make_CPUs()
+        translator.write_RAM(0x0204, 0x01)
+        with pytest.raises(NotImplementedError):
+            translator.run(max_cycles=100)
+        assert translator.PC == 0x0204
+
+    def test_branch_timing(self):
+        # NOPs, with branches taken within and across pages, and not taken.
+        CPUs = (cpu.CPU(), jit.TranslatingCPU())
+        for cpu_under_test in CPUs:
+            cpu_under_test.fill(0x0200, 0x0400, 0xEA)
+            cpu_under_test.load(0x02F8, bytes([0x18, 0x90, 0x10]))  # CLC / BCC +0x10
+            cpu_under_test.load(0x0310, bytes([0xB0, 0x10, 0x90, 0xE0]))  # BCS / BCC -0x20
+            cpu_under_test.PC = 0x0200
+        for limits in [dict(max_cycles=1000), dict(max_cycles=3), dict(until_pc=0x02F9)]:
+            results = [cpu_under_test.run(**limits) for cpu_under_test in CPUs]
+            assert results[0] == results[1]
+            assert CPUs[0].PC == CPUs[1].PC
+            assert CPUs[0].ticks == CPUs[1].ticks
+
+    def test_hooks(self):
+        calls = []
+        interpreter, translator = self.make_CPUs()
+        for cpu_under_test in (interpreter, translator):
+            cpu_under_test.SP = 0xFD
+            cpu_under_test.push_16bit(0x023F)
+        translator.run(until_pc=0x0210)  # Translate the code first.
+
+        # The blocks falling through to a hook stop before it.
+        for cpu_under_test in (interpreter, translator):
+            cpu_under_test.install_hook(0x0218, lambda c: calls.append(c.ticks), 10)
+            cpu_under_test.PC, cpu_under_test.ticks = 0x0200, 0
+        assert translator.run(until_pc=0x0250) == interpreter.run(until_pc=0x0250)
+        assert translator.ticks == interpreter.ticks
+        assert calls[0] == calls[1]
+
+    def test_mapping_devices(self):
+        # CLC / NOPs, translated, then a ROM bank of NOPs mapped over
+        # it: the block mustn't run anymore.
+        CPUs = (cpu.CPU(), jit.TranslatingCPU())
+        for cpu_under_test in CPUs:
+            cpu_under_test.fill(0x0200, 0x0300, 0xEA)
+            cpu_under_test.write_RAM(0x0200, 0x18)  # CLC
+            cpu_under_test.PC = 0x0200
+            cpu_under_test.run(until_pc=0x0210)
+        assert CPUs[1].blocks
+
+        bank = bus.BankedROM([bytes([0xEA] * 0x100)], 0x0200)
+        for cpu_under_test in CPUs:
+            cpu_under_test.map_device(bank, *bank.pages())
+            cpu_under_test.STATUS = cpu.StatusRegister.CARRY
+            cpu_under_test.PC = 0x0200
+            assert cpu_under_test.run(until_pc=0x0210) == (16, 32)
+            assert cpu_under_test.STATUS == cpu.StatusRegister.CARRY  # No CLC in the bank.
+        assert not CPUs[1].blocks
+
+    def test_code_in_devices_is_not_retranslated(self):
+        cpu_under_test = jit.TranslatingCPU()
+        bank = bus.BankedROM([bytes([0xEA] * 0x100)], 0x0200)
+        cpu_under_test.map_device(bank, *bank.pages())
+        cpu_under_test.PC = 0x0200
+        translations = []
+        translate = cpu_under_test.translate
+        cpu_under_test.translate = lambda start: translations.append(start) or translate(start)
+        assert cpu_under_test.run(until_pc=0x02F0) == (0xF0, 0x1E0)
+        assert not translations
+
+        # Back in RAM, it's translated again.
+        cpu_under_test.fill(0x0300, 0x0400, 0xEA)
+        assert cpu_under_test.run(until_pc=0x0310) == (0x20, 0x40)
+        assert translations == [0x0300]
+
+    def test_IRQ_after_CLI(self):
+        # A pending IRQ is taken right after the CLI, in the middle of a block.
+        results = []
+        for cls in (cpu.CPU, jit.TranslatingCPU):
+            cpu_under_test = cls()
+            cpu_under_test.fill(0x0200, 0x0400, 0xEA)
+            cpu_under_test.write_RAM(0x0210, 0x58)  # CLI
+            cpu_under_test.load(0xFFFE, b'\x00\x03')
+            cpu_under_test.PC, cpu_under_test.SP = 0x0200, 0xFF
+            cpu_under_test.P = cpu.FLAG_INTERRUPT
+            cpu_under_test.raise_IRQ()
+            results.append((cpu_under_test.run(until_pc=0x0300), cpu_under_test.pop_8bit(),
+                            cpu_under_test.pop_16bit()))
+        assert results[0] == results[1] == ((17, 41), cpu.FLAG_UNUSED, 0x0211)
+
+    def test_top_of_memory(self):
+        # NOPs up to 0xFFFF: PC wraps around to 0x0000.
+        CPUs = (cpu.CPU(), jit.TranslatingCPU())
+        for cpu_under_test in CPUs:
+            cpu_under_test.fill(0xFF00, 0x10000, 0xEA)
+            cpu_under_test.fill(0x0000, 0x0100, 0xEA)
+            cpu_under_test.PC = 0xFF01
+        assert CPUs[0].run(until_pc=0x0010) == CPUs[1].run(until_pc=0x0010) == (0x10F, 0x21E)
+        assert any(block.end == 0x10000 for block in CPUs[1].blocks.values())
@@ -0,0 +1,96 @@
+# pylint: disable=C0103,E0401
+
+import struct
+
+import pytest
+import cpu
+import loader
+
+def intel_HEX_record(kind, address, payload):
+    record = bytes([len(payload), address >> 8, address & 0xFF, kind]) + bytes(payload)
+    return ":" + (record + bytes([-sum(record) & 0xFF])).hex().upper() + "\n"
+
+class TestLoader():
+
+    def test_raw(self, tmp_path):
+        # 64K: big enough to be memory-mapped.
+        image = bytes(range(256)) * 256
+        path = tmp_path / "image.bin"
+        path.write_bytes(image)
+
+        cpu_under_test = cpu.CPU()
+        loaded = loader.load_file(cpu_under_test, path)
+        assert loaded == loader.Loaded([(0x0000, 0x10000)], None)
+        assert cpu_under_test.RAM == image
+
+        # A smaller one, somewhere else.
+        path.write_bytes(b'\xEA\xEA\x00')
+        loader.load_file(cpu_under_test, path, address=0x0400, reset_vector=0x0400)
+        assert cpu_under_test.dump(0x0400, 0x0403) == b'\xEA\xEA\x00'
+        cpu_under_test.reset_CPU()
+        assert cpu_under_test.PC == 0x0400
+
+    def test_PRG(self, tmp_path):
+        path = tmp_path / "program.prg"
+        path.write_bytes(b'\x01\x08' + b'\x18\xEA')
+        cpu_under_test = cpu.CPU()
+        assert loader.load_file(cpu_under_test, path, BRK_vector=0x0801).ranges == [(0x0801, 0x0803)]
+        assert cpu_under_test.dump(0x0801, 0x0803) == b'\x18\xEA'
+        assert cpu_under_test.dump(0xFFFE, 0x10000) == b'\x01\x08'
+        with pytest.raises(ValueError):
+            loader.read_PRG(b'\x01')
+
+    def test_intel_HEX(self, tmp_path):
+        path = tmp_path / "program.hex"
+        path.write_text(intel_HEX_record(0x00, 0x0200, [0xEA, 0x18]) +
+                        intel_HEX_record(0x00, 0x0202, [0x00]) +  # Merged with the first.
+                        intel_HEX_record(0x04, 0x0000, [0x00, 0x00]) +
+                        intel_HEX_record(0x00, 0xFFFC, [0x00, 0x02]) +
+                        intel_HEX_record(0x05, 0x0000, [0x00, 0x00, 0x02, 0x00]) +
+                        intel_HEX_record(0x01, 0x0000, []))
+        cpu_under_test = cpu.CPU()
+        loaded = loader.load_file(cpu_under_test, path, reset_vector=loader.ENTRY)
+        assert loaded == loader.Loaded([(0x0200, 0x0203), (0xFFFC, 0xFFFE)], 0x0200)
+        assert cpu_under_test.dump(0x0200, 0x0203) == b'\xEA\x18\x00'
+        cpu_under_test.reset_CPU()
+        assert cpu_under_test.PC == 0x0200
+
+        with pytest.raises(ValueError):
+            loader.read_intel_HEX(b':0102000000FF\n')  # Bad checksum.
+        with pytest.raises(ValueError):
+            loader.read_intel_HEX(b'0102000000FC\n')
+
+    def test_o65(self, tmp_path):
+        header = loader.O65_MAGIC + struct.pack('<H9H', loader.O65_MODE_BSSZERO,
+                                                0x0400, 3, 0x0500, 2, 0x0600, 4, 0, 0, 0)
+        options = bytes([6, 0, ord('t'), ord('e'), ord('s'), ord('t'), 0])  # A filename, then the end.
+        path = tmp_path / "program"
+        path.write_bytes(header + options + b'\xEA\x18\x00' + b'\x12\x34' + b'\x00\x00')
+
+        cpu_under_test = cpu.CPU()
+        cpu_under_test.fill(0x0600, 0x0604, 0xFF)
+        loaded = loader.load_file(cpu_under_test, path, reset_vector=loader.ENTRY)
+        assert loaded == loader.Loaded([(0x0400, 0x0403), (0x0500, 0x0502), (0x0600, 0x0604)],
+                                       0x0400)
+        assert cpu_under_test.dump(0x0400, 0x0403) == b'\xEA\x18\x00'
+        assert cpu_under_test.dump(0x0500, 0x0502) == b'\x12\x34'
+        assert cpu_under_test.dump(0x0600, 0x0604) == bytes(4)
+        assert cpu_under_test.dump(0xFFFC, 0xFFFE) == b'\x00\x04'
+
+        with pytest.raises(ValueError):
+            loader.read_o65(header[:6] + b'\x00\x10' + header[8:] + options)  # An object file.
+        with pytest.raises(ValueError):
+            loader.read_o65(header + options + b'\xEA')  # Truncated.
+        for length in (6, 7):
+            with pytest.raises(ValueError):
+                loader.read_o65(header[:length])  # No mode.
+
+        # Big enough to be memory-mapped, but its segments are even bigger.
+        path.write_bytes(header[:10] + struct.pack('<H', 0xF000) + header[12:] + options +
+                         bytes(loader.MMAP_THRESHOLD))
+        with pytest.raises(ValueError):
+            loader.load_file(cpu_under_test, path)
+
+    def test_no_entry_point(self):
+        with pytest.raises(ValueError):
+            loader.load_image(cpu.CPU(), loader.read_raw(b'\xEA', 0x0200), reset_vector=loader.ENTRY)
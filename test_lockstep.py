@@ -0,0 +1,97 @@
+# pylint: disable=C0103,E0401
+
+import pytest
+import cpu
+
+np = pytest.importorskip("numpy")
+import lockstep  # pylint: disable=C0413
+
+class TestLockstep():
+
+    def make_CPUs(self, count):
+        # The same program, but each CPU has a different mix of
+        # 1-byte (CLC) and 2-byte (NOP #imm) instructions in it.
+        cpus = []
+        for index in range(count):
+            cpu_under_test = cpu.CPU()
+            cpu_under_test.fill(0x0200, 0x0300, 0xEA)
+            for bit in range(8):
+                if index & (1 << bit):
+                    cpu_under_test.write_RAM(0x0200 + 3 * bit, 0x18)   # CLC
+                else:
+                    cpu_under_test.write_RAM(0x0200 + 3 * bit, 0x80)   # NOP #imm
+            cpu_under_test.write_RAM(0x0220, 0x00)  # BRK...
+            cpu_under_test.write_RAM(0xFFFE, 0x00)  # ... to 0x0240.
+            cpu_under_test.write_RAM(0xFFFF, 0x02)
+            cpu_under_test.load(0x0240, bytes([0xD8, 0x58, 0xB8, 0xEA]))
+            cpu_under_test.reset_CPU()
+            cpu_under_test.PC = 0x0200
+            cpu_under_test.STATUS = cpu.StatusRegister(index & 0xFF)
+            cpus.append(cpu_under_test)
+        return cpus
+
+    def assert_same(self, lockstep_CPUs, index, cpu_under_test):
+        other = lockstep_CPUs.to_CPU(index)
+        for register in cpu.CPU.STATE:
+            assert getattr(other, register) == getattr(cpu_under_test, register), register
+        assert other.RAM == cpu_under_test.RAM
+
+    def test_same_results_as_CPU(self):
+        cpus = self.make_CPUs(64)
+        lockstep_CPUs = lockstep.LockstepCPUs.from_CPUs(cpus)
+
+        instructions = lockstep_CPUs.run(max_cycles=60)
+        for index, cpu_under_test in enumerate(cpus):
+            assert instructions[index] == cpu_under_test.run(max_cycles=60)[0]
+            self.assert_same(lockstep_CPUs, index, cpu_under_test)
+
+        lockstep_CPUs.run(until_pc=0x0244)
+        for index, cpu_under_test in enumerate(cpus):
+            cpu_under_test.run(until_pc=0x0244)
+            self.assert_same(lockstep_CPUs, index, cpu_under_test)
+
+    def test_branches(self):
+        # Every combination of flags, through a maze of branches.
+        cpus = []
+        for index in range(256):
+            cpu_under_test = cpu.CPU()
+            cpu_under_test.fill(0x0200, 0x0400, 0xEA)
+            cpu_under_test.load(0x02F0, bytes([0x30, 0x20, 0x50, 0x04, 0x90, 0xF0, 0xD0, 0x30,
+                                               0xF0, 0x7F, 0x10, 0x02, 0x70, 0x80, 0xB0, 0x10]))
+            cpu_under_test.PC = 0x02E8
+            cpu_under_test.STATUS = index
+            cpus.append(cpu_under_test)
+        lockstep_CPUs = lockstep.LockstepCPUs.from_CPUs(cpus)
+
+        instructions = lockstep_CPUs.run(max_cycles=200)
+        for index, cpu_under_test in enumerate(cpus):
+            assert instructions[index] == cpu_under_test.run(max_cycles=200)[0]
+            self.assert_same(lockstep_CPUs, index, cpu_under_test)
+
+    def test_effective_addresses(self):
+        # Indexed and indirect modes, with and without crossing pages.
+        cpus = self.make_CPUs(8)
+        for index, cpu_under_test in enumerate(cpus):
+            cpu_under_test.load(0x0080, bytes([0xF0, 0x12, 0x34, 0x56] * 4))
+            cpu_under_test.load(0x0201, bytes([0x80 + index, 0x12]))
+            cpu_under_test.X, cpu_under_test.Y = index * 3, index * 0x11
+        lockstep_CPUs = lockstep.LockstepCPUs.from_CPUs(cpus)
+
+        rows = lockstep_CPUs.rows
+        for mode in [cpu.AddressingModes.ABSOLUTE_X, cpu.AddressingModes.ABSOLUTE_Y,
+                     cpu.AddressingModes.INDIRECT, cpu.AddressingModes.INDIRECT_X,
+                     cpu.AddressingModes.INDIRECT_Y]:
+            modes = np.full(len(rows), lockstep.MODES.index(mode), dtype=np.int8)
+            lockstep_CPUs.compute_effective_address(rows, modes, np.ones(len(rows), dtype=np.int64))
+            for index, cpu_under_test in enumerate(cpus):
+                cpu_under_test.compute_effective_address(mode, 1)
+                cpu_under_test.PC = 0x0200
+                assert lockstep_CPUs.EA[index] == cpu_under_test.EA, mode
+                assert lockstep_CPUs.ticks[index] == cpu_under_test.ticks, mode
+
+    def test_unimplemented_opcode(self):
+        cpus = self.make_CPUs(2)
+        cpus[1].write_RAM(0x0200, 0x02)
+        lockstep_CPUs = lockstep.LockstepCPUs.from_CPUs(cpus)
+        with pytest.raises(NotImplementedError):
+            lockstep_CPUs.step()
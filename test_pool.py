@@ -0,0 +1,94 @@
+# pylint: disable=C0103,E0401
+
+import pytest
+import cpu
+import debugger
+import jit
+import pool
+import profiler
+import scheduler
+
+def template():
+    # CLC / NOP / BCC 0x0200, and a reset vector pointing at it.
+    program = cpu.CPU()
+    program.load(0x0200, bytes([0x18, 0xEA, 0x90, 0xFC]))
+    program.load(0xFFFC, b'\x00\x02')
+    return bytes(program.RAM)
+
+class TestPool():
+
+    def test_hard_reset(self):
+        image = template()
+        cpu_under_test = cpu.CPU()
+        cpu_under_test.map_ROM(0xF000, bytes(0x1000))
+        cpu_under_test.install_hook(0x0300, lambda cpu: None, 6)
+        scheduler.Scheduler(cpu_under_test).schedule(1000, lambda: None)
+        debugger.Debugger(cpu_under_test).add_breakpoint(0x0201)
+        profiler.Profiler().attach(cpu_under_test)
+        cpu_under_test.PC, cpu_under_test.A, cpu_under_test.ticks = 0x1234, 0x56, 789
+        cpu_under_test.clear_dirty_pages()
+
+        cpu_under_test.hard_reset(image)
+        fresh = cpu.CPU()
+        for register in cpu.CPU.STATE:
+            assert getattr(cpu_under_test, register) == getattr(fresh, register), register
+        assert cpu_under_test.RAM == image
+        assert cpu_under_test.read_pages is cpu.NO_DEVICES
+        assert cpu_under_test.hooks is cpu_under_test.scheduler is cpu_under_test.profiler is None
+        assert cpu_under_test.debugger is cpu_under_test.breakpoints is None
+        assert cpu_under_test.next_event == fresh.next_event
+        assert 'read_RAM' not in vars(cpu_under_test)  # The profiler's wrappers are gone.
+        assert len(cpu_under_test.clear_dirty_pages()) == 256
+
+        cpu_under_test.reset_CPU()
+        assert cpu_under_test.run(max_cycles=14) == (6, 14)
+
+        cpu_under_test.hard_reset()
+        assert not any(cpu_under_test.RAM)
+        with pytest.raises(ValueError):
+            cpu_under_test.hard_reset(image[:-1])
+
+    def test_translations_are_kept(self):
+        image = template()
+        cpu_under_test = jit.TranslatingCPU()
+        cpu_under_test.hard_reset(image)
+        cpu_under_test.PC = 0x0200
+        cpu_under_test.run(max_cycles=100)
+        block = cpu_under_test.blocks[0x0200]
+
+        cpu_under_test.hard_reset(image)
+        assert cpu_under_test.blocks[0x0200] is block
+
+        # Something else at 0x0200: NOPs, then the same loop.
+        other = bytearray(image)
+        other[0x0200:0x0206] = bytes([0xEA, 0xEA, 0x18, 0xEA, 0x90, 0xFC])
+        cpu_under_test.hard_reset(other)
+        assert not cpu_under_test.blocks
+        cpu_under_test.PC = 0x0200
+        assert cpu_under_test.run(max_cycles=18) == (8, 18)
+
+        cpu_under_test.hard_reset()
+        assert not cpu_under_test.blocks
+
+    def test_pool(self):
+        image = template()
+        cpus = pool.CPUPool(jit.TranslatingCPU, size=1, max_idle=2)
+        with cpus.cpu(image) as first:
+            first.reset_CPU()
+            first.run(max_cycles=100)
+            with cpus.cpu(image) as second:
+                assert second is not first
+                assert second.RAM == image and second.PC == 0x0000
+                second.write_RAM(0x1234, 0x56)
+        assert (cpus.created, cpus.reused) == (2, 1)
+
+        # The last one back is the first out again, as good as new.
+        third = cpus.acquire()
+        assert third is first
+        assert not any(third.RAM) and third.ticks == 0
+        assert cpus.acquire() is second and not any(second.RAM)
+        assert (cpus.created, cpus.reused) == (2, 3)
+
+        for cpu_under_test in (third, second, cpus.acquire()):
+            cpus.release(cpu_under_test)
+        assert len(cpus.idle) == 2 and cpus.created == 3
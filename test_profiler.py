@@ -0,0 +1,103 @@
+# pylint: disable=C0103,E0401
+
+import io
+
+import profiler
+
+PROGRAM = {0x0200: bytes([0xEA, 0x18, 0xEA, 0x00])}  # NOP, CLC, NOP, BRK to 0x0300
+
+class TestProfiler():
+
+    def test_counts(self, make_CPU):
+        cpu_under_test = make_CPU(code=PROGRAM)
+        profile = profiler.Profiler()
+        profile.attach(cpu_under_test)
+        cpu_under_test.run(until_pc=0x0302)
+
+        assert profile.opcode_counts[0xEA] == 4
+        assert profile.opcode_cycles[0xEA] == 8
+        assert profile.opcode_counts[0x00] == 1
+        assert profile.opcode_cycles[0x00] == 7
+        assert profile.address_counts[0x0201] == 1
+        assert profile.address_cycles[0x0203] == 7
+        assert profile.hottest_addresses(1) == [(0x0203, 1, 7)]
+        assert profile.page_writes[0x01] == 3  # BRK pushed PC and STATUS...
+        assert profile.page_reads[0xFF] == 2   # ... and read its vector.
+        assert "0x00  BRK" in profile.report()
+
+        # Detached, it doesn't count anymore.
+        profile.detach(cpu_under_test)
+        cpu_under_test.PC = 0x0200
+        cpu_under_test.run(until_pc=0x0203)
+        assert profile.opcode_counts[0xEA] == 4
+        assert cpu_under_test.read_RAM.__self__ is cpu_under_test
+
+    def test_call_graph(self, make_CPU):
+        cpu_under_test = make_CPU(code=PROGRAM)
+        profile = profiler.Profiler(symbols={0x0400: 'multiply'})
+
+        def executed(PC, opcode, cycles, new_PC):
+            cpu_under_test.ticks += cycles
+            cpu_under_test.PC = new_PC
+            profile.instruction(cpu_under_test, PC, opcode)
+
+        executed(0x0200, 0xEA, 2, 0x0201)
+        executed(0x0201, 0x20, 6, 0x0300)  # JSR $0300
+        executed(0x0300, 0xEA, 2, 0x0301)
+        executed(0x0301, 0x20, 6, 0x0400)  # JSR multiply
+        executed(0x0400, 0xEA, 10, 0x0401)
+        executed(0x0401, 0x60, 6, 0x0304)  # RTS
+        executed(0x0304, 0x60, 6, 0x0204)  # RTS
+        executed(0x0204, 0xEA, 2, 0x0205)
+
+        assert profile.subroutine_cycles() == {'main': (40, 10),
+                                               'sub_0300': (30, 14),
+                                               'multiply': (16, 16)}
+        stream = io.StringIO()
+        profile.write_folded_stacks(stream)
+        assert stream.getvalue().splitlines() == ["main 10",
+                                                  "main;sub_0300 14",
+                                                  "main;sub_0300;multiply 16"]
+
+    def test_fetches_counted_by_step_and_run(self, make_CPU):
+        profiles = []
+        for stepping in (True, False):
+            cpu_under_test = make_CPU(code=PROGRAM)
+            profile = profiler.Profiler()
+            profile.attach(cpu_under_test)
+            if stepping:
+                while cpu_under_test.PC != 0x0302:
+                    cpu_under_test.step()
+            else:
+                cpu_under_test.run(until_pc=0x0302)
+            profiles.append(profile)
+        assert profiles[0].page_reads == profiles[1].page_reads
+        assert profiles[0].page_reads[0x02] == 4 and profiles[0].page_reads[0x03] == 2
+
+    def test_several_CPUs(self, make_CPU):
+        profile = profiler.Profiler()
+        first, second = make_CPU(code=PROGRAM), make_CPU(code=PROGRAM)
+        second.ticks = 1000
+        profile.attach(first)
+        profile.attach(second)
+        first.run(until_pc=0x0203)
+        second.run(until_pc=0x0203)
+        assert profile.opcode_cycles[0xEA] == 8 and profile.opcode_cycles[0x18] == 4
+
+        # A BRK on one of them isn't a call on the other.
+        first.run(until_pc=0x0301)
+        second.run(max_cycles=2)
+        assert profile.folded_stacks() == ["main 26", "main;sub_0300 2"]
+
+    def test_fork(self, make_CPU):
+        cpu_under_test = make_CPU(code=PROGRAM)
+        profile = profiler.Profiler()
+        profile.attach(cpu_under_test)
+        clone = cpu_under_test.fork()
+        assert clone.profiler is None
+
+        clone.write_RAM(0x1234, 0x56)
+        clone.run(until_pc=0x0203)
+        assert clone.read_RAM(0x1234) == 0x56
+        assert cpu_under_test.read_RAM(0x1234) == 0x00
+        assert profile.page_writes[0x12] == 0 and profile.opcode_counts[0xEA] == 0
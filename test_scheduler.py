@@ -0,0 +1,153 @@
+# pylint: disable=C0103,E0401
+
+import pytest
+import cpu
+import jit
+import scheduler
+
+class TestScheduler():
+
+    def test_events(self, make_CPU):
+        cpu_under_test = make_CPU()
+        events = scheduler.Scheduler(cpu_under_test)
+        fired = []
+        events.schedule(9, lambda c: fired.append(('b', c.ticks)))
+        events.schedule(5, lambda c: fired.append(('a', c.ticks)))
+        cancelled = events.schedule(7, lambda c: fired.append(('x', c.ticks)))
+        events.cancel(cancelled)
+        events.after(9, lambda c: fired.append(('c', c.ticks)))
+
+        cpu_under_test.run(max_cycles=20)
+        # Events fire before the first instruction starting at, or after, their tick.
+        assert fired == [('a', 6), ('b', 10), ('c', 10)]
+        assert cpu_under_test.next_event == float('inf')
+
+    def test_IRQ(self, make_CPU):
+        cpu_under_test = make_CPU()
+        events = scheduler.Scheduler(cpu_under_test)
+        events.schedule(10, lambda c: c.raise_IRQ())
+
+        cpu_under_test.run(until_pc=0x0300)
+        assert cpu_under_test.ticks == 10 + 7
+        assert cpu_under_test.P & cpu.FLAG_INTERRUPT
+        assert cpu_under_test.pop_8bit() == cpu.FLAG_UNUSED
+        assert cpu_under_test.pop_16bit() == 0x0205
+
+    def test_masked_IRQ(self, make_CPU):
+        cpu_under_test = make_CPU()
+        cpu_under_test.write_RAM(0x0208, 0x58)  # CLI
+        cpu_under_test.P = cpu.FLAG_INTERRUPT
+        cpu_under_test.raise_IRQ()
+
+        cpu_under_test.run(until_pc=0x0300)
+        assert cpu_under_test.pop_8bit() == cpu.FLAG_UNUSED
+        assert cpu_under_test.pop_16bit() == 0x0209  # Right after the CLI.
+
+        # While I is set, the IRQ isn't taken again...
+        SP = cpu_under_test.SP
+        assert cpu_under_test.run(until_pc=0x0320) == (0x20, 0x40)
+        # ... and after clear_IRQ(), not even when I is cleared.
+        cpu_under_test.clear_IRQ()
+        cpu_under_test.CLI()
+        assert cpu_under_test.run(until_pc=0x0340) == (0x20, 0x40)
+        assert cpu_under_test.SP == SP
+
+    def test_NMI(self, make_CPU):
+        cpu_under_test = make_CPU()
+        cpu_under_test.P = cpu.FLAG_INTERRUPT | cpu.FLAG_CARRY
+        events = scheduler.Scheduler(cpu_under_test)
+        events.schedule(4, lambda c: c.raise_NMI())
+
+        cpu_under_test.run(until_pc=0x0400)
+        assert cpu_under_test.pop_8bit() == cpu.FLAG_UNUSED | cpu.FLAG_INTERRUPT | cpu.FLAG_CARRY
+        assert cpu_under_test.pop_16bit() == 0x0202
+        assert not cpu_under_test.NMI_pending
+
+    def test_translated_code_is_on_time(self, make_CPU):
+        results = []
+        for cls in (cpu.CPU, jit.TranslatingCPU):
+            cpu_under_test = make_CPU(cls)
+            events = scheduler.Scheduler(cpu_under_test)
+            events.schedule(13, lambda c: c.raise_IRQ())
+            cpu_under_test.run(until_pc=0x0300)
+            results.append((cpu_under_test.ticks, cpu_under_test.pop_8bit(), cpu_under_test.pop_16bit()))
+        assert results[0] == results[1] == (14 + 7, cpu.FLAG_UNUSED, 0x0207)
+
+    def test_fork(self, make_CPU):
+        cpu_under_test = make_CPU()
+        events = scheduler.Scheduler(cpu_under_test)
+        fired = []
+        events.schedule(6, lambda c: fired.append(c))
+        clone = cpu_under_test.fork()
+
+        clone.run(max_cycles=10)
+        assert fired == [clone]
+        cpu_under_test.run(max_cycles=10)
+        assert fired == [clone, cpu_under_test]
+
+    def test_restore(self, make_CPU):
+        for cls in (cpu.CPU, jit.TranslatingCPU):
+            cpu_under_test = make_CPU(cls)
+            events = scheduler.Scheduler(cpu_under_test)
+            fired = []
+            events.schedule(6, lambda c: fired.append(c.ticks))
+            checkpoint = cpu_under_test.fork()
+
+            cpu_under_test.run(max_cycles=10)
+            cpu_under_test.raise_NMI()
+            cpu_under_test.raise_IRQ()
+            cpu_under_test.restore(checkpoint)
+            assert not cpu_under_test.NMI_pending and cpu_under_test.IRQ_lines == 0
+            assert cpu_under_test.next_event == 6
+
+            # The event fires again, every time we rewind.
+            for _ in range(2):
+                cpu_under_test.run(max_cycles=10)
+                cpu_under_test.restore(checkpoint)
+            assert fired == [6, 6, 6]
+            assert cpu_under_test.PC == 0x0200
+
+    def test_idle_branch_loop(self, make_CPU):
+        results = []
+        for cls, idle_skip in ((cpu.CPU, False), (cpu.CPU, True), (jit.TranslatingCPU, True)):
+            cpu_under_test = make_CPU(cls)
+            cpu_under_test.load(0x0200, bytes([0xD0, 0xFE]))  # BNE *, with Z clear
+            cpu_under_test.STATUS = 0
+            cpu_under_test.idle_skip = idle_skip
+            events = scheduler.Scheduler(cpu_under_test)
+            events.schedule(1000, lambda c: c.raise_NMI())
+
+            results.append(cpu_under_test.run(until_pc=0x0400))
+            assert cpu_under_test.idle_skips == (1 if idle_skip else 0)
+            assert cpu_under_test.read_RAM(0x01FC) == 0x00  # Pushed PC: 0x0200
+            assert cpu_under_test.read_RAM(0x01FD) == 0x02
+        # 334 branches: the first instruction to start at or after 1000.
+        assert results == [(334, 334 * 3 + 7)] * 3
+
+    def test_no_idle_skip_of_missing_instructions(self, make_CPU):
+        # JMP * and LDA $10 / BNE: JMP and LDA aren't implemented yet, so
+        # these aren't skipped as idle loops, and fail as they should.
+        for program in (bytes([0x4C, 0x00, 0x02]), bytes([0xA5, 0x10, 0xD0, 0xFC])):
+            for cls in (cpu.CPU, jit.TranslatingCPU):
+                cpu_under_test = make_CPU(cls)
+                cpu_under_test.load(0x0200, program)
+                cpu_under_test.write_RAM(0x0010, 0x80)
+                cpu_under_test.idle_skip = True
+                scheduler.Scheduler(cpu_under_test).schedule(1000, lambda c: c.raise_NMI())
+                with pytest.raises(NotImplementedError):
+                    cpu_under_test.run(until_pc=0x0400)
+                assert cpu_under_test.idle_skips == 0 and cpu_under_test.ticks == 0
+
+    def test_idle_forever(self, make_CPU):
+        cpu_under_test = make_CPU()
+        cpu_under_test.load(0x0200, bytes([0xD0, 0xFE]))  # BNE *, with Z clear
+        cpu_under_test.STATUS = 0
+        cpu_under_test.idle_skip = True
+        assert cpu_under_test.run(max_cycles=10) == (4, 12)
+        assert cpu_under_test.run() == (0, 0)  # Nothing can ever wake it up.
+        assert cpu_under_test.PC == 0x0200
+
+        # Skipping is opt-in.
+        cpu_under_test.idle_skip = False
+        assert cpu_under_test.run(max_cycles=10) == (4, 12)
+        assert cpu_under_test.idle_skips == 1
@@ -0,0 +1,139 @@
+# pylint: disable=C0103,E0401
+
+import pytest
+import cpu
+import jit
+import scheduler
+import snapshot
+
+CLC = {0x0201: b'\x18'}  # In the NOPs.
+REGISTERS = dict(A=0x01, X=0x02, Y=0x03, STATUS=cpu.StatusRegister.CARRY | cpu.StatusRegister.ZERO)
+
+class TestSnapshot():
+
+    def registers(self, cpu_under_test):
+        return [getattr(cpu_under_test, register) for register in cpu.CPU.STATE]
+
+    def test_save_load_state(self, make_CPU):
+        original = make_CPU(code=CLC, **REGISTERS)
+        state = snapshot.save_state(original)
+        assert len(state) == snapshot.HEADER.size + 0x10000
+
+        restored = cpu.CPU()
+        snapshot.load_state(restored, state)
+        assert self.registers(restored) == self.registers(original)
+        assert restored.RAM == original.RAM
+
+        # Both now run the same way.
+        assert restored.run(max_cycles=10) == original.run(max_cycles=10)
+        assert self.registers(restored) == self.registers(original)
+
+    def test_load_bad_state(self, make_CPU):
+        state = snapshot.save_state(make_CPU(code=CLC, **REGISTERS))
+        with pytest.raises(ValueError):
+            snapshot.load_state(cpu.CPU(), b'NOPE' + state[4:])
+        with pytest.raises(ValueError):
+            snapshot.load_state(cpu.CPU(), state[:-1])
+        with pytest.raises(ValueError):
+            snapshot.load_state(cpu.CPU(memory_size=0x8000), state)
+
+    def test_fork_and_restore(self, make_CPU):
+        original = make_CPU(code=CLC, **REGISTERS)
+        checkpoint = original.fork()
+
+        original.run(max_cycles=10)
+        original.write_RAM(0x1234, 0x56)
+        assert original.STATUS == cpu.StatusRegister.ZERO
+        # The fork didn't change.
+        assert checkpoint.PC == 0x0200
+        assert checkpoint.read_RAM(0x1234) == 0x00
+
+        # Rewind.
+        original.restore(checkpoint)
+        assert self.registers(original) == self.registers(checkpoint)
+        assert original.read_RAM(0x1234) == 0x00
+        assert original.STATUS == cpu.StatusRegister.CARRY | cpu.StatusRegister.ZERO
+
+    def test_restore_translated_code(self, make_CPU):
+        original = make_CPU(jit.TranslatingCPU, code=CLC, **REGISTERS)
+        checkpoint = original.fork()
+        original.write_RAM(0x0201, 0xEA)  # No more CLC...
+        original.run(until_pc=0x0210)
+        assert original.STATUS == cpu.StatusRegister.CARRY | cpu.StatusRegister.ZERO
+
+        original.restore(checkpoint)  # ... until we rewind.
+        original.run(until_pc=0x0210)
+        assert original.STATUS == cpu.StatusRegister.ZERO
+
+    def test_dirty_pages(self):
+        cpu_under_test = cpu.CPU()
+        assert cpu_under_test.clear_dirty_pages() == []
+        cpu_under_test.write_RAM(0x1234, 0x56)
+        cpu_under_test.load(0x20FF, b'\x01\x02')
+        cpu_under_test.fill(0x8000, 0x8001)
+        cpu_under_test.push_8bit(0x00)
+        assert cpu_under_test.clear_dirty_pages() == [0x01, 0x12, 0x20, 0x21, 0x80]
+        assert cpu_under_test.clear_dirty_pages() == []
+
+    def test_checkpoints(self, make_CPU):
+        cpu_under_test = make_CPU(code=CLC, **REGISTERS)
+        checkpoints = snapshot.Checkpoints(cpu_under_test)
+        assert len(checkpoints.checkpoints[0].pages) == 0x100  # All of RAM.
+
+        cpu_under_test.run(max_cycles=10)
+        cpu_under_test.write_RAM(0x1234, 0x56)
+        cpu_under_test.write_RAM(0x1235, 0x57)
+        cpu_under_test.write_RAM(0x3000, 0x01)
+        first = checkpoints.take()
+        assert sorted(checkpoints.checkpoints[first].pages) == [0x12, 0x30]
+        assert checkpoints.changes(first) == [(0x1234, 0x1236), (0x3000, 0x3001)]
+        state = self.registers(cpu_under_test)
+
+        cpu_under_test.write_RAM(0x1234, 0x00)
+        cpu_under_test.write_RAM(0x4000, 0x02)
+        cpu_under_test.run(max_cycles=10)
+        second = checkpoints.take()
+        assert sorted(checkpoints.checkpoints[second].pages) == [0x12, 0x40]
+
+        # Back to the first checkpoint: only the pages written since are copied.
+        cpu_under_test.write_RAM(0x5000, 0x03)
+        checkpoints.restore(first)
+        assert self.registers(cpu_under_test) == state
+        assert cpu_under_test.dump(0x1234, 0x1236) == b'\x56\x57'
+        assert cpu_under_test.read_RAM(0x4000) == cpu_under_test.read_RAM(0x5000) == 0x00
+        assert checkpoints.changes(checkpoints.take()) == [(0x1234, 0x1235), (0x4000, 0x4001)]
+
+        # And to the very start.
+        checkpoints.restore(0)
+        assert snapshot.diff_states(cpu_under_test, make_CPU(code=CLC, **REGISTERS)) == ({}, [])
+
+    def test_checkpoints_rewind_events(self, make_CPU):
+        cpu_under_test = make_CPU(code=CLC, **REGISTERS)
+        fired = []
+        scheduler.Scheduler(cpu_under_test).schedule(6, lambda c: fired.append(c.ticks))
+        checkpoints = snapshot.Checkpoints(cpu_under_test)
+        with pytest.raises(ValueError):
+            checkpoints.changes(0)
+
+        cpu_under_test.run(max_cycles=10)
+        cpu_under_test.raise_NMI()
+        cpu_under_test.raise_IRQ()
+        checkpoints.restore(0)
+        assert not cpu_under_test.NMI_pending and cpu_under_test.IRQ_lines == 0
+        assert cpu_under_test.next_event == 6
+
+        # The event fires again, every time we rewind.
+        for _ in range(2):
+            cpu_under_test.run(max_cycles=10)
+            checkpoints.restore(-1)
+        assert fired == [6, 6, 6]
+
+    def test_diff_states(self, make_CPU):
+        original = make_CPU(code=CLC, **REGISTERS)
+        changed = original.fork()
+        changed.run(max_cycles=4)
+        changed.fill(0x10FE, 0x1102, 0xFF)
+        changed.write_RAM(0x2000, 0x01)
+        diff = snapshot.diff_states(original, changed)
+        assert diff.registers == {'PC': (0x0200, 0x0202), 'P': (0x03, 0x02), 'ticks': (0, 4)}
+        assert diff.ranges == [(0x10FE, 0x1102), (0x2000, 0x2001)]
@@ -0,0 +1,128 @@
+# pylint: disable=C0103,E0401
+
+import bz2
+import gzip
+import io
+import lzma
+
+import pytest
+import cpu
+import tracediff
+import tracing
+
+def looping_CPU():
+    # CLC / NOP / BCC 0x0200
+    cpu_under_test = cpu.CPU()
+    cpu_under_test.load(0x0200, bytes([0x18, 0xEA, 0x90, 0xFC]))
+    cpu_under_test.reset_CPU()
+    cpu_under_test.PC = 0x0200
+    return cpu_under_test
+
+def reference_log(max_cycles):
+    log = io.StringIO()
+    reference = looping_CPU()
+    reference.ticks = 7  # Logs usually start after the reset sequence.
+    reference.tracer = tracing.Tracer(tracing.TextSink(log))
+    reference.run(max_cycles=max_cycles)
+    return log.getvalue().splitlines(keepends=True)
+
+class TestTraceDiff():
+
+    def test_parse_line(self):
+        line = ("C000  4C F5 C5  JMP $C5F5                       "
+                "A:00 X:00 Y:00 P:24 SP:FD PPU:  0, 21 CYC:7")
+        assert tracediff.parse_line(line) == tracing.TraceRecord(0xC000, 0x4C, 0, 0, 0, 0xFD, 0x24, 7)
+        assert tracediff.parse_line("0200  E8  INX  A:01 X:02 Y:03 P:24 SP:FF") == \
+            tracing.TraceRecord(0x0200, 0xE8, 1, 2, 3, 0xFF, 0x24, None)
+        assert tracediff.parse_line("RAM[0x0200] <- 0x12") is None
+
+    def test_match(self):
+        log = reference_log(100)
+        sink = tracediff.compare(looping_CPU(), log)
+        assert sink.divergence is None
+        assert sink.compared == len(log)
+        assert sink.cpu.stop_reason.cause == 'end'
+
+        sink = tracediff.compare(looping_CPU(), log, max_cycles=20)
+        assert sink.cpu.stop_reason is None
+        assert sink.compared == looping_CPU().run(max_cycles=20)[0]
+
+    def test_divergence(self):
+        log = reference_log(100)
+        X = tracediff.parse_line(log[10]).X
+        log[10] = log[10].replace(f"X:{X:02X}", f"X:{X ^ 0x80:02X}")
+        sink = tracediff.compare(looping_CPU(), iter(log), context=3)
+        assert sink.compared == 10
+        divergence = sink.divergence
+        assert divergence.line_number == 11
+        assert divergence.fields == [('X', X, X ^ 0x80)]
+        assert [line for _, line in divergence.context] == [line.rstrip("\n") for line in log[7:10]]
+        assert sink.cpu.stop_reason == tracediff.Stop('divergence', divergence.record.PC, divergence)
+
+        text = tracediff.format_divergence(divergence)
+        assert text.count("\n") == 2 * 4
+        assert text.splitlines()[-1].startswith("Line 11: X is ")
+
+    def test_cycles_and_masked_P(self):
+        log = reference_log(100)
+        # The B and unused bits don't count, but carry does.
+        record = tracediff.parse_line(log[5])
+        assert tracediff.compare(looping_CPU(), [line.replace(f" P:{record.P:02X}", f" P:{record.P ^ 0x30:02X}")
+                                                  for line in log]).divergence is None
+        bad_P = list(log)
+        bad_P[5] = bad_P[5].replace(f" P:{record.P:02X}", f" P:{record.P ^ 0x01:02X}")
+        assert tracediff.compare(looping_CPU(), bad_P).divergence.fields[0][0] == 'P'
+
+        late = list(log)
+        late[5] = late[5].replace(f"CYC:{record.ticks}", f"CYC:{record.ticks + 1}")
+        assert tracediff.compare(looping_CPU(), late).divergence.fields == \
+            [('ticks', record.ticks, record.ticks + 1)]
+
+    @pytest.mark.parametrize('opener', [open, gzip.open, bz2.open, lzma.open])
+    def test_compressed_logs(self, tmp_path, opener):
+        path = tmp_path / "reference.log"
+        with opener(path, 'wt') as log:
+            log.writelines(reference_log(100))
+        with tracediff.open_log(path) as log:
+            assert tracediff.compare(looping_CPU(), log).compared == len(reference_log(100))
+
+    def test_main(self, tmp_path):
+        image, log_path = tmp_path / "image.bin", tmp_path / "reference.log.gz"
+        image.write_bytes(looping_CPU().dump(0x0200, 0x0204))
+        log = reference_log(100)
+        with gzip.open(log_path, 'wt') as compressed:
+            compressed.writelines(log)
+
+        arguments = [str(image), str(log_path), '--address', '0x0200', '--start', '0x0200']
+        output = io.StringIO()
+        assert tracediff.main(arguments, output) == 0
+        assert output.getvalue() == f"{len(log)} instructions match.\n"
+
+        with gzip.open(log_path, 'wt') as compressed:
+            compressed.writelines(log[:3] + [log[3].replace("0200  18", "0200  38")])
+        output = io.StringIO()
+        assert tracediff.main(arguments + ['--context', '1'], output) == 1
+        assert output.getvalue().endswith("Diverged after 3 matching instructions.\n")
+        assert "opcode is 18, expected 38" in output.getvalue()
+
+        image.write_bytes(b'\x18\x02')  # CLC, then an opcode we don't have.
+        with gzip.open(log_path, 'wt') as compressed:
+            compressed.writelines([log[0], log[1].replace("0201  EA  NOP", "0201  02  ???")])
+        output = io.StringIO()
+        assert tracediff.main(arguments, output) == 2
+        assert output.getvalue().startswith("2 instructions match, then: ")
+
+    def test_part_of_the_image(self, tmp_path):
+        # Like nestest.nes: a header, the code, then more than fits.
+        image, log_path = tmp_path / "image.nes", tmp_path / "reference.log"
+        code = looping_CPU().dump(0x0200, 0x0204)
+        image.write_bytes(b'HEADER' + code + bytes(0x10000))
+        log_path.write_text("".join(reference_log(100)))
+
+        arguments = [str(image), str(log_path), '--skip', '6', '--address', '0x0200', '--start', '0x0200']
+        output = io.StringIO()
+        assert tracediff.main(arguments + ['--length', '0x4'], output) == 0
+        assert output.getvalue().endswith(" instructions match.\n")
+
+        with pytest.raises(SystemExit):
+            tracediff.main(arguments, io.StringIO())
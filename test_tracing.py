@@ -0,0 +1,76 @@
+# pylint: disable=C0103,E0401
+
+import io
+
+import tracing
+
+CLC = {0x0203: b'\x18'}  # In the NOPs.
+
+class TestTracing():
+
+    def test_ring_buffer(self, make_CPU):
+        cpu_under_test = make_CPU(code=CLC)
+        ring = tracing.RingBufferSink(size=3)
+        cpu_under_test.tracer = tracing.Tracer(ring)
+        cpu_under_test.run(until_pc=0x0205)
+
+        # Only the last 3 instructions are kept.
+        assert [record.PC for record in ring.records] == [0x0202, 0x0203, 0x0204]
+        assert ring.records[1].opcode == 0x18
+        assert ring.records[1].ticks == 6
+        assert "0203  18  CLC" in ring.dump()
+
+    def test_binary_trace(self, make_CPU):
+        cpu_under_test = make_CPU(code=CLC)
+        stream = io.BytesIO()
+        cpu_under_test.tracer = tracing.Tracer(tracing.BinaryTraceSink(stream))
+        cpu_under_test.run(until_pc=0x0205)
+
+        assert len(stream.getvalue()) == 5 * tracing.BINARY_RECORD.size
+        stream.seek(0)
+        records = list(tracing.read_binary_trace(stream))
+        assert [record.PC for record in records] == [0x0200, 0x0201, 0x0202, 0x0203, 0x0204]
+        assert records[3] == tracing.TraceRecord(0x0203, 0x18, 0, 0, 0, 0xFD, 0, 6)
+
+    def test_wrapped_stack_pointer(self, make_CPU):
+        # A BRK with only one byte left on the stack.
+        cpu_under_test = make_CPU(code=CLC)
+        cpu_under_test.write_RAM(0x0200, 0x00)
+        cpu_under_test.load(0xFFFE, b'\x04\x02')
+        cpu_under_test.SP = 0x01
+        stream = io.BytesIO()
+        cpu_under_test.tracer = tracing.Tracer(tracing.BinaryTraceSink(stream))
+        cpu_under_test.run(until_pc=0x0205)
+
+        stream.seek(0)
+        assert [record.SP for record in tracing.read_binary_trace(stream)] == [0x01, 0xFE]
+
+    def test_fork(self, make_CPU):
+        cpu_under_test = make_CPU(code=CLC)
+        ring = tracing.RingBufferSink()
+        cpu_under_test.tracer = tracing.Tracer(ring)
+        clone = cpu_under_test.fork()
+        assert clone.tracer is None
+
+        clone.run(until_pc=0x0205)
+        assert not ring.records
+
+    def test_text_trace(self, make_CPU):
+        cpu_under_test = make_CPU(code=CLC)
+        stream = io.StringIO()
+        cpu_under_test.tracer = tracing.Tracer(tracing.TextSink(stream))
+        cpu_under_test.step()
+        cpu_under_test.write_RAM(0x1234, 0x6502)
+
+        assert stream.getvalue().splitlines() == [
+            "0200  EA  NOP  A:00 X:00 Y:00 P:00 SP:FD CYC:0",
+            "RAM[0x1234] <- 0x02"]
+
+    def test_idle_loops_are_traced(self, make_CPU):
+        cpu_under_test = make_CPU(code=CLC)
+        cpu_under_test.load(0x0200, bytes([0xD0, 0xFE]))  # BNE *, with Z clear
+        cpu_under_test.idle_skip = True
+        ring = tracing.RingBufferSink(size=100)
+        cpu_under_test.tracer = tracing.Tracer(ring)
+        assert cpu_under_test.run(max_cycles=30) == (10, 30)
+        assert len(ring.records) == 10 and cpu_under_test.idle_skips == 0
@@ -0,0 +1,191 @@
+# py6502: comparing execution with a reference trace.
+#
+# Runs a CPU with a CompareSink tracing it, which checks the state
+# before every instruction against the next line of a reference log
+# (nestest-style, or our own TextSink output), and stops at the first
+# difference. The log is read lazily, and possibly decompressed on the
+# fly (gzip, bzip2, xz), and only the last few instructions are kept
+# for context: memory use doesn't depend on the length of the trace.
+#
+#   python tracediff.py nestest.nes nestest.log --skip 16 --length 0x4000 \
+#       --address 0xC000 --start 0xC000
+
+# pylint: disable=C0103
+
+import argparse
+import bz2
+from collections import deque, namedtuple
+import gzip
+import lzma
+import re
+import sys
+
+from cpu import CPU
+from debugger import Stop
+import loader
+from tracing import TraceRecord, Tracer, format_record
+
+# Compressed files are recognised by their first bytes.
+COMPRESSED = [(b'\x1f\x8b', gzip.open), (b'BZh', bz2.open), (b'\xfd7zXZ\x00', lzma.open)]
+
+# By default, the B and unused bits of P aren't compared: they don't
+# really exist, and emulators disagree about them.
+P_MASK = 0xCF
+
+LINE = re.compile(r'([0-9A-Fa-f]{4})\s+([0-9A-Fa-f]{2})\b')
+REGISTERS = re.compile(r'A:([0-9A-Fa-f]{2}) X:([0-9A-Fa-f]{2}) Y:([0-9A-Fa-f]{2}) '
+                       r'P:([0-9A-Fa-f]{2}) SP:([0-9A-Fa-f]{2})')
+CYCLES = re.compile(r'CYC:\s*(\d+)')
+
+def open_log(path):
+    """ Open a (maybe compressed) text log for reading. """
+    with open(path, 'rb') as log:
+        magic = log.read(6)
+    for prefix, opener in COMPRESSED:
+        if magic.startswith(prefix):
+            return opener(path, 'rt', encoding='latin-1')
+    return open(path, 'r', encoding='latin-1')  # pylint: disable=R1732
+
+def parse_line(line):
+    """ A TraceRecord from a line of a log (ticks is None if there's no
+    CYC: field), or None if the line isn't an instruction. """
+    start, registers = LINE.match(line), REGISTERS.search(line)
+    if start is None or registers is None:
+        return None
+    cycles = CYCLES.search(line)
+    A, X, Y, P, SP = (int(value, 16) for value in registers.groups())
+    return TraceRecord(int(start.group(1), 16), int(start.group(2), 16), A, X, Y, SP, P,
+                       int(cycles.group(1)) if cycles else None)
+
+def read_log(lines):
+    """ Yield (line number, line, TraceRecord) for the instructions in
+    an iterable of lines, lazily. """
+    for number, line in enumerate(lines, 1):
+        record = parse_line(line)
+        if record is not None:
+            yield number, line.rstrip('\r\n'), record
+
+# fields: [(name, ours, reference)]; context: the [(TraceRecord, line)]
+# that matched just before.
+Divergence = namedtuple('Divergence', 'line_number line record fields context')
+
+class CompareSink():
+    """ A tracing sink checking every instruction against the next one of
+    a reference, an iterator of (line number, line, TraceRecord). At
+    the first difference (or the end of the reference), it stops the
+    CPU after the current instruction, with cpu.stop_reason. Cycles
+    are compared relative to the first instruction. """
+    def __init__(self, cpu, reference, context=5, P_mask=P_MASK):
+        self.cpu = cpu
+        self.reference = iter(reference)
+        self.history = deque(maxlen=context)
+        self.P_mask = P_mask
+        self.cycle_offset = None
+        self.compared = 0
+        self.divergence = None
+        self.error = None  # Why the CPU couldn't go on, e.g. an unimplemented opcode.
+
+    def differences(self, record, expected):
+        fields = []
+        for name, ours, theirs in (('PC', record.PC, expected.PC),
+                                   ('opcode', record.opcode, expected.opcode),
+                                   ('A', record.A, expected.A), ('X', record.X, expected.X),
+                                   ('Y', record.Y, expected.Y), ('SP', record.SP & 0xFF, expected.SP),
+                                   ('P', record.P & self.P_mask, expected.P & self.P_mask)):
+            if ours != theirs:
+                fields.append((name, ours, theirs))
+        if expected.ticks is not None:
+            if self.cycle_offset is None:
+                self.cycle_offset = expected.ticks - record.ticks
+            elif record.ticks + self.cycle_offset != expected.ticks:
+                fields.append(('ticks', record.ticks + self.cycle_offset, expected.ticks))
+        return fields
+
+    def record(self, record):
+        if self.cpu.stop_reason is not None:
+            return  # Already stopping.
+        reference = next(self.reference, None)
+        if reference is None:
+            self.stop(Stop('end', record.PC, None))
+            return
+        number, line, expected = reference
+        fields = self.differences(record, expected)
+        if fields:
+            self.divergence = Divergence(number, line, record, fields, list(self.history))
+            self.stop(Stop('divergence', record.PC, self.divergence))
+            return
+        self.history.append((record, line))
+        self.compared += 1
+
+    def stop(self, reason):
+        self.cpu.stop_reason = reason
+        self.cpu.next_event = self.cpu.ticks
+
+def format_divergence(divergence):
+    """ The divergence, with its context, as text. """
+    lines = []
+    for record, line in divergence.context:
+        lines.append(f"      ours: {format_record(record)}")
+        lines.append(f"      log:  {line}")
+    lines.append(f">>    ours: {format_record(divergence.record)}")
+    lines.append(f">>    log:  {divergence.line}")
+    lines.append(f"Line {divergence.line_number}: " + ", ".join(
+        f"{name} is {ours:X}, expected {theirs:X}" for name, ours, theirs in divergence.fields))
+    return "\n".join(lines)
+
+def compare(cpu, lines, max_cycles=None, context=5, P_mask=P_MASK):
+    """ Run the CPU, comparing it with a log (an iterable of lines),
+    until they diverge, the log ends, or max_cycles have been spent.
+    Returns the CompareSink, which has the number of instructions
+    compared, and the divergence or error, if any. """
+    sink = CompareSink(cpu, read_log(lines), context, P_mask)
+    tracer, cpu.tracer = cpu.tracer, Tracer(sink)
+    try:
+        cpu.run(max_cycles=max_cycles)
+    except NotImplementedError as exception:
+        sink.error = str(exception)
+    finally:
+        cpu.tracer = tracer
+    return sink
+
+def main(arguments=None, output=None):
+    output = output or sys.stdout
+    parser = argparse.ArgumentParser(description="Compare execution with a reference trace.")
+    parser.add_argument('image', help="the program to run")
+    parser.add_argument('log', help="the reference trace (may be gzip, bzip2 or xz compressed)")
+    parser.add_argument('--address', type=lambda value: int(value, 0), default=0x0000,
+                        help="where to load the image (default: 0x0000)")
+    parser.add_argument('--skip', type=int, default=0, help="bytes at the start of the image to skip")
+    parser.add_argument('--length', type=lambda value: int(value, 0),
+                        help="bytes of the image to load (default: the rest of it)")
+    parser.add_argument('--start', type=lambda value: int(value, 0),
+                        help="the initial PC (default: the reset vector)")
+    parser.add_argument('--context', type=int, default=5, help="instructions shown before a divergence")
+    parser.add_argument('--max-cycles', type=int, help="stop after this many cycles")
+    options = parser.parse_args(arguments)
+
+    cpu = CPU()
+    with loader.mapped(options.image) as contents:
+        end = options.skip + options.length if options.length is not None else None
+        with memoryview(contents) as image, image[options.skip:end] as data:
+            if options.address + len(data) > len(cpu.RAM):
+                parser.error(f"{len(data)} bytes don't fit at 0x{options.address:04X} (see --length)")
+            cpu.load(options.address, data)
+    cpu.reset_CPU()
+    if options.start is not None:
+        cpu.PC = options.start
+
+    with open_log(options.log) as log:
+        sink = compare(cpu, log, options.max_cycles, options.context)
+    if sink.divergence is not None:
+        output.write(format_divergence(sink.divergence) + "\n")
+        output.write(f"Diverged after {sink.compared} matching instructions.\n")
+        return 1
+    if sink.error is not None:
+        output.write(f"{sink.compared} instructions match, then: {sink.error}\n")
+        return 2
+    output.write(f"{sink.compared} instructions match.\n")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
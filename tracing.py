@@ -0,0 +1,97 @@
+# py6502: execution tracing.
+#
+# Attach a Tracer to a CPU (cpu.tracer = Tracer(sink, ...)) to record
+# every executed instruction. With cpu.tracer = None (the default),
+# tracing costs one attribute check per instruction.
+
+# pylint: disable=C0103
+
+import struct
+import sys
+from collections import deque, namedtuple
+
+from cpu import INSTRUCTION_NAMES
+
+# The CPU state just before an instruction is executed.
+TraceRecord = namedtuple('TraceRecord', 'PC opcode A X Y SP P ticks')
+
+# Binary trace records: PC, opcode, A, X, Y, SP, P (one byte each,
+# except PC), then ticks. Little-endian, 16 bytes per record.
+BINARY_RECORD = struct.Struct('<HBBBBBBQ')
+
+def format_record(record):
+    """ Format a TraceRecord as a line of text. """
+    name = INSTRUCTION_NAMES.get(record.opcode, '???')
+    return (f"{record.PC:04X}  {record.opcode:02X}  {name:<3}  "
+            f"A:{record.A:02X} X:{record.X:02X} Y:{record.Y:02X} "
+            f"P:{record.P:02X} SP:{record.SP:02X} CYC:{record.ticks}")
+
+def format_memory_write(address, value):
+    """ Format a RAM write as a line of text. """
+    return f"RAM[0x{address:04X}] <- 0x{value & 0xFF:02X}"
+
+def read_binary_trace(stream, chunk_records=4096):
+    """ Read the TraceRecords back from a binary trace, lazily. """
+    size = BINARY_RECORD.size
+    while True:
+        chunk = stream.read(size * chunk_records)
+        if not chunk:
+            return
+        whole = len(chunk) - len(chunk) % size
+        for fields in BINARY_RECORD.iter_unpack(chunk[:whole]):
+            yield TraceRecord(*fields)
+        if whole != len(chunk):
+            raise ValueError("Truncated binary trace record")
+
+class Tracer():
+    """ Collects the state of the CPU before every instruction,
+    and hands it to the sinks. """
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        # Only some sinks care about RAM writes.
+        self.write_sinks = [sink for sink in sinks if getattr(sink, 'memory_writes', False)]
+
+    def instruction(self, cpu, opcode):
+        # SP may have wrapped below 0x00 (or above 0xFF): the stack
+        # pointer is only ever its low byte.
+        record = TraceRecord(cpu.PC, opcode, cpu.A, cpu.X, cpu.Y,
+                             cpu.SP & 0xFF, cpu.read_P(), cpu.ticks)
+        for sink in self.sinks:
+            sink.record(record)
+
+    def memory_write(self, address, value):
+        for sink in self.write_sinks:
+            sink.memory_write(address, value)
+
+class RingBufferSink():
+    """ Keeps the last `size` instructions in memory, for post-mortems. """
+    def __init__(self, size=1024):
+        self.records = deque(maxlen=size)
+
+    def record(self, record):
+        self.records.append(record)
+
+    def dump(self):
+        """ The remembered instructions, as text. """
+        return "\n".join(format_record(record) for record in self.records)
+
+class BinaryTraceSink():
+    """ Writes fixed-size binary records to a file opened in 'wb' mode. """
+    def __init__(self, stream):
+        self.stream = stream
+        self.pack = BINARY_RECORD.pack
+
+    def record(self, record):
+        self.stream.write(self.pack(*record))
+
+class TextSink():
+    """ Writes human-readable lines (by default, to stdout). """
+    def __init__(self, stream=None, memory_writes=True):
+        self.stream = stream if stream is not None else sys.stdout
+        self.memory_writes = memory_writes
+
+    def record(self, record):
+        self.stream.write(format_record(record) + "\n")
+
+    def memory_write(self, address, value):
+        self.stream.write(format_memory_write(address, value) + "\n")